@@ -0,0 +1,228 @@
+# accounting.py
+import contextvars
+import json
+import os
+import subprocess
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+import config
+
+
+# Per-request resource accounting. track_request() puts a RequestUsage in a context
+# variable; code anywhere below it (including run_in_threadpool and hedge threads,
+# which copy the context) adds to it through the module-level helpers, which are
+# no-ops outside a tracked request (e.g. pre-warm jobs).
+
+
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def current_rss() -> int:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+class RequestUsage:
+    def __init__(self, route: str):
+        self.route = route
+        self.started = time.monotonic()
+        self.rss_start = current_rss()
+        self.rss_peak = self.rss_start
+        self.bytes_down = 0
+        self.bytes_up = 0
+        self.subprocess_cpu_seconds = 0.0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.tts_characters = 0
+        self.audio_seconds = 0.0
+        self.stages = {}
+        self.status = "ok"
+        self._lock = threading.Lock()
+
+    def add(self, field: str, amount):
+        with self._lock:
+            setattr(self, field, getattr(self, field) + amount)
+
+    def add_stage(self, name: str, seconds: float):
+        with self._lock:
+            self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def sample_rss(self):
+        rss = current_rss()
+        with self._lock:
+            self.rss_peak = max(self.rss_peak, rss)
+
+    def summary(self) -> dict:
+        with self._lock:
+            return {
+                "route": self.route,
+                "status": self.status,
+                "wall_ms": round(1000 * (time.monotonic() - self.started), 1),
+                # Process-wide RSS: concurrent requests in the same worker are included
+                "peak_rss_delta_bytes": max(self.rss_peak - self.rss_start, 0),
+                "bytes_down": self.bytes_down,
+                "bytes_up": self.bytes_up,
+                "subprocess_cpu_ms": round(1000 * self.subprocess_cpu_seconds, 1),
+                "prompt_tokens": self.prompt_tokens,
+                "completion_tokens": self.completion_tokens,
+                "tts_characters": self.tts_characters,
+                "audio_seconds": round(self.audio_seconds, 2),
+                "stages_ms": {name: round(1000 * seconds, 1) for name, seconds in self.stages.items()},
+            }
+
+
+_usage: contextvars.ContextVar[Optional[RequestUsage]] = contextvars.ContextVar("request_usage", default=None)
+_active = set()
+_active_lock = threading.Lock()
+_sampler_pid = None
+
+
+def _sample_loop():
+    # One thread per worker samples RSS for every tracked request, so short
+    # allocation peaks between stage boundaries are still seen
+    while True:
+        time.sleep(config.ACCOUNTING_RSS_SAMPLE_SECONDS)
+        with _active_lock:
+            active = list(_active)
+        for usage in active:
+            usage.sample_rss()
+
+
+def _ensure_sampler():
+    # Threads do not survive a fork: start one per worker process
+    global _sampler_pid
+    if _sampler_pid != os.getpid():
+        _sampler_pid = os.getpid()
+        threading.Thread(target=_sample_loop, name="rss-sampler", daemon=True).start()
+
+
+@contextmanager
+def track_request(route: str):
+    """Account resources used while serving one request; logs a JSON summary on exit"""
+    usage = RequestUsage(route)
+    token = _usage.set(usage)
+    with _active_lock:
+        _active.add(usage)
+        _ensure_sampler()
+    try:
+        yield usage
+    except BaseException as e:
+        usage.status = f"error:{getattr(e, 'status_code', type(e).__name__)}"
+        raise
+    finally:
+        usage.sample_rss()
+        with _active_lock:
+            _active.discard(usage)
+        _usage.reset(token)
+        print(json.dumps({"event": "request_usage", **usage.summary()}))
+
+
+def current_usage() -> Optional[RequestUsage]:
+    return _usage.get()
+
+
+def usage_header(usage: RequestUsage) -> dict:
+    """Response headers carrying the usage summary, when enabled"""
+    if not config.ACCOUNTING_RESPONSE_HEADER:
+        return {}
+    return {"X-Request-Usage": json.dumps(usage.summary(), separators=(",", ":"))}
+
+
+def add_bytes_down(count: int):
+    usage = _usage.get()
+    if usage is not None:
+        usage.add("bytes_down", count)
+        usage.sample_rss()
+
+
+def add_bytes_up(count: int):
+    usage = _usage.get()
+    if usage is not None:
+        usage.add("bytes_up", count)
+
+
+def add_audio_seconds(seconds):
+    usage = _usage.get()
+    if usage is not None and seconds:
+        usage.add("audio_seconds", float(seconds))
+
+
+def add_tts_characters(count: int):
+    usage = _usage.get()
+    if usage is not None:
+        usage.add("tts_characters", count)
+
+
+def record_openai_usage(result):
+    """Prompt/completion tokens from an OpenAI response object, if it reports usage"""
+    usage = _usage.get()
+    response_usage = getattr(result, "usage", None)
+    if usage is None or response_usage is None:
+        return
+    usage.add("prompt_tokens", getattr(response_usage, "prompt_tokens", None) or 0)
+    usage.add("completion_tokens", getattr(response_usage, "completion_tokens", None) or 0)
+
+
+@contextmanager
+def stage(name: str):
+    """Wall time of a pipeline stage; repeated or concurrent stages of one name add up"""
+    usage = _usage.get()
+    started = time.monotonic()
+    try:
+        yield
+    finally:
+        if usage is not None:
+            usage.add_stage(name, time.monotonic() - started)
+            usage.sample_rss()
+
+
+def run_subprocess(args, check: bool = False, timeout: Optional[float] = None) -> subprocess.CompletedProcess:
+    """subprocess.run() with captured text output that also charges the child's CPU time.
+
+    The child is reaped with os.wait4() so its own rusage is available, unlike
+    RUSAGE_CHILDREN which mixes every request of the worker.
+    """
+    with tempfile.TemporaryFile() as stdout, tempfile.TemporaryFile() as stderr:
+        process = subprocess.Popen(args, stdin=subprocess.DEVNULL, stdout=stdout, stderr=stderr)
+        timed_out = threading.Event()
+
+        def kill():
+            timed_out.set()
+            process.kill()
+
+        timer = threading.Timer(timeout, kill) if timeout else None
+        if timer:
+            timer.start()
+        try:
+            _, status, rusage = os.wait4(process.pid, 0)
+            # Mark the child reaped before the timer can signal a possibly reused pid
+            process.returncode = os.waitstatus_to_exitcode(status)
+        finally:
+            if timer:
+                timer.cancel()
+
+        usage = _usage.get()
+        if usage is not None:
+            usage.add("subprocess_cpu_seconds", rusage.ru_utime + rusage.ru_stime)
+
+        if timed_out.is_set():
+            raise subprocess.TimeoutExpired(args, timeout)
+
+        stdout.seek(0)
+        stderr.seek(0)
+        result = subprocess.CompletedProcess(
+            args,
+            process.returncode,
+            stdout.read().decode("utf-8", errors="replace"),
+            stderr.read().decode("utf-8", errors="replace")
+        )
+    if check:
+        result.check_returncode()
+    return result
@@ -0,0 +1,118 @@
+# admission.py
+import asyncio
+import math
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+
+from fastapi import HTTPException
+
+import config
+
+
+class AdmissionController:
+    """Per-route concurrency cap with a bounded, time-limited wait queue, per worker process.
+
+    Requests beyond `max_concurrent` wait for a slot; once `max_queue` are already
+    waiting, or a wait exceeds `queue_timeout`, the request is rejected with 429 and
+    a Retry-After estimate instead of piling more work onto the worker.
+    """
+
+    def __init__(self, name: str, max_concurrent: int, max_queue: int, queue_timeout: float):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._semaphore = None
+        self.active = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected = 0
+        self._wait_times = deque(maxlen=200)
+        self._service_times = deque(maxlen=200)
+
+    def _get_semaphore(self):
+        # Created lazily so it binds to the running event loop of this worker
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrent)
+        return self._semaphore
+
+    def retry_after(self) -> int:
+        """Seconds until a slot is likely free, from recent service times"""
+        if self._service_times:
+            avg_service = sum(self._service_times) / len(self._service_times)
+        else:
+            avg_service = self.queue_timeout
+        backlog = (self.waiting + 1) / max(self.max_concurrent, 1)
+        return max(1, math.ceil(avg_service * backlog))
+
+    def _reject(self, reason: str):
+        self.rejected += 1
+        retry_after = self.retry_after()
+        print(f"Admission [{self.name}] rejected request: {reason}")
+        raise HTTPException(
+            status_code=429,
+            detail=f"Server busy ({reason}). Please retry later.",
+            headers={"Retry-After": str(retry_after)}
+        )
+
+    @asynccontextmanager
+    async def admit(self):
+        semaphore = self._get_semaphore()
+        if semaphore.locked() and self.waiting >= self.max_queue:
+            self._reject("queue full")
+
+        self.waiting += 1
+        queued_at = time.monotonic()
+        try:
+            await asyncio.wait_for(semaphore.acquire(), timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            self._reject("queue wait timed out")
+        finally:
+            self.waiting -= 1
+
+        started_at = time.monotonic()
+        self._wait_times.append(started_at - queued_at)
+        self.active += 1
+        self.admitted += 1
+        try:
+            yield
+        finally:
+            self.active -= 1
+            self._service_times.append(time.monotonic() - started_at)
+            semaphore.release()
+
+    def stats(self) -> dict:
+        waits = sorted(self._wait_times)
+        return {
+            "active": self.active,
+            "waiting": self.waiting,
+            "max_concurrent": self.max_concurrent,
+            "max_queue": self.max_queue,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "avg_wait_ms": round(1000 * sum(waits) / len(waits), 1) if waits else 0.0,
+            "p95_wait_ms": round(1000 * waits[int(0.95 * (len(waits) - 1))], 1) if waits else 0.0,
+            "wait_samples": len(waits),
+        }
+
+
+admission_controllers = {
+    "generate": AdmissionController(
+        "generate",
+        config.GENERATE_MAX_CONCURRENCY,
+        config.GENERATE_MAX_QUEUE,
+        config.ADMISSION_QUEUE_TIMEOUT_SECONDS
+    ),
+    "evaluate": AdmissionController(
+        "evaluate",
+        config.EVALUATE_MAX_CONCURRENCY,
+        config.EVALUATE_MAX_QUEUE,
+        config.ADMISSION_QUEUE_TIMEOUT_SECONDS
+    ),
+}
+
+
+def admission_stats() -> dict:
+    """This worker's figures only; worker_metrics aggregates them across workers"""
+    return {name: controller.stats() for name, controller in admission_controllers.items()}
@@ -0,0 +1,66 @@
+# bench_cold_start.py
+"""Measure cold-start latency: importing the app and warming its dependencies.
+
+Usage: python bench_cold_start.py [runs]
+Each run is a fresh interpreter so module caches do not hide import cost.
+"""
+import statistics
+import subprocess
+import sys
+
+IMPORT_SNIPPET = """
+import time
+start = time.perf_counter()
+import main
+imported = time.perf_counter()
+main.warm_up()
+warmed = time.perf_counter()
+print(f"{(imported - start) * 1000:.1f} {(warmed - imported) * 1000:.1f}")
+"""
+
+
+def run_once():
+    result = subprocess.run(
+        [sys.executable, "-c", IMPORT_SNIPPET],
+        capture_output=True,
+        text=True,
+        check=True
+    )
+    import_ms, warm_ms = result.stdout.strip().splitlines()[-1].split()
+    return float(import_ms), float(warm_ms)
+
+
+def slowest_imports(limit=10):
+    """Top modules by cumulative import time, from python -X importtime"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"],
+        capture_output=True,
+        text=True,
+        check=True
+    )
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, module = line[len("import time:"):].split("|")
+        rows.append((int(cumulative), module.strip()))
+    return sorted(rows, reverse=True)[:limit]
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    samples = [run_once() for _ in range(runs)]
+    import_times = [s[0] for s in samples]
+    warm_times = [s[1] for s in samples]
+
+    print(f"import main: median {statistics.median(import_times):.1f} ms, "
+          f"min {min(import_times):.1f} ms over {runs} runs")
+    print(f"warm_up():   median {statistics.median(warm_times):.1f} ms, "
+          f"min {min(warm_times):.1f} ms")
+    print("Slowest imports (cumulative us):")
+    for cumulative, module in slowest_imports():
+        print(f"  {cumulative:>9}  {module}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+# cache.py
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Optional
+
+import config
+
+
+# Shared key/value cache for rubrics, PDF text, transcriptions and generated audio.
+# The default backend is an on-disk SQLite file so every worker process in the
+# container sees the same entries; CACHE_URL=redis://... switches to Redis.
+
+
+def make_key(*parts) -> str:
+    return hashlib.sha256("\x1f".join(str(p) for p in parts).encode("utf-8")).hexdigest()
+
+
+class SQLiteCache:
+    def __init__(self, path: str, max_entries: int):
+        self.path = path
+        self.max_entries = max_entries
+        self._local = threading.local()
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                "namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, "
+                "expires_at REAL, accessed_at REAL NOT NULL, PRIMARY KEY (namespace, key))"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS cache_accessed ON cache (namespace, accessed_at)")
+
+    def _connect(self):
+        # One connection per thread and per process: connections must not cross a fork
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, namespace: str, key: str):
+        conn = self._connect()
+        now = time.time()
+        row = conn.execute(
+            "SELECT value, expires_at FROM cache WHERE namespace = ? AND key = ?", (namespace, key)
+        ).fetchone()
+        if row is None:
+            return None
+        if row[1] is not None and row[1] < now:
+            conn.execute("DELETE FROM cache WHERE namespace = ? AND key = ?", (namespace, key))
+            return None
+        conn.execute("UPDATE cache SET accessed_at = ? WHERE namespace = ? AND key = ?", (now, namespace, key))
+        return json.loads(row[0])
+
+    def set(self, namespace: str, key: str, value, ttl: Optional[float] = None):
+        conn = self._connect()
+        now = time.time()
+        conn.execute(
+            "INSERT OR REPLACE INTO cache (namespace, key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+            (namespace, key, json.dumps(value, ensure_ascii=False), now + ttl if ttl else None, now)
+        )
+        self._evict(conn, namespace)
+
+    def _evict(self, conn, namespace):
+        """Keep each namespace at max_entries, dropping the least recently used"""
+        conn.execute(
+            "DELETE FROM cache WHERE namespace = ? AND key IN ("
+            "SELECT key FROM cache WHERE namespace = ? ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+            (namespace, namespace, self.max_entries)
+        )
+
+    def delete(self, namespace: str, key: str):
+        self._connect().execute("DELETE FROM cache WHERE namespace = ? AND key = ?", (namespace, key))
+
+    def clear(self, namespace: str):
+        self._connect().execute("DELETE FROM cache WHERE namespace = ?", (namespace,))
+
+    def values(self, namespace: str) -> list:
+        rows = self._connect().execute(
+            "SELECT value FROM cache WHERE namespace = ? AND (expires_at IS NULL OR expires_at >= ?)",
+            (namespace, time.time())
+        ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+
+class RedisCache:
+    def __init__(self, url: str, max_entries: int):
+        import redis  # optional dependency, only needed for the Redis backend
+
+        self._redis = redis.Redis.from_url(url)
+        self.max_entries = max_entries
+
+    def _key(self, namespace, key):
+        return f"cache:{namespace}:{key}"
+
+    def get(self, namespace: str, key: str):
+        value = self._redis.get(self._key(namespace, key))
+        if value is None:
+            return None
+        self._redis.zadd(f"cache_lru:{namespace}", {key: time.time()})
+        return json.loads(value)
+
+    def set(self, namespace: str, key: str, value, ttl: Optional[float] = None):
+        self._redis.set(self._key(namespace, key), json.dumps(value, ensure_ascii=False),
+                        ex=int(ttl) if ttl else None)
+        lru_key = f"cache_lru:{namespace}"
+        self._redis.zadd(lru_key, {key: time.time()})
+        overflow = self._redis.zcard(lru_key) - self.max_entries
+        if overflow > 0:
+            for stale in self._redis.zrange(lru_key, 0, overflow - 1):
+                stale = stale.decode() if isinstance(stale, bytes) else stale
+                self._redis.delete(self._key(namespace, stale))
+            self._redis.zremrangebyrank(lru_key, 0, overflow - 1)
+
+    def delete(self, namespace: str, key: str):
+        self._redis.delete(self._key(namespace, key))
+        self._redis.zrem(f"cache_lru:{namespace}", key)
+
+    def clear(self, namespace: str):
+        for key in self._redis.scan_iter(match=self._key(namespace, "*")):
+            self._redis.delete(key)
+        self._redis.delete(f"cache_lru:{namespace}")
+
+    def values(self, namespace: str) -> list:
+        keys = list(self._redis.scan_iter(match=self._key(namespace, "*")))
+        if not keys:
+            return []
+        return [json.loads(value) for value in self._redis.mget(keys) if value is not None]
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_cache():
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                if config.CACHE_URL.startswith("redis://") or config.CACHE_URL.startswith("rediss://"):
+                    _backend = RedisCache(config.CACHE_URL, config.CACHE_MAX_ENTRIES)
+                else:
+                    _backend = SQLiteCache(config.CACHE_URL.replace("sqlite:///", "", 1), config.CACHE_MAX_ENTRIES)
+    return _backend
+
+
+def cache_get(namespace: str, key: str) -> Optional[Any]:
+    """Return the cached value or None; cache failures never fail the request"""
+    try:
+        return get_cache().get(namespace, key)
+    except Exception as e:
+        print(f"Cache read failed ({namespace}): {e}")
+        return None
+
+
+def cache_set(namespace: str, key: str, value, ttl: Optional[float] = None):
+    if ttl is None:
+        ttl = config.CACHE_TTL_SECONDS
+    try:
+        get_cache().set(namespace, key, value, ttl)
+    except Exception as e:
+        print(f"Cache write failed ({namespace}): {e}")
+
+
+def cache_delete(namespace: str, key: str):
+    try:
+        get_cache().delete(namespace, key)
+    except Exception as e:
+        print(f"Cache delete failed ({namespace}): {e}")
+
+
+def cache_clear(namespace: str):
+    try:
+        get_cache().clear(namespace)
+    except Exception as e:
+        print(f"Cache clear failed ({namespace}): {e}")
+
+
+def cache_values(namespace: str) -> list:
+    """Every live entry of a namespace; meant for small namespaces such as worker snapshots"""
+    try:
+        return get_cache().values(namespace)
+    except Exception as e:
+        print(f"Cache scan failed ({namespace}): {e}")
+        return []
@@ -1,17 +1,18 @@
 import os
-from pathlib import Path
+from dataclasses import dataclass
+from functools import lru_cache
 from dotenv import load_dotenv
-import sys
 
-# Load environment variables
-load_dotenv()
+# Load environment variables (once, for every module)
+try:
+    load_dotenv()
+except Exception as e:
+    print(f"Warning: Could not load .env file: {e}")
 
 # OpenAI Configuration
-OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
-if not OPENAI_API_KEY or not OPENAI_API_KEY.startswith('sk-'):
-    raise ValueError("Invalid OpenAI API key format")
-
 OPENAI_TTS_MODEL = "tts-1"
+# TTS output codec: mp3 (default), or opus / aac, which are much smaller at speech bitrates
+OPENAI_TTS_RESPONSE_FORMAT = os.getenv('OPENAI_TTS_RESPONSE_FORMAT', 'mp3').lower()
 # Voice mapping for different speakers
 OPENAI_VOICES = {
     "speaker1": "echo",    # Male voice 1
@@ -25,27 +26,144 @@ OPENAI_TRANSCRIBE_MODEL = "whisper-1"
 
 OPENAI_CHAT_MODEL = "gpt-3.5-turbo"
 
-# ADD THESE CLOUDINARY VARIABLES
-CLOUDINARY_CLOUD_NAME = os.getenv('CLOUDINARY_CLOUD_NAME')
-CLOUDINARY_API_KEY = os.getenv('CLOUDINARY_API_KEY')
-CLOUDINARY_API_SECRET = os.getenv('CLOUDINARY_API_SECRET')
-
-
+# Grading Configuration
+OPENAI_GRADING_MODEL = "gpt-4-turbo"
+# Max tokens of rubric instructions sent alongside the transcript in one grading call
+GRADING_INSTRUCTION_TOKEN_BUDGET = int(os.getenv('GRADING_INSTRUCTION_TOKEN_BUDGET', '1500'))
+# 'single': one structured-output call for rubrics that fit, chunked calls otherwise; 'chunked': always chunk
+GRADING_MODE = os.getenv('GRADING_MODE', 'single').lower()
+# Strict json_schema output needs a model with Structured Outputs support
+OPENAI_STRUCTURED_GRADING_MODEL = os.getenv('OPENAI_STRUCTURED_GRADING_MODEL', 'gpt-4o')
+GRADING_SINGLE_CALL_MAX_PROMPT_TOKENS = int(os.getenv('GRADING_SINGLE_CALL_MAX_PROMPT_TOKENS', '20000'))
+GRADING_SINGLE_CALL_MAX_INSTRUCTIONS = int(os.getenv('GRADING_SINGLE_CALL_MAX_INSTRUCTIONS', '40'))
+
+# OpenAI Resilience
+# Whole-request budget; clients may shorten it with an X-Request-Timeout header (seconds)
+REQUEST_DEADLINE_SECONDS = float(os.getenv('REQUEST_DEADLINE_SECONDS', '240'))
+OPENAI_CALL_TIMEOUT_SECONDS = float(os.getenv('OPENAI_CALL_TIMEOUT_SECONDS', '90'))
+OPENAI_MAX_ATTEMPTS = int(os.getenv('OPENAI_MAX_ATTEMPTS', '2'))
+OPENAI_RETRY_BACKOFF_SECONDS = float(os.getenv('OPENAI_RETRY_BACKOFF_SECONDS', '1'))
+# Hedging sends a duplicate idempotent request once the first is slower than the percentile
+OPENAI_HEDGING_ENABLED = os.getenv('OPENAI_HEDGING_ENABLED', 'false').lower() == 'true'
+OPENAI_HEDGE_PERCENTILE = float(os.getenv('OPENAI_HEDGE_PERCENTILE', '95'))
+OPENAI_HEDGE_MIN_SAMPLES = int(os.getenv('OPENAI_HEDGE_MIN_SAMPLES', '20'))
+OPENAI_HEDGE_MAX_WORKERS = int(os.getenv('OPENAI_HEDGE_MAX_WORKERS', '16'))
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv('CIRCUIT_FAILURE_THRESHOLD', '5'))
+CIRCUIT_COOLDOWN_SECONDS = float(os.getenv('CIRCUIT_COOLDOWN_SECONDS', '30'))
+
+# Grading report cache: bump GRADING_CACHE_VERSION to invalidate all cached reports
+GRADING_CACHE_VERSION = os.getenv('GRADING_CACHE_VERSION', '1')
+GRADING_CACHE_TTL_SECONDS = float(os.getenv('GRADING_CACHE_TTL_SECONDS', str(30 * 24 * 3600)))
+
+# OpenAI Rate Limits (requests / tokens per minute, per model)
+OPENAI_RATE_LIMITS = {
+    "gpt-4-turbo": {"rpm": int(os.getenv('GPT4_TURBO_RPM', '500')), "tpm": int(os.getenv('GPT4_TURBO_TPM', '30000'))},
+    "gpt-4o": {"rpm": int(os.getenv('GPT4O_RPM', '500')), "tpm": int(os.getenv('GPT4O_TPM', '30000'))},
+    "gpt-3.5-turbo": {"rpm": int(os.getenv('GPT35_TURBO_RPM', '3500')), "tpm": int(os.getenv('GPT35_TURBO_TPM', '200000'))},
+    "tts-1": {"rpm": int(os.getenv('TTS_RPM', '50'))},
+    "whisper-1": {"rpm": int(os.getenv('WHISPER_RPM', '50'))},
+}
+# Expected completion size added to the prompt estimate when reserving chat tokens
+OPENAI_COMPLETION_TOKEN_ESTIMATE = 1000
+RATE_LIMIT_MAX_WAIT_SECONDS = float(os.getenv('RATE_LIMIT_MAX_WAIT_SECONDS', '120'))
+RATE_LIMIT_MAX_RETRIES = int(os.getenv('RATE_LIMIT_MAX_RETRIES', '5'))
+# Optional redis:// URL so every worker shares one budget (requires the redis package)
+RATE_LIMIT_REDIS_URL = os.getenv('RATE_LIMIT_REDIS_URL')
+
+# Database Pool Configuration
+DB_POOL_MIN_SIZE = int(os.getenv('DB_POOL_MIN_SIZE', '1'))
+DB_POOL_MAX_SIZE = int(os.getenv('DB_POOL_MAX_SIZE', '10'))
+DB_POOL_TIMEOUT_SECONDS = float(os.getenv('DB_POOL_TIMEOUT_SECONDS', '10'))
+# Connections idle longer than this are pinged with SELECT 1 before reuse
+DB_POOL_HEALTHCHECK_IDLE_SECONDS = float(os.getenv('DB_POOL_HEALTHCHECK_IDLE_SECONDS', '30'))
+
+# Write-behind Persistence
+# "postgres" (uses DATABASE_URL) or "sqlite:///path/to.db" as a local stand-in
+WRITE_BEHIND_BACKEND = os.getenv('WRITE_BEHIND_BACKEND', 'postgres')
+WRITE_BEHIND_BATCH_SIZE = int(os.getenv('WRITE_BEHIND_BATCH_SIZE', '100'))
+WRITE_BEHIND_FLUSH_INTERVAL_SECONDS = float(os.getenv('WRITE_BEHIND_FLUSH_INTERVAL_SECONDS', '2'))
+WRITE_BEHIND_JOURNAL_PATH = os.getenv('WRITE_BEHIND_JOURNAL_PATH', 'logs/write_behind.jsonl')
+# userId/scenarioId are checked with one SELECT before a submission is queued; hits are cached
+SUBMISSION_REFERENCE_CACHE_SECONDS = float(os.getenv('SUBMISSION_REFERENCE_CACHE_SECONDS', '600'))
+
+# Shared Cache (rubrics, PDF text, transcriptions, generated audio)
+# "sqlite:///path" is shared by all workers on one host; "redis://..." across hosts
+CACHE_URL = os.getenv('CACHE_URL', 'sqlite:///cache/app_cache.db')
+CACHE_MAX_ENTRIES = int(os.getenv('CACHE_MAX_ENTRIES', '10000'))
+CACHE_TTL_SECONDS = float(os.getenv('CACHE_TTL_SECONDS', str(7 * 24 * 3600)))
+# URL-keyed entries include the file's ETag/Last-Modified (one HEAD per URL, memoized
+# briefly); without a validator they expire quickly so a re-upload is picked up
+URL_CACHE_UNVALIDATED_TTL_SECONDS = float(os.getenv('URL_CACHE_UNVALIDATED_TTL_SECONDS', '300'))
+URL_VALIDATOR_TIMEOUT_SECONDS = float(os.getenv('URL_VALIDATOR_TIMEOUT_SECONDS', '5'))
+URL_VALIDATOR_MEMO_SECONDS = float(os.getenv('URL_VALIDATOR_MEMO_SECONDS', '10'))
+
+# Scenario Pre-warming
+PREWARM_MAX_WORKERS = int(os.getenv('PREWARM_MAX_WORKERS', '2'))
+PREWARM_MAX_BATCH = int(os.getenv('PREWARM_MAX_BATCH', '100'))
+PREWARM_JOB_TTL_SECONDS = float(os.getenv('PREWARM_JOB_TTL_SECONDS', str(24 * 3600)))
+
+# Pre-flight Validation (runs before any OpenAI call)
+AUDIO_MAX_DOWNLOAD_MB = float(os.getenv('AUDIO_MAX_DOWNLOAD_MB', '25'))
+DOWNLOAD_CHUNK_BYTES = int(os.getenv('DOWNLOAD_CHUNK_BYTES', str(64 * 1024)))
+AUDIO_MIN_SECONDS = float(os.getenv('AUDIO_MIN_SECONDS', '1'))
+AUDIO_MAX_SECONDS = float(os.getenv('AUDIO_MAX_SECONDS', '1200'))
+AUDIO_SILENCE_THRESHOLD_DB = float(os.getenv('AUDIO_SILENCE_THRESHOLD_DB', '-50'))
+PDF_MAX_SIZE_MB = float(os.getenv('PDF_MAX_SIZE_MB', '5'))
+PDF_MAX_PAGES = int(os.getenv('PDF_MAX_PAGES', '30'))
+PDF_MIN_CHARS_PER_PAGE = int(os.getenv('PDF_MIN_CHARS_PER_PAGE', '50'))
+MIN_TRANSCRIPT_WORDS = int(os.getenv('MIN_TRANSCRIPT_WORDS', '3'))
+PREFLIGHT_LANGUAGES = [lang.strip() for lang in os.getenv('PREFLIGHT_LANGUAGES', 'en').split(',') if lang.strip()]
+PREFLIGHT_LANGUAGE_MIN_PROB = float(os.getenv('PREFLIGHT_LANGUAGE_MIN_PROB', '0.9'))
+PREFLIGHT_LANGDETECT_MIN_CHARS = int(os.getenv('PREFLIGHT_LANGDETECT_MIN_CHARS', '40'))
+PREFLIGHT_LANGDETECT_MAX_CHARS = int(os.getenv('PREFLIGHT_LANGDETECT_MAX_CHARS', '5000'))
+PREFLIGHT_PROBE_TIMEOUT_SECONDS = float(os.getenv('PREFLIGHT_PROBE_TIMEOUT_SECONDS', '10'))
+
+# Admission Control (per worker): concurrent requests, waiting requests, max wait
+GENERATE_MAX_CONCURRENCY = int(os.getenv('GENERATE_MAX_CONCURRENCY', '2'))
+GENERATE_MAX_QUEUE = int(os.getenv('GENERATE_MAX_QUEUE', '8'))
+EVALUATE_MAX_CONCURRENCY = int(os.getenv('EVALUATE_MAX_CONCURRENCY', '4'))
+EVALUATE_MAX_QUEUE = int(os.getenv('EVALUATE_MAX_QUEUE', '16'))
+ADMISSION_QUEUE_TIMEOUT_SECONDS = float(os.getenv('ADMISSION_QUEUE_TIMEOUT_SECONDS', '30'))
+
+# Worker Metrics: each worker publishes admission/breaker snapshots to the shared cache
+METRICS_PUBLISH_SECONDS = float(os.getenv('METRICS_PUBLISH_SECONDS', '5'))
+METRICS_SNAPSHOT_TTL_SECONDS = float(os.getenv('METRICS_SNAPSHOT_TTL_SECONDS', '15'))
+
+# Scratch Space: per-request working files; small ones on tmpfs, the rest on the audio_files volume
+SCRATCH_DISK_DIR = os.getenv('SCRATCH_DISK_DIR', 'audio_files')
+SCRATCH_MEMORY_DIR = os.getenv('SCRATCH_MEMORY_DIR', '/dev/shm/speech-scratch')
+SCRATCH_MEMORY_FILE_MAX_BYTES = int(os.getenv('SCRATCH_MEMORY_FILE_MAX_BYTES', str(8 * 1024 * 1024)))
+SCRATCH_MEMORY_MAX_BYTES = int(os.getenv('SCRATCH_MEMORY_MAX_BYTES', str(48 * 1024 * 1024)))
+SCRATCH_DISK_MAX_BYTES = int(os.getenv('SCRATCH_DISK_MAX_BYTES', str(2 * 1024 * 1024 * 1024)))
+SCRATCH_ORPHAN_AGE_SECONDS = float(os.getenv('SCRATCH_ORPHAN_AGE_SECONDS', '3600'))
+
+# Per-request accounting: RSS sampling interval; X-Request-Usage response header on/off
+ACCOUNTING_RSS_SAMPLE_SECONDS = float(os.getenv('ACCOUNTING_RSS_SAMPLE_SECONDS', '0.05'))
+ACCOUNTING_RESPONSE_HEADER = os.getenv('ACCOUNTING_RESPONSE_HEADER', 'false').lower() in ('1', 'true', 'yes')
+
+# Streaming evaluation: keep-alive comment interval while no event is ready
+SSE_HEARTBEAT_SECONDS = float(os.getenv('SSE_HEARTBEAT_SECONDS', '15'))
 
 # API Configuration
 API_HOST = "0.0.0.0"
 API_PORT = 8000
+# Import heavy dependencies and build clients in the background right after startup
+WARM_UP_ON_STARTUP = os.getenv('WARM_UP_ON_STARTUP', 'true').lower() == 'true'
 
 
+@dataclass(frozen=True)
+class Settings:
+    """Secrets and connection strings, validated once"""
+    openai_api_key: str
+    database_url: str
+    cloudinary_cloud_name: str
+    cloudinary_api_key: str
+    cloudinary_api_secret: str
 
-# Load environment variables with error handling
-try:
-    load_dotenv()
-except Exception as e:
-    print(f"Warning: Could not load .env file: {e}")
 
-# Validate critical environment variables
-def validate_environment():
+@lru_cache(maxsize=1)
+def get_settings() -> Settings:
+    """Read and validate critical environment variables; raises on the first call if any are missing"""
     required_vars = [
         'OPENAI_API_KEY',
         'DATABASE_URL',
@@ -54,22 +172,18 @@ def validate_environment():
         'CLOUDINARY_API_SECRET'
     ]
     
-    missing_vars = []
-    for var in required_vars:
-        if not os.getenv(var):
-            missing_vars.append(var)
-    
+    missing_vars = [var for var in required_vars if not os.getenv(var)]
     if missing_vars:
-        print(f"Error: Missing required environment variables: {', '.join(missing_vars)}")
-        sys.exit(1)
-
-# Call validation on import
-validate_environment()
-
-
-
-
-
-
-
-
+        raise RuntimeError(f"Missing required environment variables: {', '.join(missing_vars)}")
+
+    openai_api_key = os.getenv('OPENAI_API_KEY')
+    if not openai_api_key.startswith('sk-'):
+        raise RuntimeError("Invalid OpenAI API key format")
+
+    return Settings(
+        openai_api_key=openai_api_key,
+        database_url=os.getenv('DATABASE_URL'),
+        cloudinary_cloud_name=os.getenv('CLOUDINARY_CLOUD_NAME'),
+        cloudinary_api_key=os.getenv('CLOUDINARY_API_KEY'),
+        cloudinary_api_secret=os.getenv('CLOUDINARY_API_SECRET'),
+    )
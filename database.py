@@ -1,110 +1,213 @@
 # ===================================
 # database.py
-import psycopg2
-from psycopg2.extras import RealDictCursor
 import os
-from dotenv import load_dotenv
-import cloudinary
-import cloudinary.uploader
 import config
-from uuid import uuid4
 
 import time
 from typing import Optional, List, Dict, Any
 import uuid
 
-from psycopg2 import Binary, IntegrityError
-
-
-
-load_dotenv()
-
-# Configure Cloudinary
-cloudinary.config(
-    cloud_name=config.CLOUDINARY_CLOUD_NAME,
-    api_key=config.CLOUDINARY_API_KEY,
-    api_secret=config.CLOUDINARY_API_SECRET
-)
-
-# DATABASE_URL = os.getenv('DATABASE_URL')
-
-# def get_database_connection(max_retries=3, retry_delay=1):
-#     for attempt in range(max_retries):
-#         try:
-#             conn = psycopg2.connect(
-#                 DATABASE_URL,
-#                 connect_timeout=10,
-#                 application_name="legal_advocacy_api"
-#             )
-#             return conn
-#         except psycopg2.OperationalError as e:
-#             if attempt < max_retries - 1:
-#                 time.sleep(retry_delay * (2 ** attempt))  # Exponential backoff
-#                 continue
-#             print(f"Database connection failed after {max_retries} attempts: {e}")
-#             return None
-#         except Exception as e:
-#             print(f"Unexpected database error: {e}")
-#             return None
-        
+import threading
+from contextlib import contextmanager
+from functools import lru_cache
 
-# def get_data_from_db(query: str, params: Optional[tuple] = None) -> Optional[List[Dict]]:
-#     if not query.strip():
-#         raise ValueError("Query cannot be empty")
-    
-#     conn = get_database_connection()
-#     if not conn:
-#         return None
-    
-#     try:
-#         with conn.cursor(cursor_factory=RealDictCursor) as cursor:
-#             cursor.execute(query, params)
-#             data = cursor.fetchall()
-#             return [dict(row) for row in data]
-#     except psycopg2.Error as e:
-#         print(f"Database query error: {e}")
-#         return None
-#     except Exception as e:
-#         print(f"Unexpected error in get_data_from_db: {e}")
-#         return None
-#     finally:
-#         conn.close()
+# psycopg2 and cloudinary are imported on first use to keep application start-up cheap
 
 
+@lru_cache(maxsize=1)
+def configure_cloudinary():
+    import cloudinary
 
-# def upload_data_to_db(query: str, params: Optional[tuple] = None) -> bool:
-#     if not query.strip():
-#         raise ValueError("Query cannot be empty")
-    
-#     conn = get_database_connection()
-#     if not conn:
-#         return False
+    settings = config.get_settings()
+    cloudinary.config(
+        cloud_name=settings.cloudinary_cloud_name,
+        api_key=settings.cloudinary_api_key,
+        api_secret=settings.cloudinary_api_secret
+    )
+
+
+@lru_cache(maxsize=1)
+def _pooled_connection_class():
+    import psycopg2.extensions
+
+    class PooledConnection(psycopg2.extensions.connection):
+        """Connection that remembers which statements it has prepared and when it was last used"""
+
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.prepared_statements = set()
+            self.last_used = time.monotonic()
+
+    return PooledConnection
+
+
+# Statements prepared once per pooled connection and run with EXECUTE; the write-behind
+# queue uses them for rows it has to write one at a time
+PREPARED_STATEMENTS = {
+    "upsert_reference_audio": """
+    INSERT INTO reference_audio ("id", "audioScenarioId", "audioUrl", "fileFormate", "size", "createdAt") 
+    VALUES ($1, $2, $3, $4, $5, $6)
+    ON CONFLICT ("audioScenarioId") DO UPDATE SET 
+        "audioUrl" = EXCLUDED."audioUrl", 
+        "fileFormate" = EXCLUDED."fileFormate",
+        "size" = EXCLUDED."size",
+        "createdAt" = EXCLUDED."createdAt"
+    """,
+    "insert_submission": """
+    INSERT INTO "Submission" 
+    ("id", "userId", "scenarioId", "totalScore", "positive", "negative", "improvement", "status", "createdAt", "updatedAt") 
+    VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10) 
+    """,
+}
+
+_pool = None
+_pool_slots = None
+_pool_lock = threading.Lock()
+
+
+def get_connection_pool():
+    global _pool, _pool_slots
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                from psycopg2.pool import ThreadedConnectionPool
+
+                _pool = ThreadedConnectionPool(
+                    config.DB_POOL_MIN_SIZE,
+                    config.DB_POOL_MAX_SIZE,
+                    config.get_settings().database_url,
+                    connect_timeout=10,
+                    application_name="legal_advocacy_api",
+                    connection_factory=_pooled_connection_class()
+                )
+                # ThreadedConnectionPool raises when exhausted; the semaphore makes callers wait instead
+                _pool_slots = threading.BoundedSemaphore(config.DB_POOL_MAX_SIZE)
+    return _pool
+
+
+def close_connection_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.closeall()
+            _pool = None
+
+
+def _is_healthy(conn) -> bool:
+    import psycopg2
+
+    if conn.closed:
+        return False
+    if time.monotonic() - conn.last_used < config.DB_POOL_HEALTHCHECK_IDLE_SECONDS:
+        return True
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT 1")
+        conn.rollback()
+        return True
+    except psycopg2.Error:
+        return False
+
+
+@contextmanager
+def get_database_connection():
+    """Borrow a health-checked connection from the pool and return it afterwards"""
+    import psycopg2.extensions
+
+    pool = get_connection_pool()
+    if not _pool_slots.acquire(timeout=config.DB_POOL_TIMEOUT_SECONDS):
+        raise ValueError("Database pool exhausted - timed out waiting for a connection")
+
+    conn = None
+    try:
+        for attempt in range(config.DB_POOL_MAX_SIZE + 1):
+            conn = pool.getconn()
+            if _is_healthy(conn):
+                break
+            print(f"Discarding unhealthy database connection (attempt {attempt+1})")
+            pool.putconn(conn, close=True)
+            conn = None
+        if conn is None:
+            raise ValueError("Could not obtain a healthy database connection")
+
+        yield conn
+    finally:
+        if conn is not None:
+            if not conn.closed and conn.status != psycopg2.extensions.STATUS_READY:
+                conn.rollback()
+            conn.last_used = time.monotonic()
+            pool.putconn(conn, close=bool(conn.closed))
+        _pool_slots.release()
+
+
+def _prepare(conn, name: str):
+    if name in conn.prepared_statements:
+        return
+    with conn.cursor() as cursor:
+        cursor.execute(f"PREPARE {name} AS {PREPARED_STATEMENTS[name]}")
+    conn.prepared_statements.add(name)
+
+
+def integrity_error_reason(error) -> str:
+    """Readable cause of a constraint violation on a "Submission" or reference_audio row"""
+    error_msg = str(error)
+    # Check for specific foreign key violations
+    if "userId_fkey" in error_msg:
+        return "User not found - invalid user ID provided"
+    elif "scenarioId_fkey" in error_msg:
+        return "Scenario not found - invalid scenario ID provided"
+    elif "audioScenarioId_fkey" in error_msg:
+        return "Scenario not found - invalid audio scenario ID provided"
+    else:
+        return "Data integrity constraint violated"
+
+
+def get_data_from_db(query: str, params: Optional[tuple] = None) -> Optional[List[Dict]]:
+    import psycopg2
+    from psycopg2.extras import RealDictCursor
+
+    if not query.strip():
+        raise ValueError("Query cannot be empty")
     
-#     try:
-#         with conn:  # Auto-commit on success, auto-rollback on exception
-#             with conn.cursor() as cursor:
-#                 cursor.execute(query, params)
-#         return True
-#     except psycopg2.IntegrityError as e:
-#         error_msg = str(e)
-#         print(f"Database integrity error: {error_msg}")
-        
-#         # Check for specific foreign key violations
-#         if "userId_fkey" in error_msg:
-#             raise ValueError("User not found - invalid user ID provided")
-#         elif "scenarioId_fkey" in error_msg:
-#             raise ValueError("Scenario not found - invalid scenario ID provided")
-#         else:
-#             raise ValueError("Data integrity constraint violated")
-        
-#     except psycopg2.Error as e:
-#         print(f"Database upload error: {e}")
-#         raise ValueError(f"Database operation failed: {str(e)}")
-#     except Exception as e:
-#         print(f"Unexpected error in upload_data_to_db: {e}")
-#         return False
-#     finally:
-#         conn.close()
+    try:
+        with get_database_connection() as conn:
+            with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+                cursor.execute(query, params)
+                data = cursor.fetchall()
+            conn.rollback()
+            return [dict(row) for row in data]
+    except psycopg2.Error as e:
+        print(f"Database query error: {e}")
+        return None
+    except Exception as e:
+        print(f"Unexpected error in get_data_from_db: {e}")
+        return None
+
+
+def submission_references_exist(user_id: str, scenario_id: str) -> tuple:
+    """(user exists, scenario exists) for the foreign keys of a "Submission" row"""
+    with get_database_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                'SELECT EXISTS (SELECT 1 FROM "User" WHERE "id" = %s), '
+                'EXISTS (SELECT 1 FROM "Scenario" WHERE "id" = %s)',
+                (user_id, scenario_id)
+            )
+            user_exists, scenario_exists = cursor.fetchone()
+        conn.rollback()
+    return bool(user_exists), bool(scenario_exists)
+
+
+def execute_prepared(conn, name: str, params: tuple):
+    """Run one of PREPARED_STATEMENTS on conn, preparing it there the first time.
+
+    psycopg2 errors propagate so the caller can tell a constraint violation from a
+    connection problem; the caller owns the transaction.
+    """
+    placeholders = ", ".join(["%s"] * len(params))
+    _prepare(conn, name)
+    with conn.cursor() as cursor:
+        cursor.execute(f"EXECUTE {name} ({placeholders})", params)
 
 
 # def get_scenario_by_id(scenario_id: str) -> Optional[List[Dict]]:
@@ -123,6 +226,9 @@ cloudinary.config(
 
 
 def upload_audio_file_to_cloudinary(file_path: str, public_id: str) -> Optional[str]:
+    import cloudinary.uploader
+
+    configure_cloudinary()
     # print(file_path)
     # print(public_id)
     if not os.path.exists(file_path):
@@ -146,51 +252,6 @@ def upload_audio_file_to_cloudinary(file_path: str, public_id: str) -> Optional[
         return None
     
 
-def upload_audio_url_to_db(scenario_id, audio_url, audio_format, audio_size):
-    """Store audio URL, format, and size in database"""
-    query = """
-    INSERT INTO reference_audio ("id", "audioScenarioId", "audioUrl", "fileFormate", "size", "createdAt") 
-    VALUES (%s, %s, %s, %s, %s, NOW())
-    ON CONFLICT ("audioScenarioId") DO UPDATE SET 
-        "audioUrl" = EXCLUDED."audioUrl", 
-        "fileFormate" = EXCLUDED."fileFormate",
-        "size" = EXCLUDED."size",
-        "createdAt" = NOW()
-    """
-    return upload_data_to_db(query, (str(uuid4()), scenario_id, audio_url, audio_format, audio_size))
-
-# def upload_submission_to_db(user_id, scenario_id, total_score, positives_str, negatives_str, improvements_str):
-#     """Store submission feedback in database"""
-#     query = """
-#     INSERT INTO "Submission" 
-#     ("id", "userId", "scenarioId", "totalScore", "positive", "negative", "improvement", "status", "createdAt", "updatedAt") 
-#     VALUES (%s, %s, %s, %s, %s, %s, %s, 'COMPLETED', NOW(), NOW()) 
-#     """
-    
-#     submission_id = str(uuid4())
-    
-#     params = (
-#         submission_id,
-#         user_id,
-#         scenario_id,
-#         total_score,
-#         positives_str,
-#         negatives_str,
-#         improvements_str,
-#     )
-    
-#     try:
-#         success = upload_data_to_db(query, params)
-#         if not success:
-#             raise ValueError("Database operation failed")
-#         return submission_id
-#     except ValueError:
-#         # Re-raise ValueError exceptions from upload_data_to_db
-#         raise
-#     except Exception as e:
-#         raise ValueError(f"Submission upload failed: {str(e)}")
-
-
 # def get_pdfUrl_according_to_scenario(scenario_id):
 #     query = 'SELECT "markingPointer" FROM "Scenario" WHERE "id" = %s'
 #     data = get_data_from_db(query, (scenario_id,))
@@ -0,0 +1,36 @@
+# gunicorn.conf.py
+# Production serving mode: several uvicorn workers under one gunicorn master.
+# Run with: gunicorn -c gunicorn.conf.py main:app
+import multiprocessing
+import os
+
+import config as app_config  # "config" is itself a gunicorn setting name
+
+bind = f"{app_config.API_HOST}:{app_config.API_PORT}"
+worker_class = "uvicorn.workers.UvicornWorker"
+workers = int(os.getenv("WEB_CONCURRENCY", str(multiprocessing.cpu_count())))
+
+# Import the app once in the master so workers fork with modules already loaded
+preload_app = os.getenv("PRELOAD_APP", "true").lower() == "true"
+
+# Graceful restarts: `kill -HUP` replaces workers one by one, in-flight requests get
+# graceful_timeout to finish, and workers are recycled to bound memory growth.
+timeout = int(os.getenv("WORKER_TIMEOUT", "300"))
+graceful_timeout = int(os.getenv("GRACEFUL_TIMEOUT", "60"))
+keepalive = 5
+max_requests = int(os.getenv("MAX_REQUESTS", "1000"))
+max_requests_jitter = int(os.getenv("MAX_REQUESTS_JITTER", "100"))
+
+accesslog = "-"
+errorlog = "-"
+
+
+def on_starting(server):
+    # Heavy modules are imported pre-fork and shared copy-on-write. Clients, pools and
+    # caches hold sockets, so they are created per worker in the app lifespan instead.
+    import services
+    services.import_dependencies()
+
+    # No worker is running yet, so every scratch workspace on disk or tmpfs is an orphan
+    from scratch import scratch
+    scratch.sweep_orphans(force=True)
@@ -1,18 +1,58 @@
 # main.py
-from fastapi import FastAPI, HTTPException, UploadFile, File
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, HTTPException, UploadFile, File, Request, Response
+from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi.concurrency import run_in_threadpool
+from typing import Optional
+import asyncio
+import json
 import config
 # from database import upload_submission_to_db
 from services import (
     generate_audio_from_pdf, 
-    transcribe_audio_from_url, 
+    prepare_audio_submission,
+    transcribe_prepared_audio,
+    extract_text_from_pdf_url,
     process_pdf_for_instructions, 
-    report
+    report,
+    warm_up
+)
+from models import (
+    AudioGenerationRequest, AudioGenerationResponse, GradingReport, EvaluationResponse,
+    PrewarmRequest, PrewarmJobResponse
 )
-from models import AudioGenerationRequest, AudioGenerationResponse, GradingReport, EvaluationResponse
 from fastapi.middleware.cors import CORSMiddleware
+from contextlib import asynccontextmanager, AsyncExitStack
+import threading
+from database import close_connection_pool
+from write_behind import write_queue, enqueue_submission, enqueue_reference_audio, verify_submission_references
+from admission import admission_controllers
+from resilience import request_deadline
+from prewarm import start_prewarm_job, get_prewarm_job
+from preflight import check_transcript
+from scratch import scratch
+from accounting import track_request, usage_header
+import worker_metrics
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Fail fast on bad configuration before accepting traffic
+    config.get_settings()
+    # Working files left behind by a crashed worker
+    scratch.sweep_orphans()
+    if config.WARM_UP_ON_STARTUP:
+        threading.Thread(target=warm_up, name="warm-up", daemon=True).start()
+    write_queue.start()
+    metrics_task = asyncio.create_task(worker_metrics.publish_loop())
+    yield
+    metrics_task.cancel()
+    worker_metrics.unpublish()
+    # Flush queued submissions before the pool goes away
+    write_queue.stop()
+    close_connection_pool()
 
-app = FastAPI()
+
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -23,14 +63,52 @@ app.add_middleware(
 )
 
 
+@app.middleware("http")
+async def deadline_middleware(request: Request, call_next):
+    """Propagate a per-request deadline to every OpenAI call made while serving it"""
+    seconds = config.REQUEST_DEADLINE_SECONDS
+    requested = request.headers.get("X-Request-Timeout")
+    if requested:
+        try:
+            seconds = min(max(float(requested), 1.0), config.REQUEST_DEADLINE_SECONDS)
+        except ValueError:
+            pass
+    with request_deadline(seconds):
+        return await call_next(request)
+
+
 @app.get("/")
 async def root():
     return {"message": "Server is running fine!"}
 
 
+@app.get("/metrics/admission")
+async def admission_metrics():
+    """Per-route in-flight, queued and wait-time figures for the autoscaler, summed over all workers"""
+    return worker_metrics.cluster_admission_stats(await run_in_threadpool(worker_metrics.worker_snapshots))
+
+
+@app.get("/metrics/scratch")
+async def scratch_metrics():
+    """Scratch-space usage per tier, allocations, spills and reclaimed bytes"""
+    return scratch.stats()
+
+
+@app.get("/metrics/write-behind")
+async def write_behind_metrics():
+    """Rows still queued for the database and rows dead-lettered after a constraint violation"""
+    return worker_metrics.cluster_write_behind_stats(await run_in_threadpool(worker_metrics.worker_snapshots))
+
+
+@app.get("/metrics/upstream")
+async def upstream_metrics():
+    """Circuit breaker state per OpenAI model: the worst state across workers, and per-worker counts"""
+    return worker_metrics.cluster_upstream_states(await run_in_threadpool(worker_metrics.worker_snapshots))
+
+
 
 @app.post("/speech/generate-from-scenario", response_model=AudioGenerationResponse)
-async def generate_audio_from_scenario_endpoint(request: AudioGenerationRequest):
+async def generate_audio_from_scenario_endpoint(request: AudioGenerationRequest, response: Response):
     try:
         pdf_url = request.pdf_url
 
@@ -38,13 +116,28 @@ async def generate_audio_from_scenario_endpoint(request: AudioGenerationRequest)
         # if not pdf_url or not pdf_url.endswith(".pdf"):
         #     raise HTTPException(status_code=400, detail="Invalid or missing PDF URL")
 
-        # Pass PDF URL directly to your audio generation logic
-        result = generate_audio_from_pdf(pdf_url)
+        # Pass PDF URL directly to your audio generation logic; the blocking work runs
+        # in the threadpool so queued requests do not stall the event loop
+        with track_request("generate") as usage:
+            async with admission_controllers["generate"].admit():
+                result = await run_in_threadpool(generate_audio_from_pdf, pdf_url)
+        response.headers.update(usage_header(usage))
+
+        if request.scenario_id:
+            enqueue_reference_audio(
+                request.scenario_id,
+                result["cloudinary_url"],
+                result["audio_format"],
+                result["audio_size"]
+            )
 
         return AudioGenerationResponse(
             message="Audio generated successfully",
             cloudinary_url=result["cloudinary_url"],
-            status="completed"
+            status="completed",
+            audio_format=result.get("audio_format"),
+            audio_size=result.get("audio_size"),
+            audio_bitrate_kbps=result.get("audio_bitrate_kbps")
         )
 
     except HTTPException:
@@ -57,48 +150,125 @@ async def generate_audio_from_scenario_endpoint(request: AudioGenerationRequest)
 
     
 
-@app.post("/grade/evaluate-submission", response_model=EvaluationResponse)
-async def evaluate_submission_endpoint(
-    pdf_url: str,
-    audio_url: str,
-    file_format: str
-):
-    """Evaluate uploaded audio submission against PDF instructions"""
+@app.post("/scenarios/prewarm", response_model=PrewarmJobResponse, status_code=202)
+async def prewarm_scenarios_endpoint(request: PrewarmRequest):
+    """Precompute text, rubric and reference audio for scenario PDFs before submissions arrive"""
     try:
+        job = start_prewarm_job(request.pdf_urls, request.include_audio)
+    except ValueError as ve:
+        raise HTTPException(status_code=400, detail=str(ve))
+    return job
 
-        transcription = transcribe_audio_from_url(audio_url, file_format)
-        instructions = process_pdf_for_instructions(pdf_url)
 
+@app.get("/scenarios/prewarm/{job_id}", response_model=PrewarmJobResponse)
+async def prewarm_status_endpoint(job_id: str):
+    job = get_prewarm_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Pre-warm job not found")
+    return job
 
 
-        if not instructions:
-            raise HTTPException(status_code=404, detail="No instructions found for scenario")
+def _no_events(event: str, data: dict):
+    pass
 
-        rep = report(transcription, instructions)
 
-        # Validate report structure using Pydantic
-        grading_report = GradingReport(**rep)
+async def _run_evaluation(pdf_url: str, audio_url: str, file_format: str, emit=_no_events):
+    """Pre-flight, transcription, rubric and grading; `emit(event, data)` reports progress"""
+    # Pre-flight: download, probe and validate both inputs before any OpenAI call
+    prepared_audio, _ = await asyncio.gather(
+        run_in_threadpool(prepare_audio_submission, audio_url, file_format),
+        run_in_threadpool(extract_text_from_pdf_url, pdf_url)
+    )
+    emit("downloaded", {"audio_cached": "transcription" in prepared_audio})
 
-        # Extract the 4 features with safe handling
-        total_score = grading_report.TotalScore
-        positives = grading_report.Positive or []
-        negatives = grading_report.Negative or []
-        improvements = grading_report.Improvement or []
+    async def transcribe():
+        transcription = await run_in_threadpool(transcribe_prepared_audio, prepared_audio)
+        emit("transcribed", {
+            "seconds": transcription.get("Seconds"),
+            "words": len(transcription["Submission"].split())
+        })
+        return transcription
 
-        # Convert lists to strings (comma-separated or newline-separated)
-        positives_str = "\n".join(positives)
-        negatives_str = "\n".join(negatives)
-        improvements_str = "\n".join(improvements)
+    async def rubric():
+        instructions = await run_in_threadpool(process_pdf_for_instructions, pdf_url)
+        emit("rubric_ready", {"instructions": len(instructions) if isinstance(instructions, list) else 0})
+        return instructions
 
-    
+    # Transcription and rubric extraction are independent; run them side by side
+    transcription, instructions = await asyncio.gather(transcribe(), rubric())
+
+    if not instructions:
+        raise HTTPException(status_code=404, detail="No instructions found for scenario")
+
+    check_transcript(transcription["Submission"])
+
+    # report() runs in a worker thread; each graded chunk is handed back as a "partial" event
+    return await run_in_threadpool(report, transcription, instructions, lambda chunk: emit("partial", chunk))
+
+
+async def _check_submission_references(user_id: Optional[str], scenario_id: Optional[str]) -> Optional[bool]:
+    """Before any grading: a 400 for an unknown user/scenario, None when nothing will be stored"""
+    if not (user_id and scenario_id):
+        return None
+    return await run_in_threadpool(verify_submission_references, user_id, scenario_id)
+
+
+def _evaluation_response(rep: dict, user_id: Optional[str], scenario_id: Optional[str],
+                         references_verified: Optional[bool] = None) -> dict:
+    # Validate report structure using Pydantic
+    grading_report = GradingReport(**rep)
+
+    # Extract the 4 features with safe handling
+    total_score = grading_report.TotalScore
+    positives = grading_report.Positive or []
+    negatives = grading_report.Negative or []
+    improvements = grading_report.Improvement or []
+
+    # Convert lists to strings (comma-separated or newline-separated)
+    positives_str = "\n".join(positives)
+    negatives_str = "\n".join(negatives)
+    improvements_str = "\n".join(improvements)
 
-        return {
-            "message": "Evaluation completed successfully",
-            "total_score": total_score,
-            "positive": positives,
-            "negative": negatives,
-            "improvement": improvements
-        }
+    # Persisted in batches off the request path: the id is for a queued row, and
+    # "persisted" says whether its user/scenario could be checked first
+    submission_id = None
+    persisted = None
+    if user_id and scenario_id:
+        submission_id = enqueue_submission(
+            user_id, scenario_id, total_score, positives_str, negatives_str, improvements_str
+        )
+        persisted = "queued" if references_verified else "queued_unverified"
+
+    return {
+        "message": "Evaluation completed successfully",
+        "total_score": total_score,
+        "positive": positives,
+        "negative": negatives,
+        "improvement": improvements,
+        "submission_id": submission_id,
+        "persisted": persisted,
+        "token_stats": rep.get("TokenStats")
+    }
+
+
+@app.post("/grade/evaluate-submission", response_model=EvaluationResponse)
+async def evaluate_submission_endpoint(
+    pdf_url: str,
+    audio_url: str,
+    file_format: str,
+    response: Response,
+    user_id: Optional[str] = None,
+    scenario_id: Optional[str] = None
+):
+    """Evaluate uploaded audio submission against PDF instructions"""
+    try:
+        references_verified = await _check_submission_references(user_id, scenario_id)
+        with track_request("evaluate") as usage:
+            async with admission_controllers["evaluate"].admit():
+                rep = await _run_evaluation(pdf_url, audio_url, file_format)
+        response.headers.update(usage_header(usage))
+
+        return _evaluation_response(rep, user_id, scenario_id, references_verified)
             
     except ValueError as ve:
     # Handle database constraint violations and validation errors
@@ -112,6 +282,87 @@ async def evaluate_submission_endpoint(
         print(f"Error type: {type(e)}")  # Additional debugging
         raise HTTPException(status_code=500, detail=error_msg)
 
+
+# Running stream evaluations; holding a reference keeps a task alive after its client disconnects
+_stream_evaluations = set()
+
+
+def _sse(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+@app.post("/grade/evaluate-submission/stream")
+async def evaluate_submission_stream_endpoint(
+    pdf_url: str,
+    audio_url: str,
+    file_format: str,
+    user_id: Optional[str] = None,
+    scenario_id: Optional[str] = None
+):
+    """Server-sent events variant of evaluate-submission.
+
+    Emits downloaded, transcribed and rubric_ready stage events, a partial event per
+    graded rubric chunk, then either result (same body as evaluate-submission) or error.
+    """
+    try:
+        references_verified = await _check_submission_references(user_id, scenario_id)
+    except ValueError as ve:
+        raise HTTPException(status_code=400, detail=str(ve))
+
+    # Admit before the response starts so an overloaded worker still answers 429 + Retry-After
+    admission = AsyncExitStack()
+    await admission.enter_async_context(admission_controllers["evaluate"].admit())
+
+    loop = asyncio.get_running_loop()
+    events = asyncio.Queue()
+
+    def emit(event, data):
+        # Called from the event loop and from report()'s worker thread
+        loop.call_soon_threadsafe(events.put_nowait, (event, data))
+
+    async def run():
+        try:
+            with track_request("evaluate_stream"):
+                rep = await _run_evaluation(pdf_url, audio_url, file_format, emit)
+            emit("result", _evaluation_response(rep, user_id, scenario_id, references_verified))
+        except HTTPException as e:
+            emit("error", {"status_code": e.status_code, "detail": e.detail})
+        except ValueError as ve:
+            emit("error", {"status_code": 400, "detail": str(ve)})
+        except Exception as e:
+            print(f"Unexpected error in evaluate_submission_stream_endpoint: {e}")
+            error_msg = str(e) if str(e).strip() else "An unexpected error occurred during submission evaluation"
+            emit("error", {"status_code": 500, "detail": error_msg})
+        finally:
+            emit(None, None)
+            # The evaluation owns its admission slot: it is returned only once the
+            # transcription/grading work has finished, even if the client went away
+            await admission.aclose()
+
+    # Started here, not in the generator, so the slot is released even if streaming never begins.
+    # A disconnecting client does not cancel it: the threadpool work would run on regardless.
+    task = asyncio.create_task(run())
+    _stream_evaluations.add(task)
+    task.add_done_callback(_stream_evaluations.discard)
+
+    async def event_stream():
+        while True:
+            try:
+                event, data = await asyncio.wait_for(events.get(), timeout=config.SSE_HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                # Comment line keeps proxies and clients from closing an idle connection
+                yield ": keep-alive\n\n"
+                continue
+            if event is None:
+                break
+            yield _sse(event, data)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host=config.API_HOST, port=config.API_PORT)
@@ -1,14 +1,27 @@
 # models.py
 from pydantic import BaseModel, Field
-from typing import Optional, List
+from typing import Optional, List, Dict
 
 class AudioGenerationRequest(BaseModel):
     pdf_url: str
+    scenario_id: Optional[str] = None
 
 class AudioGenerationResponse(BaseModel):
     message: str
     cloudinary_url: str 
     status: str
+    audio_format: Optional[str] = None
+    audio_size: Optional[int] = None
+    audio_bitrate_kbps: Optional[float] = None
+
+class PrewarmRequest(BaseModel):
+    pdf_urls: List[str]
+    include_audio: bool = True
+
+class PrewarmJobResponse(BaseModel):
+    job_id: str
+    status: str
+    scenarios: Dict[str, Dict[str, str]]
 
 class GradingReport(BaseModel):
     TotalScore: float = Field(..., ge=0, le=100)
@@ -21,4 +34,8 @@ class EvaluationResponse(BaseModel):
     total_score: float
     positive: Optional[List[str]] = None
     negative: Optional[List[str]] = None
-    improvement: Optional[List[str]] = None
\ No newline at end of file
+    improvement: Optional[List[str]] = None
+    submission_id: Optional[str] = None
+    # "queued" (user/scenario checked) or "queued_unverified" (database unreachable at check time)
+    persisted: Optional[str] = None
+    token_stats: Optional[Dict[str, int]] = None
\ No newline at end of file
@@ -0,0 +1,188 @@
+# preflight.py
+import json
+import re
+import shutil
+import subprocess
+import unicodedata
+from typing import Optional
+
+from fastapi import HTTPException
+
+import config
+from accounting import run_subprocess
+from cache import make_key
+
+
+# Cheap checks that run before any OpenAI call. Each one either returns quietly or
+# raises an HTTPException (400 bad input, 413 too large) so an empty, silent,
+# scanned, oversized or non-English input is rejected in milliseconds instead of
+# after transcription, rubric generation or grading has been paid for.
+
+
+def normalize_text(text: str) -> str:
+    """NFKC, collapsed whitespace and casefolded: the form cached text is keyed on"""
+    return " ".join(unicodedata.normalize("NFKC", text or "").split()).casefold()
+
+
+def content_fingerprint(text: str) -> str:
+    """Hash of normalized text, so the same content under another URL is recognised"""
+    return make_key(normalize_text(text))
+
+
+def read_limited_body(response, max_size_mb: float, what: str) -> bytes:
+    """Body of a stream=True response, rejected with 413 as soon as it is known to exceed max_size_mb.
+
+    A Content-Length over the limit is refused before any of the body is read;
+    otherwise the body is read in chunks and abandoned once it passes the limit.
+    """
+    limit = max_size_mb * 1024 * 1024
+    too_large = HTTPException(status_code=413, detail=f"{what} is larger than {max_size_mb:g} MB")
+
+    declared = response.headers.get("Content-Length") if response.headers else None
+    if declared and declared.isdigit() and int(declared) > limit:
+        raise too_large
+
+    body = bytearray()
+    for chunk in response.iter_content(chunk_size=config.DOWNLOAD_CHUNK_BYTES):
+        body.extend(chunk)
+        if len(body) > limit:
+            raise too_large
+    return bytes(body)
+
+
+def _ffmpeg_exe():
+    import imageio_ffmpeg
+    return imageio_ffmpeg.get_ffmpeg_exe()
+
+
+def _probe_with_ffprobe(ffprobe: str, path: str) -> dict:
+    result = run_subprocess(
+        [ffprobe, "-v", "error", "-print_format", "json", "-show_format", "-show_streams", path],
+        timeout=config.PREFLIGHT_PROBE_TIMEOUT_SECONDS
+    )
+    if result.returncode != 0:
+        raise HTTPException(status_code=400, detail="Audio file could not be read")
+
+    data = json.loads(result.stdout or "{}")
+    fmt = data.get("format", {})
+    codecs = [s.get("codec_name") for s in data.get("streams", []) if s.get("codec_type") == "audio"]
+    try:
+        duration = float(fmt.get("duration"))
+    except (TypeError, ValueError):
+        duration = None
+    return {"format": fmt.get("format_name"), "duration": duration, "audio_codecs": codecs}
+
+
+def _probe_with_ffmpeg(path: str) -> dict:
+    # imageio-ffmpeg ships ffmpeg without ffprobe; `ffmpeg -i` prints the same stream summary
+    result = run_subprocess(
+        [_ffmpeg_exe(), "-hide_banner", "-i", path],
+        timeout=config.PREFLIGHT_PROBE_TIMEOUT_SECONDS
+    )
+    output = result.stderr
+    input_match = re.search(r"Input #0, (.+?), from ", output)
+    if not input_match:
+        raise HTTPException(status_code=400, detail="Audio file could not be read")
+
+    duration = None
+    duration_match = re.search(r"Duration: (\d+):(\d+):(\d+(?:\.\d+)?)", output)
+    if duration_match:
+        hours, minutes, seconds = duration_match.groups()
+        duration = int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+    codecs = re.findall(r"Stream #\d+:\d+.*?: Audio: (\w+)", output)
+    return {"format": input_match.group(1), "duration": duration, "audio_codecs": codecs}
+
+
+def probe_audio(path: str) -> dict:
+    """Container format, duration and audio codecs, without decoding the file"""
+    ffprobe = shutil.which("ffprobe")
+    try:
+        if ffprobe:
+            return _probe_with_ffprobe(ffprobe, path)
+        return _probe_with_ffmpeg(path)
+    except subprocess.TimeoutExpired:
+        raise HTTPException(status_code=400, detail="Audio file could not be probed in time")
+
+
+def check_audio(probe: dict):
+    if not probe["audio_codecs"]:
+        raise HTTPException(status_code=400, detail="File contains no audio stream")
+
+    duration = probe["duration"]
+    if duration is None:
+        return
+    if duration < config.AUDIO_MIN_SECONDS:
+        raise HTTPException(status_code=400, detail=f"Audio is too short ({duration:.1f}s)")
+    if duration > config.AUDIO_MAX_SECONDS:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Audio is too long ({duration:.0f}s, limit {config.AUDIO_MAX_SECONDS:.0f}s)"
+        )
+
+
+def parse_max_volume(ffmpeg_output: str) -> Optional[float]:
+    """Peak level from ffmpeg's volumedetect filter output, in dB"""
+    match = re.search(r"max_volume: (-?[\d.]+|-inf) dB", ffmpeg_output or "")
+    if not match:
+        return None
+    return float("-inf") if match.group(1) == "-inf" else float(match.group(1))
+
+
+def check_not_silent(ffmpeg_output: str):
+    max_volume = parse_max_volume(ffmpeg_output)
+    if max_volume is not None and max_volume <= config.AUDIO_SILENCE_THRESHOLD_DB:
+        raise HTTPException(status_code=400, detail="Audio appears to be silent")
+
+
+def check_pdf_pages(page_count: int):
+    if page_count == 0:
+        raise HTTPException(status_code=400, detail="PDF has no pages")
+    if page_count > config.PDF_MAX_PAGES:
+        raise HTTPException(
+            status_code=413,
+            detail=f"PDF has {page_count} pages, limit is {config.PDF_MAX_PAGES}"
+        )
+
+
+def check_language(text: str, what: str):
+    """Reject text that langdetect is confident is not in PREFLIGHT_LANGUAGES"""
+    if len(text) < config.PREFLIGHT_LANGDETECT_MIN_CHARS:
+        return
+
+    from langdetect import DetectorFactory, detect_langs
+    from langdetect.lang_detect_exception import LangDetectException
+
+    DetectorFactory.seed = 0  # deterministic results for the same text
+    try:
+        candidates = detect_langs(text[:config.PREFLIGHT_LANGDETECT_MAX_CHARS])
+    except LangDetectException:
+        return
+    if not candidates:
+        return
+
+    best = candidates[0]
+    if best.lang not in config.PREFLIGHT_LANGUAGES and best.prob >= config.PREFLIGHT_LANGUAGE_MIN_PROB:
+        raise HTTPException(
+            status_code=400,
+            detail=f"{what} appears to be in an unsupported language ({best.lang})"
+        )
+
+
+def check_pdf_text(text: str, page_count: int):
+    """Scanned or image-only PDFs extract to (almost) nothing; reject before a rubric or TTS call"""
+    if not text:
+        raise HTTPException(status_code=400, detail="No text found in PDF")
+    density = len(text) / max(page_count, 1)
+    if density < config.PDF_MIN_CHARS_PER_PAGE:
+        raise HTTPException(
+            status_code=400,
+            detail=f"PDF has too little extractable text ({density:.0f} characters per page); is it scanned?"
+        )
+    check_language(text, "PDF")
+
+
+def check_transcript(text: str):
+    """Run before grading so an empty or off-language answer is not sent to the grading model"""
+    if len(text.split()) < config.MIN_TRANSCRIPT_WORDS:
+        raise HTTPException(status_code=400, detail="Submission is too short to grade")
+    check_language(text, "Submission")
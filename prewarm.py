@@ -0,0 +1,126 @@
+# prewarm.py
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+
+import config
+from cache import cache_get, cache_set
+from services import extract_text_from_pdf_url, process_pdf_for_instructions, generate_audio_from_pdf
+
+
+# Scenario PDFs are known before students submit. A pre-warm job runs text extraction,
+# rubric generation and reference-audio generation ahead of time; each step stores its
+# result in the shared cache, so later evaluation and generation requests are cache hits.
+# Job status also lives in the shared cache so any worker can answer status queries.
+
+JOB_NAMESPACE = "prewarm_job"
+
+_executor = ThreadPoolExecutor(max_workers=config.PREWARM_MAX_WORKERS, thread_name_prefix="prewarm")
+_job_locks = {}
+_job_locks_guard = threading.Lock()
+
+
+def _job_lock(job_id: str) -> threading.Lock:
+    with _job_locks_guard:
+        return _job_locks.setdefault(job_id, threading.Lock())
+
+
+def get_prewarm_job(job_id: str):
+    return cache_get(JOB_NAMESPACE, job_id)
+
+
+def _save_job(job):
+    job["updated_at"] = time.time()
+    cache_set(JOB_NAMESPACE, job["job_id"], job, ttl=config.PREWARM_JOB_TTL_SECONDS)
+
+
+def _update_step(job_id: str, pdf_url: str, step: str, status: str):
+    with _job_lock(job_id):
+        job = get_prewarm_job(job_id)
+        if job is None:
+            return
+        job["scenarios"][pdf_url][step] = status
+        _save_job(job)
+
+
+def _finish_job(job_id: str):
+    with _job_lock(job_id):
+        job = get_prewarm_job(job_id)
+        if job is None:
+            return
+        steps = [status for scenario in job["scenarios"].values() for status in scenario.values()]
+        if all(status in ("done", "skipped") for status in steps):
+            job["status"] = "completed"
+        elif any(status == "done" for status in steps):
+            job["status"] = "partial"
+        else:
+            job["status"] = "failed"
+        _save_job(job)
+    with _job_locks_guard:
+        _job_locks.pop(job_id, None)
+
+
+def _run_step(job_id, pdf_url, step, fn):
+    _update_step(job_id, pdf_url, step, "running")
+    try:
+        result = fn(pdf_url)
+        if not result:
+            raise ValueError("no result produced")
+        _update_step(job_id, pdf_url, step, "done")
+        return True
+    except Exception as e:
+        detail = getattr(e, "detail", None) or str(e) or type(e).__name__
+        print(f"Pre-warm {step} failed for {pdf_url}: {detail}")
+        _update_step(job_id, pdf_url, step, f"failed: {detail}")
+        return False
+
+
+def _warm_scenario(job_id: str, pdf_url: str, include_audio: bool):
+    # Text first: both later steps read the cached extraction instead of downloading again
+    if not _run_step(job_id, pdf_url, "text", extract_text_from_pdf_url):
+        _update_step(job_id, pdf_url, "rubric", "skipped")
+        if include_audio:
+            _update_step(job_id, pdf_url, "audio", "skipped")
+        return
+
+    _run_step(job_id, pdf_url, "rubric", process_pdf_for_instructions)
+    if include_audio:
+        _run_step(job_id, pdf_url, "audio", generate_audio_from_pdf)
+
+
+def _run_job(job_id: str, pdf_urls: List[str], include_audio: bool):
+    with _job_lock(job_id):
+        job = get_prewarm_job(job_id)
+        if job is not None:
+            job["status"] = "running"
+            _save_job(job)
+
+    # Scenarios from every job share one bounded pool so pre-warming cannot starve requests
+    futures = [_executor.submit(_warm_scenario, job_id, pdf_url, include_audio) for pdf_url in pdf_urls]
+    for future in futures:
+        future.result()
+    _finish_job(job_id)
+
+
+def start_prewarm_job(pdf_urls: List[str], include_audio: bool = True) -> dict:
+    """Register scenario PDFs and precompute their text, rubric and reference audio in the background"""
+    pdf_urls = list(dict.fromkeys(url.strip() for url in pdf_urls if url and url.strip()))
+    if not pdf_urls:
+        raise ValueError("At least one PDF URL is required")
+    if len(pdf_urls) > config.PREWARM_MAX_BATCH:
+        raise ValueError(f"At most {config.PREWARM_MAX_BATCH} PDF URLs can be pre-warmed per request")
+
+    steps = ["text", "rubric"] + (["audio"] if include_audio else [])
+    job = {
+        "job_id": str(uuid.uuid4()),
+        "status": "queued",
+        "created_at": time.time(),
+        "scenarios": {url: {step: "pending" for step in steps} for url in pdf_urls},
+    }
+    _save_job(job)
+    threading.Thread(
+        target=_run_job, args=(job["job_id"], pdf_urls, include_audio), name="prewarm-job", daemon=True
+    ).start()
+    return job
@@ -0,0 +1,255 @@
+# rate_limiter.py
+import re
+import threading
+import time
+from typing import Dict, Optional
+
+import config
+
+
+# Token-bucket state is kept per model and per kind ("requests" / "tokens").
+# Buckets refill continuously at capacity-per-minute; a bucket with no configured
+# capacity is treated as unlimited.
+
+
+class LocalBackend:
+    """In-process buckets, shared by all threads of one worker"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._levels: Dict[str, float] = {}
+        self._stamps: Dict[str, float] = {}
+        self._blocked_until: Dict[str, float] = {}
+
+    def _refill(self, key, capacity, now):
+        level = self._levels.get(key, capacity)
+        elapsed = now - self._stamps.get(key, now)
+        level = min(capacity, level + elapsed * capacity / 60.0)
+        self._levels[key] = level
+        self._stamps[key] = now
+        return level
+
+    def try_acquire(self, model, costs, now):
+        """Take `costs` ({kind: (capacity, cost)}) if all buckets allow it, else return seconds to wait"""
+        with self._lock:
+            wait = max(self._blocked_until.get(model, 0) - now, 0)
+            for kind, (capacity, cost) in costs.items():
+                level = self._refill(f"{model}:{kind}", capacity, now)
+                if cost > level:
+                    wait = max(wait, (cost - level) * 60.0 / capacity)
+
+            if wait > 0:
+                return wait
+
+            for kind, (capacity, cost) in costs.items():
+                self._levels[f"{model}:{kind}"] -= cost
+            return 0.0
+
+    def set_level(self, model, kind, remaining, now):
+        with self._lock:
+            key = f"{model}:{kind}"
+            self._levels[key] = min(self._levels.get(key, remaining), remaining)
+            self._stamps[key] = now
+
+    def block(self, model, until):
+        with self._lock:
+            self._blocked_until[model] = max(self._blocked_until.get(model, 0), until)
+
+
+_ACQUIRE_SCRIPT = """
+local now = tonumber(ARGV[1])
+local blocked = tonumber(redis.call('GET', KEYS[#KEYS]) or '0')
+local wait = math.max(blocked - now, 0)
+local levels = {}
+for i = 1, #KEYS - 1 do
+    local capacity = tonumber(ARGV[i * 2])
+    local cost = tonumber(ARGV[i * 2 + 1])
+    local state = redis.call('HMGET', KEYS[i], 'level', 'ts')
+    local level = tonumber(state[1]) or capacity
+    local ts = tonumber(state[2]) or now
+    level = math.min(capacity, level + (now - ts) * capacity / 60)
+    levels[i] = level
+    if cost > level then
+        wait = math.max(wait, (cost - level) * 60 / capacity)
+    end
+end
+if wait > 0 then
+    return tostring(wait)
+end
+for i = 1, #KEYS - 1 do
+    local cost = tonumber(ARGV[i * 2 + 1])
+    redis.call('HSET', KEYS[i], 'level', levels[i] - cost, 'ts', now)
+    redis.call('EXPIRE', KEYS[i], 120)
+end
+return '0'
+"""
+
+
+class RedisBackend:
+    """Buckets stored in Redis so several uvicorn workers share one budget"""
+
+    def __init__(self, url: str):
+        import redis  # optional dependency, only needed for the shared backend
+
+        self._redis = redis.Redis.from_url(url)
+        self._acquire = self._redis.register_script(_ACQUIRE_SCRIPT)
+
+    def _key(self, model, kind):
+        return f"openai_ratelimit:{model}:{kind}"
+
+    def try_acquire(self, model, costs, now):
+        keys = [self._key(model, kind) for kind in costs] + [self._key(model, "blocked")]
+        args = [now]
+        for capacity, cost in costs.values():
+            args.extend([capacity, cost])
+        return float(self._acquire(keys=keys, args=args))
+
+    def set_level(self, model, kind, remaining, now):
+        key = self._key(model, kind)
+        level = self._redis.hget(key, "level")
+        if level is not None:
+            remaining = min(float(level), remaining)
+        self._redis.hset(key, mapping={"level": remaining, "ts": now})
+        self._redis.expire(key, 120)
+
+    def block(self, model, until):
+        key = self._key(model, "blocked")
+        current = float(self._redis.get(key) or 0)
+        if until > current:
+            self._redis.set(key, until, ex=max(int(until - time.time()) + 1, 1))
+
+
+def parse_reset_duration(value: Optional[str]) -> Optional[float]:
+    """Parse OpenAI reset headers such as '1s', '6m0s' or '20ms' into seconds"""
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+
+    total = 0.0
+    matched = False
+    for amount, unit in re.findall(r"([\d.]+)(ms|h|m|s)", value):
+        matched = True
+        amount = float(amount)
+        total += {"ms": amount / 1000, "s": amount, "m": amount * 60, "h": amount * 3600}[unit]
+    return total if matched else None
+
+
+class RateLimiter:
+    def __init__(self, limits: Dict[str, Dict[str, int]], backend=None, max_wait: float = 120.0):
+        self.limits = limits
+        self.backend = backend or LocalBackend()
+        self.max_wait = max_wait
+
+    def _costs(self, model, tokens):
+        limits = self.limits.get(model, {})
+        costs = {}
+        rpm = limits.get("rpm")
+        tpm = limits.get("tpm")
+        if rpm:
+            costs["requests"] = (rpm, 1)
+        if tpm and tokens:
+            costs["tokens"] = (tpm, min(tokens, tpm))
+        return costs
+
+    def acquire(self, model: str, tokens: int = 0, max_wait: Optional[float] = None):
+        """Block until the model's request and token budgets allow this call"""
+        costs = self._costs(model, tokens)
+        max_wait = self.max_wait if max_wait is None else min(max_wait, self.max_wait)
+        deadline = time.monotonic() + max_wait
+
+        while True:
+            wait = self.backend.try_acquire(model, costs, time.time())
+            if wait <= 0:
+                return
+            if time.monotonic() + wait > deadline:
+                raise TimeoutError(f"OpenAI rate limit budget for {model} exhausted; gave up after {max_wait:.0f}s")
+            time.sleep(min(wait, 5.0))
+
+    def update_from_headers(self, model: str, headers):
+        """Sync local buckets with the x-ratelimit-* headers returned by OpenAI"""
+        if not headers:
+            return
+        now = time.time()
+        for kind in ("requests", "tokens"):
+            remaining = headers.get(f"x-ratelimit-remaining-{kind}")
+            if remaining is None:
+                continue
+            try:
+                remaining = float(remaining)
+            except ValueError:
+                continue
+
+            limit = headers.get(f"x-ratelimit-limit-{kind}")
+            if limit:
+                key = "rpm" if kind == "requests" else "tpm"
+                self.limits.setdefault(model, {})[key] = int(float(limit))
+
+            self.backend.set_level(model, kind, remaining, now)
+            if remaining <= 0:
+                reset = parse_reset_duration(headers.get(f"x-ratelimit-reset-{kind}"))
+                if reset:
+                    self.backend.block(model, now + reset)
+
+    def pause(self, model: str, seconds: float):
+        self.backend.block(model, time.time() + seconds)
+
+
+def _retry_after_seconds(headers) -> float:
+    if not headers:
+        return 1.0
+    retry_after_ms = headers.get("retry-after-ms")
+    if retry_after_ms:
+        try:
+            return float(retry_after_ms) / 1000
+        except ValueError:
+            pass
+    return (
+        parse_reset_duration(headers.get("retry-after"))
+        or parse_reset_duration(headers.get("x-ratelimit-reset-requests"))
+        or 1.0
+    )
+
+
+def _create_backend():
+    if config.RATE_LIMIT_REDIS_URL:
+        try:
+            return RedisBackend(config.RATE_LIMIT_REDIS_URL)
+        except Exception as e:
+            print(f"Warning: Could not use shared rate limit backend, falling back to local: {e}")
+    return LocalBackend()
+
+
+limiter = RateLimiter(
+    {model: dict(limits) for model, limits in config.OPENAI_RATE_LIMITS.items()},
+    backend=_create_backend(),
+    max_wait=config.RATE_LIMIT_MAX_WAIT_SECONDS
+)
+
+
+def limited_call(model: str, resource, estimated_tokens: int = 0, max_wait: Optional[float] = None, **kwargs):
+    """Call `resource.create(**kwargs)` (e.g. client.chat.completions) through the shared limiter.
+
+    429 responses are queued behind the advertised retry delay instead of surfacing
+    to the caller, up to RATE_LIMIT_MAX_RETRIES attempts.
+    """
+    import openai
+
+    for attempt in range(config.RATE_LIMIT_MAX_RETRIES):
+        limiter.acquire(model, estimated_tokens, max_wait)
+        try:
+            raw_response = resource.with_raw_response.create(model=model, **kwargs)
+        except openai.RateLimitError as e:
+            headers = e.response.headers if e.response is not None else None
+            limiter.update_from_headers(model, headers)
+            delay = _retry_after_seconds(headers)
+            print(f"OpenAI rate limited on {model} (attempt {attempt+1}); waiting {delay:.1f}s")
+            limiter.pause(model, delay)
+            continue
+
+        limiter.update_from_headers(model, raw_response.headers)
+        return raw_response.parse()
+
+    raise TimeoutError(f"OpenAI rate limit for {model} persisted after {config.RATE_LIMIT_MAX_RETRIES} attempts")
@@ -0,0 +1,251 @@
+# resilience.py
+import contextvars
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait as wait_futures
+from contextlib import contextmanager
+from typing import Optional
+
+from fastapi import HTTPException
+
+import config
+from rate_limiter import limited_call
+from accounting import record_openai_usage
+
+
+# Every OpenAI call goes through resilient_call(), which adds on top of the rate limiter:
+#   - a per-call timeout derived from the incoming request's deadline,
+#   - bounded retries with jittered backoff for transient failures,
+#   - optional hedging: a duplicate request after a percentile-based delay,
+#   - a per-model circuit breaker that fails fast while the upstream is degraded.
+
+
+class DeadlineExceeded(HTTPException):
+    def __init__(self, detail: str = "Request deadline exceeded"):
+        super().__init__(status_code=504, detail=detail)
+
+
+class CircuitOpenError(HTTPException):
+    def __init__(self, model: str, retry_after: float):
+        super().__init__(
+            status_code=503,
+            detail=f"OpenAI {model} is temporarily unavailable. Please retry later.",
+            headers={"Retry-After": str(max(1, int(retry_after)))}
+        )
+
+
+_deadline: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar("request_deadline", default=None)
+
+
+@contextmanager
+def request_deadline(seconds: float):
+    """Bound all OpenAI calls made in this context (and threads spawned from it)"""
+    token = _deadline.set(time.monotonic() + seconds)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining_time() -> Optional[float]:
+    deadline = _deadline.get()
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+
+def call_timeout() -> float:
+    """Per-call timeout: the configured cap, shortened to what is left of the request deadline"""
+    remaining = remaining_time()
+    if remaining is None:
+        return config.OPENAI_CALL_TIMEOUT_SECONDS
+    if remaining <= 0:
+        raise DeadlineExceeded()
+    return min(config.OPENAI_CALL_TIMEOUT_SECONDS, remaining)
+
+
+class CircuitBreaker:
+    """closed -> open after N consecutive failures -> half-open trial after cooldown"""
+
+    def __init__(self, failure_threshold: int, cooldown: float):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._trial_in_flight = False
+
+    @property
+    def state(self) -> str:
+        if self._opened_at is None:
+            return "closed"
+        if time.monotonic() - self._opened_at >= self.cooldown:
+            return "half_open"
+        return "open"
+
+    def before_call(self, model: str):
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return
+            if state == "half_open" and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return
+            retry_after = self.cooldown - (time.monotonic() - self._opened_at)
+            raise CircuitOpenError(model, retry_after)
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_in_flight = False
+
+    def release_trial(self):
+        """The half-open trial ended without telling us anything about upstream health"""
+        with self._lock:
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._trial_in_flight or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+            self._trial_in_flight = False
+
+
+class LatencyTracker:
+    def __init__(self, size: int = 200):
+        self._samples = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, pct: float) -> Optional[float]:
+        with self._lock:
+            if len(self._samples) < config.OPENAI_HEDGE_MIN_SAMPLES:
+                return None
+            ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+_breakers = {}
+_latencies = {}
+_registry_lock = threading.Lock()
+_hedge_executor = ThreadPoolExecutor(max_workers=config.OPENAI_HEDGE_MAX_WORKERS, thread_name_prefix="openai-hedge")
+
+
+def _breaker(model: str) -> CircuitBreaker:
+    with _registry_lock:
+        if model not in _breakers:
+            _breakers[model] = CircuitBreaker(config.CIRCUIT_FAILURE_THRESHOLD, config.CIRCUIT_COOLDOWN_SECONDS)
+        return _breakers[model]
+
+
+def _latency(operation: str) -> LatencyTracker:
+    with _registry_lock:
+        if operation not in _latencies:
+            _latencies[operation] = LatencyTracker()
+        return _latencies[operation]
+
+
+def _is_transient(error: Exception) -> bool:
+    import openai
+
+    return isinstance(error, (
+        openai.APITimeoutError,
+        openai.APIConnectionError,
+        openai.InternalServerError,
+    )) and not isinstance(error, openai.RateLimitError)
+
+
+def _upstream_responded(error: Exception) -> bool:
+    import openai
+
+    # A 4xx answer (bad request, auth, 429) means the upstream itself is up
+    return isinstance(error, openai.APIStatusError)
+
+
+def _submit(fn, *args, **kwargs):
+    # Run in the hedge pool with the caller's context so the request deadline carries over
+    ctx = contextvars.copy_context()
+    return _hedge_executor.submit(ctx.run, fn, *args, **kwargs)
+
+
+def _hedged(operation: str, fn, *args, **kwargs):
+    """Start fn; if it is slower than the operation's hedge percentile, start a duplicate and take the first result"""
+    delay = _latency(operation).percentile(config.OPENAI_HEDGE_PERCENTILE)
+    if delay is None:
+        return fn(*args, **kwargs)
+
+    primary = _submit(fn, *args, **kwargs)
+    done, _ = wait_futures([primary], timeout=delay)
+    if done:
+        return primary.result()
+
+    print(f"Hedging {operation}: no response after {delay:.2f}s, sending duplicate request")
+    pending = {primary, _submit(fn, *args, **kwargs)}
+    first_error = None
+    while pending:
+        done, pending = wait_futures(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None:
+                # The slower request is left to finish in the background and its result dropped
+                return future.result()
+            first_error = first_error or future.exception()
+    raise first_error
+
+
+def resilient_call(operation: str, model: str, resource, hedge: bool = False, estimated_tokens: int = 0, **kwargs):
+    """limited_call() with deadline-bound timeouts, backoff retries, optional hedging and a circuit breaker.
+
+    Only pass hedge=True for idempotent requests (same input -> same effect); file
+    uploads must be given as bytes so a duplicate request can resend them.
+    """
+    breaker = _breaker(model)
+    hedge = hedge and config.OPENAI_HEDGING_ENABLED
+
+    for attempt in range(config.OPENAI_MAX_ATTEMPTS):
+        # Before before_call(): an expired deadline must not take the half-open trial slot
+        timeout = call_timeout()
+        breaker.before_call(model)
+        started = time.monotonic()
+        try:
+            call_args = dict(kwargs, timeout=timeout)
+            if hedge:
+                result = _hedged(operation, limited_call, model, resource, estimated_tokens,
+                                 max_wait=timeout, **call_args)
+            else:
+                result = limited_call(model, resource, estimated_tokens, max_wait=timeout, **call_args)
+        except Exception as e:
+            if not _is_transient(e):
+                if _upstream_responded(e):
+                    breaker.record_success()
+                else:
+                    breaker.release_trial()
+                raise
+            breaker.record_failure()
+            print(f"{operation} on {model} failed (attempt {attempt+1}): {e}")
+            if attempt + 1 >= config.OPENAI_MAX_ATTEMPTS:
+                raise
+            # Jittered exponential backoff instead of retrying straight away
+            backoff = min(config.OPENAI_RETRY_BACKOFF_SECONDS * (2 ** attempt), 10) * random.uniform(0.5, 1.5)
+            remaining = remaining_time()
+            if remaining is not None and remaining <= backoff:
+                raise DeadlineExceeded(f"Request deadline exceeded while retrying {operation}")
+            time.sleep(backoff)
+            continue
+
+        breaker.record_success()
+        _latency(operation).record(time.monotonic() - started)
+        record_openai_usage(result)
+        return result
+
+
+def breaker_states() -> dict:
+    """This worker's breakers; each worker process trips its own"""
+    with _registry_lock:
+        return {model: breaker.state for model, breaker in _breakers.items()}
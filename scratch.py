@@ -0,0 +1,214 @@
+# scratch.py
+import os
+import shutil
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Optional
+
+from fastapi import HTTPException
+
+import config
+
+
+# Intermediate files (downloaded submissions, converted audio, TTS segments, joined
+# reference audio) live in per-request workspaces:
+#   <root>/ws-<pid>-<id>/
+# Small files go to a tmpfs root (/dev/shm) and larger ones spill to the disk root.
+# Workspaces are removed when the request finishes; a crashed worker leaves its
+# workspace behind, and those orphans are swept at startup and reclaimed (oldest
+# first) whenever a tier runs over its byte budget.
+
+
+class Workspace:
+    def __init__(self, manager: "ScratchSpace", workspace_id: str):
+        self.manager = manager
+        self.id = workspace_id
+        self._dirs = {}
+
+    def _dir(self, tier: str) -> Path:
+        if tier not in self._dirs:
+            path = self.manager.roots[tier] / self.id
+            path.mkdir(parents=True, exist_ok=True)
+            self._dirs[tier] = path
+        return self._dirs[tier]
+
+    def path(self, name: str, size_hint: int = 0) -> Path:
+        """Path for a file of roughly size_hint bytes that someone else (e.g. ffmpeg) will write"""
+        return self._dir(self.manager.allocate(size_hint)) / name
+
+    def write(self, name: str, data: bytes) -> Path:
+        path = self.path(name, len(data))
+        with open(path, "wb") as f:
+            f.write(data)
+        return path
+
+    def cleanup(self):
+        for path in self._dirs.values():
+            shutil.rmtree(path, ignore_errors=True)
+        self._dirs = {}
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _tree_size(path: Path) -> int:
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for filename in filenames:
+            try:
+                total += os.lstat(os.path.join(dirpath, filename)).st_size
+            except OSError:
+                pass
+    return total
+
+
+class ScratchSpace:
+    def __init__(self, disk_dir: str, memory_dir: Optional[str], memory_file_max: int,
+                 memory_budget: int, disk_budget: int, orphan_age: float):
+        self.roots = {"disk": Path(disk_dir)}
+        if memory_dir and Path(memory_dir).parent.is_dir():
+            self.roots["memory"] = Path(memory_dir)
+        self.budgets = {"disk": disk_budget, "memory": memory_budget}
+        self.memory_file_max = memory_file_max
+        self.orphan_age = orphan_age
+        self._lock = threading.Lock()
+        self._active = set()
+        self.allocations = {"memory": 0, "disk": 0}
+        self.spilled = 0
+        self.rejected = 0
+        self.reclaimed_bytes = 0
+
+    def _usage(self, tier: str) -> int:
+        root = self.roots.get(tier)
+        return _tree_size(root) if root and root.exists() else 0
+
+    def _memory_free(self) -> int:
+        stats = os.statvfs(self.roots["memory"].parent)
+        return stats.f_bavail * stats.f_frsize
+
+    def _is_orphan(self, entry: Path, force: bool) -> bool:
+        if entry.name in self._active:
+            return False
+        if force:
+            return True
+        parts = entry.name.split("-")
+        if len(parts) == 3 and parts[0] == "ws" and parts[1].isdigit():
+            pid = int(parts[1])
+            if pid == os.getpid() or not _pid_alive(pid):
+                return True
+        # Stray files from older code and workspaces whose owner outlived any deadline
+        try:
+            return time.time() - entry.stat().st_mtime > self.orphan_age
+        except OSError:
+            return False
+
+    def _reclaim(self, tier: str, needed: int, force: bool = False) -> int:
+        """Remove orphaned entries, least recently modified first, until `needed` bytes are freed"""
+        root = self.roots.get(tier)
+        if not root or not root.exists():
+            return 0
+        entries = []
+        for entry in root.iterdir():
+            try:
+                entries.append((entry.stat().st_mtime, entry))
+            except OSError:
+                pass
+
+        freed = 0
+        for _, entry in sorted(entries, key=lambda item: item[0]):
+            if freed >= needed:
+                break
+            if not self._is_orphan(entry, force):
+                continue
+            size = _tree_size(entry) if entry.is_dir() else entry.stat().st_size
+            if entry.is_dir():
+                shutil.rmtree(entry, ignore_errors=True)
+            else:
+                entry.unlink(missing_ok=True)
+            freed += size
+        self.reclaimed_bytes += freed
+        return freed
+
+    def _fits(self, tier: str, size: int) -> bool:
+        overflow = self._usage(tier) + size - self.budgets[tier]
+        if overflow <= 0:
+            return True
+        return self._reclaim(tier, overflow) >= overflow
+
+    def allocate(self, size: int) -> str:
+        """Pick a tier for a new file: tmpfs when small and within budget, else disk"""
+        with self._lock:
+            if "memory" in self.roots and size <= self.memory_file_max:
+                if size < self._memory_free() and self._fits("memory", size):
+                    self.allocations["memory"] += 1
+                    return "memory"
+                self.spilled += 1
+            if self._fits("disk", size):
+                self.allocations["disk"] += 1
+                return "disk"
+            self.rejected += 1
+        raise HTTPException(
+            status_code=503,
+            detail="Scratch space is full. Please retry later.",
+            headers={"Retry-After": "30"}
+        )
+
+    @contextmanager
+    def workspace(self):
+        """Per-request working area, removed on exit"""
+        workspace_id = f"ws-{os.getpid()}-{uuid.uuid4().hex[:12]}"
+        with self._lock:
+            self._active.add(workspace_id)
+        workspace = Workspace(self, workspace_id)
+        try:
+            yield workspace
+        finally:
+            workspace.cleanup()
+            with self._lock:
+                self._active.discard(workspace_id)
+
+    def sweep_orphans(self, force: bool = False) -> int:
+        """Remove workspaces left by dead workers; force=True when no worker is running yet"""
+        freed = 0
+        with self._lock:
+            for tier in self.roots:
+                freed += self._reclaim(tier, float("inf"), force=force)
+        if freed:
+            print(f"Scratch sweep reclaimed {freed} bytes")
+        return freed
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "memory_enabled": "memory" in self.roots,
+                "memory_bytes": self._usage("memory"),
+                "memory_budget_bytes": self.budgets["memory"],
+                "disk_bytes": self._usage("disk"),
+                "disk_budget_bytes": self.budgets["disk"],
+                "active_workspaces": len(self._active),
+                "memory_allocations": self.allocations["memory"],
+                "disk_allocations": self.allocations["disk"],
+                "spilled_to_disk": self.spilled,
+                "rejected": self.rejected,
+                "reclaimed_bytes": self.reclaimed_bytes,
+            }
+
+
+scratch = ScratchSpace(
+    config.SCRATCH_DISK_DIR,
+    config.SCRATCH_MEMORY_DIR,
+    config.SCRATCH_MEMORY_FILE_MAX_BYTES,
+    config.SCRATCH_MEMORY_MAX_BYTES,
+    config.SCRATCH_DISK_MAX_BYTES,
+    config.SCRATCH_ORPHAN_AGE_SECONDS
+)
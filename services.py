@@ -1,58 +1,147 @@
-import openai
-import requests
-import tempfile
-import os
-import PyPDF2
+import io
 from pathlib import Path
 import json
+import re
 from fastapi import HTTPException
 import config
 
 import mimetypes
+from functools import lru_cache
 from typing import Optional
 
-from langdetect import detect, LangDetectException
 import uuid
-import os
-from dotenv import load_dotenv
-import openai
+import hashlib
+import threading
+import time
 
 import subprocess          
-import imageio_ffmpeg
-import requests
 
-load_dotenv()  # Loads variables from .env 
+from resilience import resilient_call
+from cache import make_key, cache_get, cache_set, cache_clear
+from tokens import estimate_chat_tokens
+from scratch import scratch
+import preflight
+import accounting
+from accounting import stage, run_subprocess
 
+# openai, PyPDF2, requests and imageio_ffmpeg are imported inside the functions that
+# use them so importing this module stays cheap; warm_up() loads them ahead of time.
 
 
+@lru_cache(maxsize=1)
+def get_openai_client():
+    """Shared OpenAI client, reused across requests and threads"""
+    import openai
+    # SDK retries are disabled: resilient_call owns retries, backoff and timeouts
+    return openai.OpenAI(api_key=config.get_settings().openai_api_key, max_retries=0)
 
 
-openai.api_key = os.getenv("OPENAI_API_KEY")
+def import_dependencies():
+    """Import heavy modules only; safe to run in a pre-fork master process"""
+    import openai
+    import PyPDF2
+    import requests
+    import imageio_ffmpeg
+    import cloudinary.uploader
+    import psycopg2.extras
+
+
+def warm_up():
+    """Import heavy dependencies and build shared clients ahead of the first request"""
+    import imageio_ffmpeg
+    from database import configure_cloudinary
+
+    import_dependencies()
+    get_openai_client()
+    imageio_ffmpeg.get_ffmpeg_exe()
+    configure_cloudinary()
+
+
+_url_validators = {}
+_url_validators_lock = threading.Lock()
+
+
+def _url_validator(url: str) -> Optional[str]:
+    """ETag or Last-Modified of a URL from a HEAD request, or None if it has neither.
+
+    Remembered for URL_VALIDATOR_MEMO_SECONDS so the lookups of one request (PDF text,
+    rubric, audio) share a single HEAD.
+    """
+    import requests
+
+    now = time.monotonic()
+    with _url_validators_lock:
+        memo = _url_validators.get(url)
+        if memo and now - memo[0] < config.URL_VALIDATOR_MEMO_SECONDS:
+            return memo[1]
+
+    validator = None
+    try:
+        response = requests.head(url, timeout=config.URL_VALIDATOR_TIMEOUT_SECONDS, allow_redirects=True)
+        if response.ok:
+            tag = response.headers.get("ETag") or response.headers.get("Last-Modified")
+            if tag:
+                validator = f"{tag}|{response.headers.get('Content-Length', '')}"
+    except requests.RequestException as e:
+        print(f"HEAD {url} failed, caching by URL briefly: {e}")
+
+    with _url_validators_lock:
+        if len(_url_validators) > 1000:
+            _url_validators.clear()
+        _url_validators[url] = (now, validator)
+    return validator
+
+
+def url_cache_key(url: str, *parts):
+    """Cache key and TTL for something derived from the file at url.
+
+    The file's validator is part of the key, so a PDF or recording re-uploaded under
+    the same URL is a miss. Without one the entry lives only
+    URL_CACHE_UNVALIDATED_TTL_SECONDS; content-fingerprint keys stay long-lived.
+    """
+    validator = _url_validator(url)
+    ttl = None if validator else config.URL_CACHE_UNVALIDATED_TTL_SECONDS
+    return make_key(url, validator or "", *parts), ttl
+
+
+def extract_text_from_pdf_url(pdf_url: str, max_size_mb: float = config.PDF_MAX_SIZE_MB) -> str:
+    import requests
+    import PyPDF2
 
-def extract_text_from_pdf_url(pdf_url: str, max_size_mb: int = 5) -> str:
     if not pdf_url or not pdf_url.strip():
         raise ValueError("PDF URL cannot be empty")
     
     if not pdf_url.startswith(('http://', 'https://')):
         raise ValueError("Invalid PDF URL format")
+
+    cache_key, url_ttl = url_cache_key(pdf_url)
+    cached_text = cache_get("pdf_text", cache_key)
+    if cached_text is not None:
+        return cached_text
     
     try:
-        response = requests.get(pdf_url)
-        response.raise_for_status()
-        
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as temp_file:
-            temp_file.write(response.content)
-            temp_file_path = temp_file.name
+        with stage("pdf_download"):
+            with requests.get(pdf_url, timeout=30, stream=True) as response:
+                response.raise_for_status()
+                pdf_bytes = preflight.read_limited_body(response, max_size_mb, "PDF")
+            accounting.add_bytes_down(len(pdf_bytes))
         
+        # Parsed straight from memory: the PDF never touches scratch space
         text = ""
-        with open(temp_file_path, 'rb') as file:
-            pdf_reader = PyPDF2.PdfReader(file)
+        with stage("pdf_parse"):
+            pdf_reader = PyPDF2.PdfReader(io.BytesIO(pdf_bytes))
+            # Page count is read from the xref table; reject before extracting any text
+            page_count = len(pdf_reader.pages)
+            preflight.check_pdf_pages(page_count)
             for page in pdf_reader.pages:
                 text += page.extract_text()
+        text = text.strip()
+        preflight.check_pdf_text(text, page_count)
+        cache_set("pdf_text", cache_key, text, ttl=url_ttl)
+        return text
         
-        os.unlink(temp_file_path)
-        return text.strip()
-        
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"PDF text extraction failed: {e}")
         raise HTTPException(status_code=500, detail=f"PDF extraction failed: {str(e)}")
@@ -72,7 +161,7 @@ def chunk_text(text, max_chars=4000):
 
 def identify_speakers_and_assign_voices(text):
     try:
-        client = openai.OpenAI(api_key=config.OPENAI_API_KEY)
+        client = get_openai_client()
         
         system_prompt = (
             "Analyze the text and identify different speakers. Return a JSON object with:"
@@ -82,12 +171,17 @@ def identify_speakers_and_assign_voices(text):
             "If no dialogue/multiple speakers found, return single speaker with all text."
         )
         
-        response = client.chat.completions.create(
-            model=config.OPENAI_CHAT_MODEL,
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": text}
-            ],
+        messages = [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": text}
+        ]
+        response = resilient_call(
+            "speaker_analysis",
+            config.OPENAI_CHAT_MODEL,
+            client.chat.completions,
+            hedge=True,
+            estimated_tokens=estimate_chat_tokens(messages, config.OPENAI_CHAT_MODEL, config.OPENAI_COMPLETION_TOKEN_ESTIMATE),
+            messages=messages,
             temperature=0
         )
         
@@ -130,92 +224,147 @@ def assign_voice_to_speaker(speaker_id, voice_type, assigned_voices):
     # print(f"Assigned voice '{voice}' to speaker '{speaker_id}' (type: {voice_type})")
     return voice
 
+# TTS response_format -> (segment extension, output extension, extra ffmpeg output options).
+# Segments are joined with the concat demuxer in stream-copy mode, so there is no re-encode;
+# ADTS AAC segments are remuxed into an MP4 container that players can seek in.
+TTS_OUTPUT_FORMATS = {
+    "mp3": ("mp3", "mp3", []),
+    "opus": ("opus", "opus", []),
+    "aac": ("aac", "m4a", ["-bsf:a", "aac_adtstoasc", "-movflags", "+faststart"]),
+}
+
+
+def concat_audio_segments(segment_paths, output_path, response_format):
+    """Join same-codec segments losslessly: ffmpeg concat demuxer with -c copy"""
+    import imageio_ffmpeg
+
+    _, _, output_options = TTS_OUTPUT_FORMATS[response_format]
+    list_path = Path(output_path).with_suffix(".txt")
+    with open(list_path, "w") as f:
+        for path in segment_paths:
+            escaped = str(Path(path).resolve()).replace("'", "'\\''")
+            f.write(f"file '{escaped}'\n")
+    try:
+        run_subprocess(
+            [imageio_ffmpeg.get_ffmpeg_exe(), "-hide_banner", "-loglevel", "error",
+             "-f", "concat", "-safe", "0", "-i", str(list_path),
+             "-c", "copy", *output_options, "-y", str(output_path)],
+            check=True
+        )
+    except subprocess.CalledProcessError as e:
+        raise RuntimeError(f"Audio concatenation failed: {e.stderr.strip()}")
+    finally:
+        list_path.unlink(missing_ok=True)
+
+
 from database import upload_audio_file_to_cloudinary
 def generate_audio_from_pdf(pdf_url):
-    chunk_files = []
-    local_audio_path = None
+    response_format = config.OPENAI_TTS_RESPONSE_FORMAT
+    if response_format not in TTS_OUTPUT_FORMATS:
+        raise HTTPException(status_code=500, detail=f"Unsupported TTS response format: {response_format}")
+    segment_ext, output_ext, _ = TTS_OUTPUT_FORMATS[response_format]
+
+    cache_key, url_ttl = url_cache_key(pdf_url, config.OPENAI_TTS_MODEL, response_format)
+    cached_audio = cache_get("audio", cache_key)
+    if cached_audio is not None:
+        return cached_audio
     
     try:
         text = extract_text_from_pdf_url(pdf_url)
 
         if not text:
             raise HTTPException(status_code=400, detail="No text found in PDF")
+
+        # The same scenario text uploaded under another URL reuses the audio already generated
+        content_key = make_key(
+            "text", preflight.content_fingerprint(text), config.OPENAI_TTS_MODEL, response_format
+        )
+        cached_audio = cache_get("audio", content_key)
+        if cached_audio is not None:
+            cache_set("audio", cache_key, cached_audio, ttl=url_ttl)
+            return cached_audio
         
-        speaker_analysis = identify_speakers_and_assign_voices(text)
+        with stage("speaker_analysis"):
+            speaker_analysis = identify_speakers_and_assign_voices(text)
         assigned_voices = {}
 
-        client = openai.OpenAI(api_key=config.OPENAI_API_KEY)
-        
-        audio_dir = Path("audio_files")
-        audio_dir.mkdir(exist_ok=True)
-        cloudinary_unique_id = uuid.uuid4()
-        local_audio_path = audio_dir / f"{cloudinary_unique_id}.mp3"
-        
-        # Generate audio chunks
-        for i, dialogue_item in enumerate(speaker_analysis["dialogue"]):
-            speaker_id = dialogue_item["speaker_id"]
-            text_content = dialogue_item["text"]
-            voice_type = dialogue_item["voice_type"]
-            
-            voice = assign_voice_to_speaker(speaker_id, voice_type, assigned_voices)
-            text_chunks = chunk_text(text_content, max_chars=4000)
-            
-            for j, chunk in enumerate(text_chunks):
-                response = client.audio.speech.create(
-                    model=config.OPENAI_TTS_MODEL,
-                    voice=voice,
-                    input=chunk
-                )
-                
-                chunk_id = uuid.uuid4()
-                chunk_path = audio_dir / f"chunk_{chunk_id}_speaker_{speaker_id}_{i}_{j}.mp3"
-                
-                with open(chunk_path, 'wb') as f:
-                    for chunk_bytes in response.iter_bytes():
-                        f.write(chunk_bytes)
-                
-                chunk_files.append(chunk_path)
-        
-        # Combine all chunks
-        all_audio_data = b''
-        for chunk_file in chunk_files:
-            with open(chunk_file, 'rb') as f:
-                all_audio_data += f.read()
-        
-        with open(local_audio_path, 'wb') as f:
-            f.write(all_audio_data)
-        
-        # Remove individual chunks
-        for chunk_file in chunk_files:
-            if chunk_file.exists():
-                chunk_file.unlink()
-        chunk_files = []
-        
-        # Upload to Cloudinary
-        cloudinary_audio_unique_id = uuid.uuid4()
-        audio_url = upload_audio_file_to_cloudinary(str(local_audio_path), f"{cloudinary_audio_unique_id}")
-        # print("Uploaded to Cloudinary:", audio_url)
+        client = get_openai_client()
+
+        # Segments and the joined file live in a per-request scratch workspace, removed on exit
+        with scratch.workspace() as workspace:
+            chunk_files = []
+
+            # Generate audio chunks
+            for i, dialogue_item in enumerate(speaker_analysis["dialogue"]):
+                speaker_id = dialogue_item["speaker_id"]
+                text_content = dialogue_item["text"]
+                voice_type = dialogue_item["voice_type"]
+
+                voice = assign_voice_to_speaker(speaker_id, voice_type, assigned_voices)
+                text_chunks = chunk_text(text_content, max_chars=4000)
+
+                for j, chunk in enumerate(text_chunks):
+                    with stage("tts"):
+                        response = resilient_call(
+                            "tts",
+                            config.OPENAI_TTS_MODEL,
+                            client.audio.speech,
+                            hedge=True,
+                            voice=voice,
+                            input=chunk,
+                            response_format=response_format
+                        )
+                        segment = b"".join(response.iter_bytes())
+                    accounting.add_tts_characters(len(chunk))
+                    accounting.add_bytes_down(len(segment))
+                    chunk_files.append(workspace.write(f"chunk_{speaker_id}_{i}_{j}.{segment_ext}", segment))
+
+            if not chunk_files:
+                raise HTTPException(status_code=400, detail="No dialogue found to synthesize")
+
+            # Combine all chunks on frame boundaries instead of gluing raw bytes together
+            local_audio_path = workspace.path(
+                f"{uuid.uuid4()}.{output_ext}",
+                size_hint=sum(path.stat().st_size for path in chunk_files)
+            )
+            with stage("concat"):
+                concat_audio_segments(chunk_files, local_audio_path, response_format)
+
+            audio_size = local_audio_path.stat().st_size
+            duration = preflight.probe_audio(str(local_audio_path))["duration"]
+            bitrate_kbps = round(audio_size * 8 / duration / 1000, 1) if duration else None
+            accounting.add_audio_seconds(duration)
+            print(
+                f"Reference audio: {response_format}, {audio_size} bytes, "
+                f"{duration or 0:.1f}s, {bitrate_kbps or 0} kbps"
+            )
+
+            # Upload to Cloudinary
+            cloudinary_audio_unique_id = uuid.uuid4()
+            with stage("upload"):
+                audio_url = upload_audio_file_to_cloudinary(str(local_audio_path), f"{cloudinary_audio_unique_id}")
+            accounting.add_bytes_up(audio_size)
+            # print("Uploaded to Cloudinary:", audio_url)
 
         if not audio_url:
             raise HTTPException(status_code=500, detail="Failed to upload audio to Cloudinary")
 
-        if local_audio_path and local_audio_path.exists():
-            local_audio_path.unlink()
-
-        return {
+        result = {
             "cloudinary_url": audio_url,
+            "audio_format": output_ext,
+            "audio_size": audio_size,
+            "audio_duration": duration,
+            "audio_bitrate_kbps": bitrate_kbps,
         }
+        cache_set("audio", cache_key, result, ttl=url_ttl)
+        cache_set("audio", content_key, result)
+        return result
             
     except Exception as e:
-        # Cleanup on error
-        for chunk_file in chunk_files:
-            if chunk_file.exists():
-                chunk_file.unlink()
-        
-        if local_audio_path and local_audio_path.exists():
-            local_audio_path.unlink()
-            
         print(f"Audio generation from PDF failed: {e}")
+        if isinstance(e, HTTPException):
+            # Keep deadline (504), circuit-open (503) and input (400) statuses intact
+            raise
         raise HTTPException(status_code=500, detail=str(e))
 
 
@@ -246,50 +395,100 @@ def generate_audio_from_pdf(pdf_url):
 ###########################################################################################
 
 
-def transcribe_audio_from_url(audio_url: str, file_format: str):
-    temp_original_path = None
-    temp_converted_path = None
+def prepare_audio_submission(audio_url: str, file_format: str) -> dict:
+    """Download, probe and convert a submission without any OpenAI call.
 
-    try:
-        client = openai.OpenAI(api_key=config.OPENAI_API_KEY)
+    Returns {"transcription": ...} when the audio was transcribed before (same URL or
+    same bytes), otherwise the converted upload for transcribe_prepared_audio().
+    """
+    import requests
+    import imageio_ffmpeg
 
+    url_key, url_ttl = url_cache_key(audio_url, file_format, config.OPENAI_TRANSCRIBE_MODEL)
+    cached_transcription = cache_get("transcription", url_key)
+    if cached_transcription is not None:
+        return {"transcription": cached_transcription}
+
+    try:
         # 1. DOWNLOAD AUDIO FROM URL
-        response = requests.get(audio_url, timeout=30)
-        response.raise_for_status()
-        audio_bytes = response.content
+        with stage("audio_download"):
+            with requests.get(audio_url, timeout=30, stream=True) as response:
+                response.raise_for_status()
+                audio_bytes = preflight.read_limited_body(response, config.AUDIO_MAX_DOWNLOAD_MB, "Audio file")
+        accounting.add_bytes_down(len(audio_bytes))
 
         if not audio_bytes:
             raise HTTPException(status_code=400, detail="Downloaded audio file is empty")
 
-        # 2. SAVE ORIGINAL FILE
-        clean_ext = file_format.split('/')[-1].replace('.', '')
+        # A resubmitted recording under a new URL is the same transcription
+        content_key = make_key(hashlib.sha256(audio_bytes).hexdigest(), config.OPENAI_TRANSCRIBE_MODEL)
+        cached_transcription = cache_get("transcription", content_key)
+        if cached_transcription is not None:
+            cache_set("transcription", url_key, cached_transcription, ttl=url_ttl)
+            return {"transcription": cached_transcription}
+
+        # Working files live in a per-request scratch workspace, removed on exit
+        with scratch.workspace() as workspace:
+            # 2. SAVE ORIGINAL FILE
+            clean_ext = file_format.split('/')[-1].replace('.', '')
+            original_path = workspace.write(f"original.{clean_ext}", audio_bytes)
+
+            # 3. PROBE: reject files with no audio, or too short/long, before converting
+            with stage("probe"):
+                preflight.check_audio(preflight.probe_audio(str(original_path)))
+
+            # 4. DEFINE OUTPUT PATH
+            converted_path = workspace.path("converted.mp3", size_hint=len(audio_bytes))
+
+            # 5. CONVERT USING FFMPEG (volumedetect passes audio through and reports the peak level)
+            ffmpeg_exe = imageio_ffmpeg.get_ffmpeg_exe()
+
+            with stage("convert"):
+                conversion = run_subprocess(
+                    [ffmpeg_exe, "-i", str(original_path), "-af", "volumedetect", "-y", str(converted_path)],
+                    check=True
+                )
+            preflight.check_not_silent(conversion.stderr)
 
-        with tempfile.NamedTemporaryFile(delete=False, suffix=f".{clean_ext}") as tmp_file:
-            tmp_file.write(audio_bytes)
-            temp_original_path = tmp_file.name
+            # Sent as bytes so a hedged duplicate request can resend the same upload
+            converted_bytes = converted_path.read_bytes()
 
-        # 3. DEFINE OUTPUT PATH
-        temp_converted_path = temp_original_path + "_converted.mp3"
+        return {
+            "filename": f"{content_key[:16]}.mp3",
+            "audio_bytes": converted_bytes,
+            "cache_keys": [(url_key, url_ttl), (content_key, None)],
+        }
 
-        # 4. CONVERT USING FFMPEG
-        ffmpeg_exe = imageio_ffmpeg.get_ffmpeg_exe()
+    except HTTPException:
+        raise
+    except requests.RequestException as e:
+        raise HTTPException(status_code=500, detail=f"Failed to download audio: {str(e)}")
+    except subprocess.CalledProcessError:
+        raise HTTPException(status_code=400, detail="Audio file could not be converted")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Transcription failed: {str(e)}")
 
-        subprocess.run(
-            [ffmpeg_exe, "-i", temp_original_path, "-y", temp_converted_path],
-            check=True,
-            stdout=subprocess.DEVNULL,
-            stderr=subprocess.DEVNULL
-        )
 
-        # 5. TRANSCRIBE
-        with open(temp_converted_path, "rb") as audio_file:
-            transcription = client.audio.transcriptions.create(
-                model=config.OPENAI_TRANSCRIBE_MODEL,
-                file=audio_file,
+def transcribe_prepared_audio(prepared: dict) -> dict:
+    if "transcription" in prepared:
+        return prepared["transcription"]
+
+    try:
+        client = get_openai_client()
+
+        # TRANSCRIBE
+        with stage("transcribe"):
+            transcription = resilient_call(
+                "transcription",
+                config.OPENAI_TRANSCRIBE_MODEL,
+                client.audio.transcriptions,
+                hedge=True,
+                file=(prepared["filename"], prepared["audio_bytes"]),
                 response_format="json",
                 language="en",
                 prompt="This is an English transcription."
             )
+        accounting.add_bytes_up(len(prepared["audio_bytes"]))
 
         transcription_dict = transcription.model_dump()
         text = transcription_dict.get("text", "").strip()
@@ -304,22 +503,20 @@ def transcribe_audio_from_url(audio_url: str, file_format: str):
             "Submission": text,
             "Seconds": transcription_dict.get("usage", {}).get("seconds")
         }
+        accounting.add_audio_seconds(structured_output["Seconds"])
 
+        for cache_key, ttl in prepared["cache_keys"]:
+            cache_set("transcription", cache_key, structured_output, ttl=ttl)
         return structured_output
 
     except HTTPException:
         raise
-    except requests.RequestException as e:
-        raise HTTPException(status_code=500, detail=f"Failed to download audio: {str(e)}")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Transcription failed: {str(e)}")
-    finally:
-        for path in [temp_original_path, temp_converted_path]:
-            if path and os.path.exists(path):
-                try:
-                    os.unlink(path)
-                except Exception:
-                    pass
+
+
+def transcribe_audio_from_url(audio_url: str, file_format: str):
+    return transcribe_prepared_audio(prepare_audio_submission(audio_url, file_format))
 
 
 
@@ -332,17 +529,30 @@ def transcribe_audio_from_url(audio_url: str, file_format: str):
 
 
 def process_pdf_for_instructions(pdf_url):
+    import requests
+
     # from database import get_pdfUrl_according_to_scenario
     
     # pdf_url = get_pdfUrl_according_to_scenario(scenario_id=scenario_id)
     
     if not pdf_url:  # This check should raise an exception
         raise HTTPException(status_code=404, detail="Scenario not found or PDF URL missing")
+
+    cache_key, url_ttl = url_cache_key(pdf_url, config.OPENAI_CHAT_MODEL)
+    cached_rubric = cache_get("rubric", cache_key)
+    if cached_rubric is not None:
+        return cached_rubric
     
 
     try:
         text = extract_text_from_pdf_url(pdf_url)
         #print("Extracted PDF Text:", text)
+
+        content_key = make_key("text", preflight.content_fingerprint(text), config.OPENAI_CHAT_MODEL)
+        cached_rubric = cache_get("rubric", content_key)
+        if cached_rubric is not None:
+            cache_set("rubric", cache_key, cached_rubric, ttl=url_ttl)
+            return cached_rubric
         # file = open(pdf_url, "rb")
 
         # # Create reader
@@ -371,15 +581,21 @@ def process_pdf_for_instructions(pdf_url):
         )
 
         # Step 5: Send to OpenAI
-        client = openai.OpenAI()
-        response = client.chat.completions.create(
-            model=config.OPENAI_CHAT_MODEL,
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": text}
-            ],
-            temperature=0
-        )
+        client = get_openai_client()
+        messages = [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": text}
+        ]
+        with stage("rubric"):
+            response = resilient_call(
+                "rubric",
+                config.OPENAI_CHAT_MODEL,
+                client.chat.completions,
+                hedge=True,
+                estimated_tokens=estimate_chat_tokens(messages, config.OPENAI_CHAT_MODEL, config.OPENAI_COMPLETION_TOKEN_ESTIMATE),
+                messages=messages,
+                temperature=0
+            )
 
         # Get raw string output
         structured_output = response.choices[0].message.content
@@ -402,8 +618,16 @@ def process_pdf_for_instructions(pdf_url):
         # print()
         # print("stracture output:", structured_output_json)
 
+        # Only a parsed rubric is worth sharing; raw text falls through uncached
+        if isinstance(structured_output_json, list) and structured_output_json:
+            cache_set("rubric", cache_key, structured_output_json, ttl=url_ttl)
+            cache_set("rubric", content_key, structured_output_json)
+
         return structured_output_json
 
+    except HTTPException:
+        # Deadline and circuit-breaker errors must reach the client as-is
+        raise
     except requests.RequestException as e:
         print(f"Failed to download PDF: {e}")
     except Exception as e:
@@ -416,101 +640,442 @@ def process_pdf_for_instructions(pdf_url):
 
 
 
-import json
-import openai
-# import config  # Ensure config with OPENAI_API_KEY is imported
-
-def report(transcription, instructions):
-    client = openai.OpenAI(api_key=config.OPENAI_API_KEY)
-
-    results = []
-    chunk_size = 3  # Send instructions in chunks
-
-    # Break the instructions into chunks
-    for i in range(0, len(instructions), chunk_size):
-        chunk = instructions[i:i+chunk_size]
-
-        prompt = {
-            "role": "system",
-            "content": (
-                "You are a grading assistant specialized in Legal Advocacy in the UK. "
-                "Evaluate a student's oral or written submission against the provided instructions in a fair, professional manner. "
-                # IMPORTANT: You must mention 'JSON' in the prompt for JSON mode to work
-                "Return a JSON object strictly following this structure: "
-                "{'TotalScore': int, 'Positive': [str], 'Negative': [str], 'Improvement': [str]}. "
-                "All text should be in clear UK English. "
-                "Do not include any explanations outside the JSON."
+from tokens import count_tokens, compact_json, batch_by_token_budget
+
+GRADING_SYSTEM_PROMPT = (
+    "You are a grading assistant specialized in Legal Advocacy in the UK. "
+    "Evaluate a student's oral or written submission against the provided instructions in a fair, professional manner. "
+    # IMPORTANT: You must mention 'JSON' in the prompt for JSON mode to work
+    "Grade every instruction separately against its MaxMarks. "
+    "Return a JSON object strictly following this structure: "
+    "{'Results': [{'id': <instruction id>, 'Score': number, 'Positive': [str], 'Negative': [str], 'Improvement': [str]}]} "
+    "with exactly one entry per instruction. "
+    "All text should be in clear UK English. "
+    "Do not include any explanations outside the JSON."
+)
+
+
+# Single-call mode: the whole rubric in one request, answer constrained by a strict schema.
+# Scores are raw per-instruction marks; totals are computed locally, never by the model.
+GRADING_STRUCTURED_SYSTEM_PROMPT = (
+    "You are a grading assistant specialized in Legal Advocacy in the UK. "
+    "Evaluate a student's oral or written submission against the provided instructions in a fair, professional manner. "
+    "Grade every instruction separately: 'score' is the marks awarded, between 0 and the instruction's MaxMarks, "
+    "and 'max' is that MaxMarks. Return exactly one entry per instruction id, with Positive, Negative and "
+    "Improvement points for that instruction. Do not compute a total. "
+    "All text should be in clear UK English."
+)
+
+GRADING_RESULT_SCHEMA = {
+    "name": "grading_results",
+    "strict": True,
+    "schema": {
+        "type": "object",
+        "additionalProperties": False,
+        "required": ["Results"],
+        "properties": {
+            "Results": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "additionalProperties": False,
+                    "required": ["id", "score", "max", "Positive", "Negative", "Improvement"],
+                    "properties": {
+                        "id": {"type": "string"},
+                        "score": {"type": "number"},
+                        "max": {"type": "number"},
+                        "Positive": {"type": "array", "items": {"type": "string"}},
+                        "Negative": {"type": "array", "items": {"type": "string"}},
+                        "Improvement": {"type": "array", "items": {"type": "string"}},
+                    },
+                },
+            },
+        },
+    },
+}
+
+
+# Changes to the grading prompts or an explicit GRADING_CACHE_VERSION bump change every
+# grading cache key, so stale reports are never served and simply age out of the LRU.
+GRADING_PROMPT_VERSION = hashlib.sha256(
+    f"{config.GRADING_CACHE_VERSION}:{GRADING_SYSTEM_PROMPT}:{GRADING_STRUCTURED_SYSTEM_PROMPT}:"
+    f"{json.dumps(GRADING_RESULT_SCHEMA, sort_keys=True)}".encode("utf-8")
+).hexdigest()[:16]
+
+
+def transcript_hash(transcription) -> str:
+    if isinstance(transcription, dict):
+        text = transcription.get("Submission", "")
+        seconds = transcription.get("Seconds")
+    else:
+        text = transcription
+        seconds = None
+    return make_key(preflight.normalize_text(text), seconds)
+
+
+def instruction_hash(instruction) -> str:
+    return make_key(json.dumps(instruction, sort_keys=True, separators=(",", ":"), ensure_ascii=False))
+
+
+def instruction_id(instruction, index: int) -> str:
+    if isinstance(instruction, dict) and instruction.get("id") is not None:
+        return str(instruction["id"])
+    return str(index + 1)
+
+
+def chunk_for_model(chunk, indexes):
+    """Instructions as sent to the model, and the id each answer must carry.
+
+    Rubric ids are kept where they are unique within the chunk; a missing or
+    repeated id is replaced by a chunk-unique one so every answer maps back to
+    exactly one instruction.
+    """
+    model_chunk, chunk_ids = [], []
+    for instruction, index in zip(chunk, indexes):
+        key = instruction_id(instruction, index)
+        if key in chunk_ids:
+            key = f"{key}#{index + 1}"
+        if isinstance(instruction, dict) and str(instruction.get("id")) != key:
+            instruction = dict(instruction, id=key)
+        model_chunk.append(instruction)
+        chunk_ids.append(key)
+    return model_chunk, chunk_ids
+
+
+def grading_cache_key(transcription, instructions, model: str) -> str:
+    """normalized transcript hash + rubric hash + model + prompt version"""
+    rubric_hash = make_key(json.dumps(instructions, sort_keys=True, separators=(",", ":"), ensure_ascii=False))
+    return make_key(transcript_hash(transcription), rubric_hash, model, GRADING_PROMPT_VERSION)
+
+
+def instruction_cache_key(submission_hash: str, instruction, model: str) -> str:
+    """Per-instruction result key: an edited instruction text or MaxMarks gets a new key"""
+    return make_key(submission_hash, instruction_hash(instruction), model, GRADING_PROMPT_VERSION)
+
+
+def invalidate_grading_cache():
+    """Drop every cached grading report, e.g. after editing the prompt without a version bump"""
+    cache_clear("grading_report")
+    cache_clear("instruction_grade")
+
+
+def build_submission_message(transcription):
+    """Shared prompt prefix: identical for every chunk of the same submission"""
+    if isinstance(transcription, dict):
+        text = transcription.get("Submission", "")
+        seconds = transcription.get("Seconds")
+    else:
+        text = transcription
+        seconds = None
+
+    content = f"Submission:\n{text}"
+    if seconds is not None:
+        content += f"\n\nDuration (seconds): {seconds}"
+    return {"role": "user", "content": content}
+
+
+def select_grading_engine(transcription, instructions):
+    """(model, single_call): one structured call when the whole rubric fits, chunked calls otherwise"""
+    if config.GRADING_MODE == "single" and isinstance(instructions, list):
+        model = config.OPENAI_STRUCTURED_GRADING_MODEL
+        if len(instructions) <= config.GRADING_SINGLE_CALL_MAX_INSTRUCTIONS:
+            prompt_tokens = (
+                count_tokens(GRADING_STRUCTURED_SYSTEM_PROMPT, model)
+                + count_tokens(build_submission_message(transcription)["content"], model)
+                + count_tokens(compact_json({"Instructions": instructions}), model)
             )
-        }
+            if prompt_tokens <= config.GRADING_SINGLE_CALL_MAX_PROMPT_TOKENS:
+                return model, True
+        print(f"Rubric with {len(instructions)} instruction(s) is too large for one grading call; using chunked mode")
+    return config.OPENAI_GRADING_MODEL, False
+
+
+def max_marks(instruction) -> Optional[float]:
+    """MaxMarks as a number ('15', 15 or '15%'), or None when missing"""
+    value = instruction.get("MaxMarks") if isinstance(instruction, dict) else None
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value) if value > 0 else None
+    match = re.search(r"\d+(?:\.\d+)?", str(value or ""))
+    if match and float(match.group()) > 0:
+        return float(match.group())
+    return None
+
+
+def _grade_limit(grade: dict, instruction) -> Optional[float]:
+    # The rubric's MaxMarks is authoritative; the model's echoed "max" only fills a gap
+    return max_marks(instruction) or max_marks({"MaxMarks": grade.get("Max")})
+
+
+def clamp_grade(grade: dict, instruction) -> dict:
+    """Keep a per-instruction score within 0..MaxMarks, whatever the model returned"""
+    score = max(_as_score(grade.get("Score")), 0.0)
+    limit = _grade_limit(grade, instruction)
+    if limit is not None:
+        score = min(score, limit)
+    return dict(grade, Score=score)
+
+
+def total_score(results, instructions) -> float:
+    """Total as a 0-100 share of the rubric's MaxMarks, from clamped per-instruction scores"""
+    earned = sum(result["Score"] for result in results)
+    limits = [_grade_limit(result, instruction) for result, instruction in zip(results, instructions)]
+    if limits and None not in limits:
+        return round(100 * earned / sum(limits), 2)
+    return round(min(max(earned, 0.0), 100.0), 2)
+
+
+def estimate_token_savings(transcription, all_instructions, batches, submission_message, model,
+                           system_prompt=GRADING_SYSTEM_PROMPT):
+    """Compare prompt tokens against the old fixed 3-instruction, indent=2 layout"""
+    legacy_tokens = 0
+    for i in range(0, len(all_instructions), 3):
+        legacy_payload = json.dumps({
+            "Submission": transcription,
+            "Instructions": all_instructions[i:i+3]
+        }, indent=2, ensure_ascii=False)
+        legacy_tokens += count_tokens(GRADING_SYSTEM_PROMPT, model) + count_tokens(legacy_payload, model)
+
+    prefix_tokens = count_tokens(system_prompt, model) + count_tokens(submission_message["content"], model)
+    lean_tokens = sum(
+        prefix_tokens + count_tokens(compact_json({"Instructions": batch}), model)
+        for batch in batches
+    )
+
+    return {
+        "Chunks": len(batches),
+        "CachedInstructions": len(all_instructions) - sum(len(batch) for batch in batches),
+        "PromptTokens": lean_tokens,
+        "LegacyPromptTokens": legacy_tokens,
+        "TokensSaved": max(legacy_tokens - lean_tokens, 0),
+        "SharedPrefixTokens": prefix_tokens
+    }
+
 
-        user_input = {
-            "role": "user",
-            "content": json.dumps({
-                "Submission": transcription,
-                "Instructions": chunk
-            }, indent=2, ensure_ascii=False)
+def report(transcription, instructions, on_chunk=None):
+    """Grade a transcription against rubric instructions.
+
+    on_chunk, if given, is called with each batch's partial result as soon as it is
+    graded (and once up front for instructions served from the cache).
+    """
+    model, single_call = select_grading_engine(transcription, instructions)
+
+    # temperature=0 grading is repeatable: serve retries and refreshes from the cache
+    cache_key = grading_cache_key(transcription, instructions, model)
+    cached_report = cache_get("grading_report", cache_key)
+    if cached_report is not None:
+        legacy_tokens = (cached_report.get("TokenStats") or {}).get("LegacyPromptTokens", 0)
+        cached_report["TokenStats"] = {
+            "Chunks": 0,
+            "PromptTokens": 0,
+            "LegacyPromptTokens": legacy_tokens,
+            "TokensSaved": legacy_tokens,
+            "CacheHit": 1
         }
+        print("Grading report served from cache.")
+        return cached_report
+
+    if not isinstance(instructions, list):
+        raise ValueError("Marking instructions could not be parsed into a list")
+
+    client = get_openai_client()
+    failed_chunks = 0
+
+    # Re-use per-instruction grades for unchanged instructions; only new or edited
+    # ones are sent to the model.
+    # Grades are keyed by rubric position: ids may be missing or repeated in a rubric
+    submission_hash = transcript_hash(transcription)
+    per_instruction = {}
+    pending = []
+    for index, instruction in enumerate(instructions):
+        cached_grade = cache_get("instruction_grade", instruction_cache_key(submission_hash, instruction, model))
+        if cached_grade is not None:
+            per_instruction[index] = dict(cached_grade, id=instruction_id(instruction, index))
+        else:
+            pending.append(index)
 
-        # --- RETRY LOGIC STARTS HERE ---
-        max_retries = 3
-        attempt = 0
-        chunk_result = None
-
-        while attempt < max_retries:
-            try:
-                # API Call with JSON Enforcement
-                response = client.chat.completions.create(
-                    model="gpt-4-turbo",  # MUST use gpt-4-turbo, gpt-4o, or gpt-3.5-turbo-0125 for JSON mode
-                    messages=[prompt, user_input],
-                    temperature=0,
-                    response_format={"type": "json_object"}  # <--- CRITICAL: Forces valid JSON
-                )
+    def clamped(indexed_grades):
+        return [clamp_grade(grade, instructions[index]) for index, grade in indexed_grades]
 
-                raw_content = response.choices[0].message.content
-                
-                # Parse JSON
-                result = json.loads(raw_content)
-
-                # VALIDATION: Check if essential keys exist
-                if "TotalScore" in result:
-                    chunk_result = result
-                    # Success! Break the retry loop
-                    break  
-                else:
-                    print(f"Chunk {i}: Attempt {attempt+1} failed - Missing 'TotalScore'. Retrying...")
-                    attempt += 1
-
-            except json.JSONDecodeError:
-                print(f"Chunk {i}: Attempt {attempt+1} failed - Invalid JSON syntax. Retrying...")
-                attempt += 1
-            except Exception as e:
-                print(f"Chunk {i}: Attempt {attempt+1} failed - API Error: {e}. Retrying...")
-                attempt += 1
-        
-        # --- FALLBACK (Only if all 3 attempts fail) ---
-        if chunk_result is None:
-            print(f"CRITICAL: Failed to grade chunk {i} after {max_retries} attempts.")
-            chunk_result = {
-                "TotalScore": 0,
-                "Positive": [],
-                "Negative": ["System Error: Unable to grade this specific section due to repeated API failures."],
-                "Improvement": []
-            }
+    # System prompt + submission are sent first and unchanged for every chunk so the
+    # provider can reuse the cached prefix; only the instruction batch varies.
+    system_prompt = GRADING_STRUCTURED_SYSTEM_PROMPT if single_call else GRADING_SYSTEM_PROMPT
+    prompt = {"role": "system", "content": system_prompt}
+    submission_message = build_submission_message(transcription)
 
-        
-        results.append(chunk_result)
-        # print()
-        # print(result)
+    if single_call:
+        # Whole rubric in one round trip, answer held to a strict schema
+        batches = [[instructions[index] for index in pending]] if pending else []
+        response_format = {"type": "json_schema", "json_schema": GRADING_RESULT_SCHEMA}
+    else:
+        # Batch instructions by token budget instead of a fixed count per chunk
+        batches = batch_by_token_budget(
+            [instructions[index] for index in pending], config.GRADING_INSTRUCTION_TOKEN_BUDGET, model
+        )
+        response_format = {"type": "json_object"}
+    pending_indexes = iter(pending)
+
+    if on_chunk and per_instruction:
+        cached_results = clamped(per_instruction.items())
+        on_chunk({
+            "chunk": 0,
+            "chunks": len(batches),
+            "cached": True,
+            "failed": False,
+            "report": merge_results(cached_results),
+            "results": cached_results,
+        })
+
+    for i, chunk in enumerate(batches):
+        chunk_indexes = [next(pending_indexes) for _ in chunk]
+        model_chunk, chunk_ids = chunk_for_model(chunk, chunk_indexes)
+        with stage("grading"):
+            chunk_results = grade_instruction_chunk(
+                client, model, prompt, submission_message, model_chunk, chunk_ids, i, response_format
+            )
+
+        # --- FALLBACK (API error, or all 3 attempts returned unusable output) ---
+        chunk_failed = chunk_results is None
+        if chunk_failed:
+            failed_chunks += 1
+            chunk_results = [{"Score": 0, "Positive": [], "Negative": [], "Improvement": []}
+                             for _ in chunk_ids]
+            chunk_results[0]["Negative"] = [
+                "System Error: Unable to grade this specific section due to an API failure."
+            ]
+        else:
+            for instruction, grade in zip(chunk, chunk_results):
+                cache_set(
+                    "instruction_grade",
+                    instruction_cache_key(submission_hash, instruction, model),
+                    grade,
+                    ttl=config.GRADING_CACHE_TTL_SECONDS
+                )
 
-    # Merge results into one final JSON
+        # Results come back in chunk order; report them under the rubric's own id
+        indexed_grades = []
+        for index, grade in zip(chunk_indexes, chunk_results):
+            grade = dict(grade, id=instruction_id(instructions[index], index))
+            per_instruction[index] = grade
+            indexed_grades.append((index, grade))
+
+        if on_chunk:
+            chunk_graded = clamped(indexed_grades)
+            on_chunk({
+                "chunk": i + 1,
+                "chunks": len(batches),
+                "cached": False,
+                "failed": chunk_failed,
+                "report": merge_results(chunk_graded),
+                "results": chunk_graded,
+            })
+
+    # Merge results into one final JSON, in rubric order. The total is computed here
+    # from clamped per-instruction scores, so it always fits GradingReport's 0-100 range.
+    results = clamped((index, per_instruction[index]) for index in range(len(instructions)))
     final_result = merge_results(results)
-    # print()
-    # print(final_result)
+    final_result["TotalScore"] = total_score(results, instructions)
+
+    token_stats = estimate_token_savings(
+        transcription, instructions, batches, submission_message, model, system_prompt
+    )
+    token_stats["SingleCall"] = int(single_call)
+    final_result["TokenStats"] = token_stats
+    print(
+        f"Grading prompt tokens: {token_stats['PromptTokens']} "
+        f"(saved {token_stats['TokensSaved']} vs legacy {token_stats['LegacyPromptTokens']}) "
+        f"across {token_stats['Chunks']} chunk(s), {token_stats['CachedInstructions']} instruction(s) reused"
+    )
     
+    # Never memoize a report that contains a zero-score fallback chunk
+    if failed_chunks == 0:
+        cache_set("grading_report", cache_key, final_result, ttl=config.GRADING_CACHE_TTL_SECONDS)
+
     print("Final grading report generated.")
     return final_result
 
-# Helper function to merge results (remains same)
+
+def _as_score(value) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def grade_instruction_chunk(client, model, prompt, submission_message, chunk, chunk_ids, i,
+                            response_format=None):
+    """Grade one batch of instructions; returns one entry per instruction id, or None on an API
+    error or after 3 malformed/incomplete answers"""
+    user_input = {
+        "role": "user",
+        "content": compact_json({"Instructions": chunk})
+    }
+
+    # --- RETRY LOGIC STARTS HERE ---
+    # Only malformed or incomplete answers are retried here; API retries belong to resilient_call()
+    max_retries = 3
+    attempt = 0
+
+    while attempt < max_retries:
+        try:
+            # API Call with JSON Enforcement
+            messages = [prompt, submission_message, user_input]
+            response = resilient_call(
+                "grading",
+                model,  # MUST use gpt-4-turbo, gpt-4o, or gpt-3.5-turbo-0125 for JSON mode
+                client.chat.completions,
+                hedge=True,
+                estimated_tokens=estimate_chat_tokens(messages, model, config.OPENAI_COMPLETION_TOKEN_ESTIMATE),
+                messages=messages,
+                temperature=0,
+                response_format=response_format or {"type": "json_object"}  # <--- CRITICAL: Forces valid JSON
+            )
+
+            raw_content = response.choices[0].message.content
+            
+            # Parse JSON
+            result = json.loads(raw_content)
+
+            # VALIDATION: every instruction in the chunk must come back with a score
+            # ("Score" in JSON mode, "score"/"max" under the structured-output schema)
+            entries = {str(entry.get("id")): entry for entry in result.get("Results", []) if isinstance(entry, dict)}
+            missing = [
+                key for key in chunk_ids
+                if key not in entries or ("Score" not in entries[key] and "score" not in entries[key])
+            ]
+            if not missing:
+                # Success! Break the retry loop
+                return [
+                    {
+                        "id": key,
+                        "Score": _as_score(entries[key].get("Score", entries[key].get("score"))),
+                        "Max": entries[key].get("max"),
+                        "Positive": entries[key].get("Positive"),
+                        "Negative": entries[key].get("Negative"),
+                        "Improvement": entries[key].get("Improvement")
+                    }
+                    for key in chunk_ids
+                ]
+
+            print(f"Chunk {i}: Attempt {attempt+1} failed - Missing scores for {missing}. Retrying...")
+            attempt += 1
+
+        except HTTPException:
+            # Deadline exceeded or circuit open: retrying the chunk cannot help
+            raise
+        except json.JSONDecodeError:
+            print(f"Chunk {i}: Attempt {attempt+1} failed - Invalid JSON syntax. Retrying...")
+            attempt += 1
+        except Exception as e:
+            # resilient_call() already retried transient errors with backoff; anything
+            # left (4xx, limiter timeout, exhausted retries) will not fix itself here
+            print(f"CRITICAL: Failed to grade chunk {i} - API Error: {e}")
+            return None
+
+    print(f"CRITICAL: Failed to grade chunk {i} after {max_retries} attempts.")
+    return None
+
+# Helper function to merge results: accepts per-instruction grades ("Score") and
+# whole-chunk results ("TotalScore")
 def merge_results(results):
     def ensure_list(x):
         if isinstance(x, list):
@@ -520,7 +1085,7 @@ def merge_results(results):
         else:
             return []
 
-    total_score = sum(r.get("TotalScore", 0) for r in results) 
+    total_score = sum(r.get("Score", r.get("TotalScore", 0)) or 0 for r in results) 
     
     positives = []
     negatives = []
@@ -0,0 +1,25 @@
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+# The app modules live at the repository root
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+# Settings are validated lazily, but give the tests a complete, harmless environment
+os.environ.setdefault("OPENAI_API_KEY", "sk-test")
+os.environ.setdefault("DATABASE_URL", "postgresql://test@localhost/test")
+os.environ.setdefault("CLOUDINARY_CLOUD_NAME", "test")
+os.environ.setdefault("CLOUDINARY_API_KEY", "test")
+os.environ.setdefault("CLOUDINARY_API_SECRET", "test")
+
+
+@pytest.fixture
+def shared_cache(tmp_path, monkeypatch):
+    """Point the shared cache at a fresh SQLite file for one test"""
+    import cache
+
+    backend = cache.SQLiteCache(str(tmp_path / "cache.db"), max_entries=100)
+    monkeypatch.setattr(cache, "_backend", backend)
+    return backend
@@ -0,0 +1,75 @@
+import json
+import subprocess
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+import accounting
+import config
+
+BURN_CPU = "import time\nend = time.process_time() + 0.2\nwhile time.process_time() < end: pass\nprint('done')"
+
+
+def test_helpers_are_noops_outside_a_request():
+    assert accounting.current_usage() is None
+    accounting.add_bytes_down(10)
+    accounting.record_openai_usage(SimpleNamespace(usage=SimpleNamespace(prompt_tokens=5, completion_tokens=2)))
+    with accounting.stage("download"):
+        pass
+
+
+def test_track_request_collects_and_logs_usage(capsys):
+    with accounting.track_request("evaluate") as usage:
+        accounting.add_bytes_down(100)
+        accounting.add_bytes_up(40)
+        accounting.add_audio_seconds(12.5)
+        accounting.add_tts_characters(30)
+        accounting.record_openai_usage(SimpleNamespace(usage=SimpleNamespace(prompt_tokens=50, completion_tokens=7)))
+        accounting.record_openai_usage(SimpleNamespace(usage=None))
+        with accounting.stage("grade"):
+            pass
+        with accounting.stage("grade"):
+            pass
+    assert accounting.current_usage() is None
+
+    logged = json.loads(capsys.readouterr().out.strip().splitlines()[-1])
+    assert logged["event"] == "request_usage"
+    assert logged["status"] == "ok"
+    assert (logged["bytes_down"], logged["bytes_up"]) == (100, 40)
+    assert (logged["prompt_tokens"], logged["completion_tokens"]) == (50, 7)
+    assert logged["audio_seconds"] == 12.5 and logged["tts_characters"] == 30
+    assert list(logged["stages_ms"]) == ["grade"]
+    assert usage.summary()["route"] == "evaluate"
+
+
+def test_track_request_records_error_status(capsys):
+    from fastapi import HTTPException
+
+    with pytest.raises(HTTPException):
+        with accounting.track_request("generate"):
+            raise HTTPException(status_code=413, detail="too large")
+    logged = json.loads(capsys.readouterr().out.strip().splitlines()[-1])
+    assert logged["status"] == "error:413"
+
+
+def test_run_subprocess_charges_child_cpu():
+    with accounting.track_request("evaluate") as usage:
+        result = accounting.run_subprocess([sys.executable, "-c", BURN_CPU], check=True)
+    assert result.stdout.strip() == "done"
+    assert usage.subprocess_cpu_seconds >= 0.15
+
+
+def test_run_subprocess_check_and_timeout():
+    with pytest.raises(subprocess.CalledProcessError):
+        accounting.run_subprocess([sys.executable, "-c", "import sys; sys.exit(3)"], check=True)
+    with pytest.raises(subprocess.TimeoutExpired):
+        accounting.run_subprocess([sys.executable, "-c", "import time; time.sleep(5)"], timeout=0.2)
+
+
+def test_usage_header_follows_config(monkeypatch):
+    usage = accounting.RequestUsage("evaluate")
+    monkeypatch.setattr(config, "ACCOUNTING_RESPONSE_HEADER", False)
+    assert accounting.usage_header(usage) == {}
+    monkeypatch.setattr(config, "ACCOUNTING_RESPONSE_HEADER", True)
+    assert json.loads(accounting.usage_header(usage)["X-Request-Usage"])["route"] == "evaluate"
@@ -0,0 +1,70 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from admission import AdmissionController
+
+
+def test_full_queue_is_rejected_with_retry_after():
+    controller = AdmissionController("evaluate", max_concurrent=1, max_queue=1, queue_timeout=5)
+
+    async def scenario():
+        release = asyncio.Event()
+
+        async def hold():
+            async with controller.admit():
+                await release.wait()
+
+        holder = asyncio.create_task(hold())
+        waiter = asyncio.create_task(hold())
+        await asyncio.sleep(0.01)
+        assert (controller.active, controller.waiting) == (1, 1)
+
+        with pytest.raises(HTTPException) as rejected:
+            async with controller.admit():
+                pass
+        release.set()
+        await asyncio.gather(holder, waiter)
+        return rejected.value
+
+    error = asyncio.run(scenario())
+    assert error.status_code == 429
+    assert int(error.headers["Retry-After"]) >= 1
+    assert controller.stats()["rejected"] == 1
+    assert controller.stats()["admitted"] == 2
+
+
+def test_queue_wait_timeout_is_rejected():
+    controller = AdmissionController("generate", max_concurrent=1, max_queue=5, queue_timeout=0.05)
+
+    async def scenario():
+        release = asyncio.Event()
+
+        async def hold():
+            async with controller.admit():
+                await release.wait()
+
+        holder = asyncio.create_task(hold())
+        await asyncio.sleep(0.01)
+        try:
+            with pytest.raises(HTTPException) as rejected:
+                async with controller.admit():
+                    pass
+            return rejected.value
+        finally:
+            release.set()
+            await holder
+
+    error = asyncio.run(scenario())
+    assert error.status_code == 429
+    assert "timed out" in error.detail
+    assert controller.waiting == 0
+
+
+def test_retry_after_grows_with_backlog():
+    controller = AdmissionController("evaluate", max_concurrent=2, max_queue=10, queue_timeout=30)
+    controller._service_times.extend([4.0, 6.0])
+    assert controller.retry_after() == 3  # (0 + 1) waiting / 2 slots * 5s
+    controller.waiting = 3
+    assert controller.retry_after() == 10
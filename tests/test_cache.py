@@ -0,0 +1,60 @@
+import time
+
+import cache
+
+
+def test_values_round_trip_as_json(shared_cache):
+    cache.cache_set("rubric", "k", [{"id": 1, "MaxMarks": "10"}])
+    assert cache.cache_get("rubric", "k") == [{"id": 1, "MaxMarks": "10"}]
+    assert cache.cache_get("rubric", "missing") is None
+    assert cache.cache_get("other", "k") is None
+
+
+def test_entries_expire_after_ttl(shared_cache):
+    cache.cache_set("pdf_text", "short", "text", ttl=0.05)
+    cache.cache_set("pdf_text", "long", "text", ttl=60)
+    time.sleep(0.1)
+    assert cache.cache_get("pdf_text", "short") is None
+    assert cache.cache_get("pdf_text", "long") == "text"
+    assert cache.cache_values("pdf_text") == ["text"]
+
+
+def test_least_recently_used_entries_are_evicted(shared_cache):
+    shared_cache.max_entries = 2
+    cache.cache_set("audio", "a", 1)
+    time.sleep(0.01)
+    cache.cache_set("audio", "b", 2)
+    time.sleep(0.01)
+    cache.cache_get("audio", "a")
+    time.sleep(0.01)
+    cache.cache_set("audio", "c", 3)
+    assert cache.cache_get("audio", "b") is None
+    assert cache.cache_get("audio", "a") == 1
+    assert cache.cache_get("audio", "c") == 3
+
+
+def test_workers_share_entries_through_the_file(shared_cache):
+    cache.cache_set("transcription", "k", {"Submission": "hello"})
+    other_worker = cache.SQLiteCache(shared_cache.path, max_entries=100)
+    assert other_worker.get("transcription", "k") == {"Submission": "hello"}
+
+
+def test_delete_and_clear(shared_cache):
+    cache.cache_set("rubric", "a", 1)
+    cache.cache_set("rubric", "b", 2)
+    cache.cache_delete("rubric", "a")
+    assert cache.cache_get("rubric", "a") is None
+    cache.cache_clear("rubric")
+    assert cache.cache_values("rubric") == []
+
+
+def test_cache_failures_do_not_raise(monkeypatch):
+    class Broken:
+        def get(self, *args):
+            raise OSError("disk full")
+
+        set = get
+
+    monkeypatch.setattr(cache, "_backend", Broken())
+    assert cache.cache_get("rubric", "k") is None
+    cache.cache_set("rubric", "k", 1)
@@ -0,0 +1,40 @@
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+import config
+
+
+@pytest.fixture(autouse=True)
+def fresh_settings():
+    config.get_settings.cache_clear()
+    yield
+    config.get_settings.cache_clear()
+
+
+def test_settings_are_read_once(monkeypatch):
+    settings = config.get_settings()
+    monkeypatch.setenv("DATABASE_URL", "postgresql://changed")
+    assert config.get_settings() is settings
+
+
+def test_missing_variables_are_all_reported(monkeypatch):
+    monkeypatch.delenv("DATABASE_URL")
+    monkeypatch.delenv("CLOUDINARY_API_KEY")
+    with pytest.raises(RuntimeError, match="DATABASE_URL, CLOUDINARY_API_KEY"):
+        config.get_settings()
+
+
+def test_invalid_openai_key_is_rejected(monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "not-a-key")
+    with pytest.raises(RuntimeError, match="Invalid OpenAI API key format"):
+        config.get_settings()
+
+
+def test_importing_the_app_does_not_load_heavy_dependencies():
+    code = "import main, sys; print('loaded:' + ','.join(m for m in ('openai', 'PyPDF2', 'psycopg2', 'cloudinary') if m in sys.modules))"
+    root = Path(__file__).resolve().parent.parent
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True, cwd=root)
+    assert "loaded:\n" in result.stdout
@@ -0,0 +1,53 @@
+import database
+
+
+class _Cursor:
+    def __init__(self, log):
+        self.log = log
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, sql, params=None):
+        self.log.append((sql.split()[0], sql.split()[1], params))
+
+
+class _Connection:
+    """Stands in for PooledConnection: tracks its own prepared statements"""
+
+    def __init__(self):
+        self.prepared_statements = set()
+        self.log = []
+
+    def cursor(self):
+        return _Cursor(self.log)
+
+
+def test_statement_is_prepared_once_per_connection():
+    conn = _Connection()
+    params = ("id", "scenario", "https://audio", "mp3", 100, "2026-01-01T00:00:00+00:00")
+    database.execute_prepared(conn, "upsert_reference_audio", params)
+    database.execute_prepared(conn, "upsert_reference_audio", params)
+
+    assert [entry[0] for entry in conn.log] == ["PREPARE", "EXECUTE", "EXECUTE"]
+    assert conn.log[1] == ("EXECUTE", "upsert_reference_audio", params)
+
+    other = _Connection()
+    database.execute_prepared(other, "upsert_reference_audio", params)
+    assert [entry[0] for entry in other.log] == ["PREPARE", "EXECUTE"]
+
+
+def test_prepared_statements_take_every_queued_column():
+    from write_behind import REFERENCE_AUDIO_COLUMNS, SUBMISSION_COLUMNS
+
+    assert f"${len(SUBMISSION_COLUMNS)})" in database.PREPARED_STATEMENTS["insert_submission"]
+    assert f"${len(REFERENCE_AUDIO_COLUMNS)})" in database.PREPARED_STATEMENTS["upsert_reference_audio"]
+
+
+def test_integrity_error_reason_names_the_foreign_key():
+    assert database.integrity_error_reason('violates "Submission_userId_fkey"').startswith("User not found")
+    assert database.integrity_error_reason('violates "Submission_scenarioId_fkey"').startswith("Scenario not found")
+    assert database.integrity_error_reason("duplicate key") == "Data integrity constraint violated"
@@ -0,0 +1,113 @@
+import pytest
+
+import config
+import services
+import tokens
+
+
+RUBRIC = [
+    {"id": 1, "Instruction": "States the client's claim", "MaxMarks": "10"},
+    {"id": 2, "Instruction": "Cites the relevant statute", "MaxMarks": "10"},
+]
+
+
+@pytest.fixture
+def grader(monkeypatch, shared_cache):
+    """report() with a fake model: every instruction scores 5, calls are recorded"""
+    monkeypatch.setattr(tokens, "_get_encoding", lambda model: None)
+    monkeypatch.setattr(config, "GRADING_MODE", "chunked")
+    monkeypatch.setattr(services, "get_openai_client", lambda: None)
+    calls = []
+
+    def grade_chunk(client, model, prompt, submission_message, chunk, chunk_ids, i, response_format=None):
+        calls.append(list(chunk_ids))
+        return [
+            {"id": key, "Score": 5, "Max": None, "Positive": [f"good {key}"], "Negative": [], "Improvement": []}
+            for key in chunk_ids
+        ]
+
+    monkeypatch.setattr(services, "grade_instruction_chunk", grade_chunk)
+    return calls
+
+
+def test_cache_key_ignores_whitespace_and_case_of_the_transcript():
+    key = services.grading_cache_key("The client  was\nharmed.", RUBRIC, "gpt-4o")
+    assert services.grading_cache_key("the client was harmed.", RUBRIC, "gpt-4o") == key
+    assert services.grading_cache_key("the client was not harmed.", RUBRIC, "gpt-4o") != key
+    assert services.grading_cache_key("the client was harmed.", RUBRIC, "gpt-4-turbo") != key
+    edited = [dict(RUBRIC[0], MaxMarks="15"), RUBRIC[1]]
+    assert services.grading_cache_key("the client was harmed.", edited, "gpt-4o") != key
+
+
+def test_repeat_report_is_served_from_cache(grader):
+    first = services.report("The client was harmed by the landlord.", RUBRIC)
+    second = services.report("the client was harmed by the landlord.", RUBRIC)
+    assert len(grader) == 1
+    assert second["TotalScore"] == first["TotalScore"]
+    assert second["TokenStats"]["CacheHit"] == 1
+
+
+def test_report_with_failed_chunk_is_not_memoized(grader, monkeypatch):
+    monkeypatch.setattr(services, "grade_instruction_chunk", lambda *args, **kwargs: None)
+    failed = services.report("The client was harmed by the landlord.", RUBRIC)
+    assert failed["TotalScore"] == 0
+    assert "CacheHit" not in services.report("The client was harmed by the landlord.", RUBRIC)["TokenStats"]
+
+
+def test_chunk_for_model_makes_missing_and_repeated_ids_unique():
+    chunk = [
+        {"id": 1, "Instruction": "a"},
+        {"id": 1, "Instruction": "b"},
+        {"Instruction": "c"},
+        {"id": 3, "Instruction": "d"},
+    ]
+    model_chunk, chunk_ids = services.chunk_for_model(chunk, [0, 1, 2, 3])
+    assert chunk_ids == ["1", "1#2", "3", "3#4"]
+    assert [instruction["id"] for instruction in model_chunk] == [1, "1#2", "3", "3#4"]
+    # Instructions that already had a unique id are sent unchanged
+    assert model_chunk[0] is chunk[0]
+    assert "id" not in chunk[2]
+
+
+def test_duplicate_rubric_ids_are_graded_separately(grader):
+    rubric = [
+        {"id": 1, "Instruction": "a", "MaxMarks": 10},
+        {"id": 1, "Instruction": "b", "MaxMarks": 10},
+    ]
+    result = services.report("The client was harmed by the landlord.", rubric)
+    assert grader == [["1", "1#2"]]
+    assert result["TotalScore"] == 50.0
+    assert result["Positive"] == ["good 1", "good 1#2"]
+
+
+def test_only_edited_instructions_are_regraded(grader):
+    services.report("The client was harmed by the landlord.", RUBRIC)
+    edited = [RUBRIC[0], dict(RUBRIC[1], Instruction="Cites the statute and a case")]
+    services.report("The client was harmed by the landlord.", edited)
+    assert grader == [["1", "2"], ["2"]]
+
+
+def test_clamp_grade_keeps_scores_within_max_marks():
+    instruction = {"id": 1, "MaxMarks": "15%"}
+    assert services.clamp_grade({"Score": 40, "Max": 100}, instruction)["Score"] == 15.0
+    assert services.clamp_grade({"Score": -3}, instruction)["Score"] == 0.0
+    # The model's echoed Max only applies when the rubric gives none
+    assert services.clamp_grade({"Score": 12, "Max": 8}, {"id": 2})["Score"] == 8.0
+    assert services.clamp_grade({"Score": 12, "Max": None}, {"id": 2})["Score"] == 12.0
+
+
+def test_total_score_is_a_share_of_max_marks():
+    instructions = [{"MaxMarks": "10"}, {"MaxMarks": 30}]
+    results = [{"Score": 10.0}, {"Score": 15.0}]
+    assert services.total_score(results, instructions) == 62.5
+    # Without limits for every instruction the raw sum is clamped to 0..100
+    assert services.total_score([{"Score": 80.0}, {"Score": 70.0}], [{}, {}]) == 100.0
+
+
+def test_overscoring_model_is_clamped_in_the_report(grader, monkeypatch):
+    def grade_chunk(client, model, prompt, submission_message, chunk, chunk_ids, i, response_format=None):
+        return [{"id": key, "Score": 50, "Max": 50, "Positive": [], "Negative": [], "Improvement": []}
+                for key in chunk_ids]
+
+    monkeypatch.setattr(services, "grade_instruction_chunk", grade_chunk)
+    assert services.report("The client was harmed by the landlord.", RUBRIC)["TotalScore"] == 100.0
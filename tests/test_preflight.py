@@ -0,0 +1,102 @@
+import pytest
+from fastapi import HTTPException
+
+import config
+import preflight
+
+
+def _status(fn, *args):
+    with pytest.raises(HTTPException) as rejected:
+        fn(*args)
+    return rejected.value.status_code
+
+
+VOLUMEDETECT = """[Parsed_volumedetect_0 @ 0x1] n_samples: 88200
+[Parsed_volumedetect_0 @ 0x1] mean_volume: {mean} dB
+[Parsed_volumedetect_0 @ 0x1] max_volume: {peak} dB
+"""
+
+
+def test_silent_audio_is_rejected():
+    assert preflight.parse_max_volume(VOLUMEDETECT.format(mean="-91.0", peak="-inf")) == float("-inf")
+    assert _status(preflight.check_not_silent, VOLUMEDETECT.format(mean="-91.0", peak="-inf")) == 400
+    assert _status(preflight.check_not_silent, VOLUMEDETECT.format(mean="-80.0", peak="-60.5")) == 400
+
+
+def test_audible_or_unmeasured_audio_passes():
+    preflight.check_not_silent(VOLUMEDETECT.format(mean="-25.1", peak="-3.2"))
+    preflight.check_not_silent("no volumedetect output")
+
+
+def test_scanned_pdf_is_rejected_by_text_density():
+    assert _status(preflight.check_pdf_text, "", 3) == 400
+    sparse = "x" * (config.PDF_MIN_CHARS_PER_PAGE * 3 - 1)
+    assert _status(preflight.check_pdf_text, sparse, 3) == 400
+
+
+def test_pdf_page_limits():
+    assert _status(preflight.check_pdf_pages, 0) == 400
+    assert _status(preflight.check_pdf_pages, config.PDF_MAX_PAGES + 1) == 413
+    preflight.check_pdf_pages(config.PDF_MAX_PAGES)
+
+
+def test_audio_duration_and_stream_checks():
+    assert _status(preflight.check_audio, {"audio_codecs": [], "duration": 10.0}) == 400
+    assert _status(preflight.check_audio, {"audio_codecs": ["mp3"], "duration": config.AUDIO_MIN_SECONDS / 2}) == 400
+    assert _status(preflight.check_audio, {"audio_codecs": ["mp3"], "duration": config.AUDIO_MAX_SECONDS + 1}) == 413
+    preflight.check_audio({"audio_codecs": ["mp3"], "duration": None})
+
+
+def test_short_transcript_is_rejected():
+    assert _status(preflight.check_transcript, "um") == 400
+
+
+class _Response:
+    def __init__(self, headers, chunks):
+        self.headers = headers
+        self.chunks = chunks
+        self.read = 0
+
+    def iter_content(self, chunk_size):
+        for chunk in self.chunks:
+            self.read += 1
+            yield chunk
+
+
+def test_declared_oversize_download_is_refused_before_reading():
+    response = _Response({"Content-Length": str(2 * 1024 * 1024)}, [b"x"])
+    assert _status(preflight.read_limited_body, response, 1, "PDF") == 413
+    assert response.read == 0
+
+
+def test_undeclared_download_stops_once_over_the_limit():
+    response = _Response({}, [b"x" * 600_000] * 10)
+    assert _status(preflight.read_limited_body, response, 1, "Audio file") == 413
+    assert response.read == 2
+
+
+def test_normalized_text_fingerprint():
+    assert preflight.content_fingerprint("Hello  WORLD\n") == preflight.content_fingerprint("hello world")
+
+
+def test_probe_and_silence_on_real_audio(tmp_path):
+    imageio_ffmpeg = pytest.importorskip("imageio_ffmpeg")
+    from accounting import run_subprocess
+
+    ffmpeg = imageio_ffmpeg.get_ffmpeg_exe()
+    silent = tmp_path / "silent.wav"
+    run_subprocess([ffmpeg, "-f", "lavfi", "-i", "anullsrc=r=16000:cl=mono", "-t", "2", "-y", str(silent)], check=True)
+
+    probe = preflight.probe_audio(str(silent))
+    assert probe["audio_codecs"] and probe["duration"] == pytest.approx(2.0, abs=0.1)
+    preflight.check_audio(probe)
+
+    detect = run_subprocess([ffmpeg, "-i", str(silent), "-af", "volumedetect", "-f", "null", "-"])
+    assert _status(preflight.check_not_silent, detect.stderr) == 400
+
+
+def test_non_audio_file_is_rejected(tmp_path):
+    pytest.importorskip("imageio_ffmpeg")
+    junk = tmp_path / "junk.mp3"
+    junk.write_bytes(b"not audio at all" * 100)
+    assert _status(preflight.probe_audio, str(junk)) == 400
@@ -0,0 +1,67 @@
+import time
+
+import pytest
+
+import prewarm
+
+
+@pytest.fixture
+def steps(monkeypatch, shared_cache):
+    """Stub pipeline steps; a URL containing a step name makes that step fail"""
+    calls = []
+
+    def step(name):
+        def run(pdf_url):
+            calls.append((name, pdf_url))
+            if name in pdf_url:
+                raise ValueError(f"{name} broke")
+            return f"{name} for {pdf_url}"
+        return run
+
+    monkeypatch.setattr(prewarm, "extract_text_from_pdf_url", step("text"))
+    monkeypatch.setattr(prewarm, "process_pdf_for_instructions", step("rubric"))
+    monkeypatch.setattr(prewarm, "generate_audio_from_pdf", step("audio"))
+    return calls
+
+
+def _wait(job_id, timeout=3.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = prewarm.get_prewarm_job(job_id)
+        if job["status"] in ("completed", "partial", "failed"):
+            return job
+        time.sleep(0.02)
+    raise AssertionError("pre-warm job did not finish")
+
+
+def test_all_steps_done_completes_the_job(steps):
+    job = prewarm.start_prewarm_job(["https://files/a.pdf", " https://files/a.pdf ", "https://files/b.pdf"])
+    assert list(job["scenarios"]) == ["https://files/a.pdf", "https://files/b.pdf"]
+
+    job = _wait(job["job_id"])
+    assert job["status"] == "completed"
+    assert all(status == "done" for scenario in job["scenarios"].values() for status in scenario.values())
+    assert len(steps) == 6
+
+
+def test_failed_audio_makes_the_job_partial(steps):
+    job = _wait(prewarm.start_prewarm_job(["https://files/audio.pdf"])["job_id"])
+    assert job["status"] == "partial"
+    scenario = job["scenarios"]["https://files/audio.pdf"]
+    assert scenario["text"] == scenario["rubric"] == "done"
+    assert scenario["audio"] == "failed: audio broke"
+
+
+def test_failed_text_skips_later_steps(steps):
+    job = _wait(prewarm.start_prewarm_job(["https://files/text.pdf"], include_audio=False)["job_id"])
+    assert job["status"] == "failed"
+    assert job["scenarios"]["https://files/text.pdf"] == {"text": "failed: text broke", "rubric": "skipped"}
+    assert [name for name, _ in steps] == ["text"]
+
+
+def test_batch_limits(steps, monkeypatch):
+    with pytest.raises(ValueError):
+        prewarm.start_prewarm_job(["", "  "])
+    monkeypatch.setattr(prewarm.config, "PREWARM_MAX_BATCH", 1)
+    with pytest.raises(ValueError):
+        prewarm.start_prewarm_job(["https://files/a.pdf", "https://files/b.pdf"])
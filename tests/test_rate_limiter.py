@@ -0,0 +1,68 @@
+import pytest
+
+from rate_limiter import LocalBackend, RateLimiter, parse_reset_duration
+
+
+def test_bucket_allows_capacity_then_reports_wait():
+    backend = LocalBackend()
+    costs = {"requests": (60, 1)}  # 60 rpm refills one request per second
+    for _ in range(60):
+        assert backend.try_acquire("m", costs, now=1000.0) == 0.0
+    assert backend.try_acquire("m", costs, now=1000.0) == pytest.approx(1.0)
+
+
+def test_bucket_refills_over_time():
+    backend = LocalBackend()
+    costs = {"tokens": (600, 300)}
+    assert backend.try_acquire("m", costs, now=0.0) == 0.0
+    assert backend.try_acquire("m", costs, now=0.0) == 0.0
+    # Empty: 300 tokens at 10 per second takes 30 seconds
+    assert backend.try_acquire("m", costs, now=0.0) == pytest.approx(30.0)
+    assert backend.try_acquire("m", costs, now=30.0) == 0.0
+
+
+def test_denied_request_takes_nothing_from_other_buckets():
+    backend = LocalBackend()
+    assert backend.try_acquire("m", {"requests": (10, 1), "tokens": (100, 100)}, now=0.0) == 0.0
+    assert backend.try_acquire("m", {"requests": (10, 1), "tokens": (100, 50)}, now=0.0) > 0
+    assert backend._levels["m:requests"] == pytest.approx(9)
+
+
+def test_block_delays_every_bucket_of_the_model():
+    backend = LocalBackend()
+    backend.block("m", until=105.0)
+    assert backend.try_acquire("m", {"requests": (60, 1)}, now=100.0) == pytest.approx(5.0)
+    assert backend.try_acquire("other", {"requests": (60, 1)}, now=100.0) == 0.0
+
+
+def test_acquire_gives_up_past_max_wait():
+    limiter = RateLimiter({"m": {"rpm": 1}}, backend=LocalBackend(), max_wait=0.5)
+    limiter.acquire("m")
+    with pytest.raises(TimeoutError):
+        limiter.acquire("m")
+
+
+def test_unconfigured_model_is_unlimited():
+    limiter = RateLimiter({}, backend=LocalBackend(), max_wait=0.1)
+    for _ in range(100):
+        limiter.acquire("unknown", tokens=10_000)
+
+
+def test_headers_lower_the_bucket_and_block_until_reset():
+    backend = LocalBackend()
+    limiter = RateLimiter({"m": {"rpm": 100}}, backend=backend)
+    limiter.update_from_headers("m", {
+        "x-ratelimit-limit-requests": "500",
+        "x-ratelimit-remaining-requests": "0",
+        "x-ratelimit-reset-requests": "6m0s",
+    })
+    assert limiter.limits["m"]["rpm"] == 500
+    assert backend._levels["m:requests"] == 0
+    assert max(backend._blocked_until.values()) > 0
+
+
+@pytest.mark.parametrize("value, seconds", [
+    ("1s", 1.0), ("6m0s", 360.0), ("20ms", 0.02), ("1h2m", 3720.0), ("2.5", 2.5), ("", None), ("soon", None),
+])
+def test_parse_reset_duration(value, seconds):
+    assert parse_reset_duration(value) == (pytest.approx(seconds) if seconds is not None else None)
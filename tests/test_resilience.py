@@ -0,0 +1,47 @@
+import time
+
+import openai
+import pytest
+
+import config
+import resilience
+
+
+@pytest.fixture
+def breaker(monkeypatch):
+    monkeypatch.setattr(config, "OPENAI_MAX_ATTEMPTS", 1)
+    monkeypatch.setattr(config, "OPENAI_HEDGING_ENABLED", False)
+    breaker = resilience.CircuitBreaker(failure_threshold=1, cooldown=0.05)
+    monkeypatch.setitem(resilience._breakers, "test-model", breaker)
+    return breaker
+
+
+def _connection_error(*args, **kwargs):
+    raise openai.APIConnectionError(request=None)
+
+
+def test_expired_deadline_does_not_hold_half_open_trial(monkeypatch, breaker):
+    monkeypatch.setattr(resilience, "limited_call", _connection_error)
+    with pytest.raises(openai.APIConnectionError):
+        resilience.resilient_call("op", "test-model", None)
+    assert breaker.state == "open"
+
+    time.sleep(0.06)
+    assert breaker.state == "half_open"
+    with resilience.request_deadline(-1):
+        with pytest.raises(resilience.DeadlineExceeded):
+            resilience.resilient_call("op", "test-model", None)
+
+    monkeypatch.setattr(resilience, "limited_call", lambda *args, **kwargs: "ok")
+    assert resilience.resilient_call("op", "test-model", None) == "ok"
+    assert breaker.state == "closed"
+
+
+def test_half_open_trial_is_exclusive(breaker):
+    breaker.record_failure()
+    time.sleep(0.06)
+    breaker.before_call("test-model")
+    with pytest.raises(resilience.CircuitOpenError):
+        breaker.before_call("test-model")
+    breaker.release_trial()
+    breaker.before_call("test-model")
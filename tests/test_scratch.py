@@ -0,0 +1,69 @@
+import os
+
+import pytest
+from fastapi import HTTPException
+
+from scratch import ScratchSpace
+
+
+def _space(tmp_path, memory_budget=1000, disk_budget=10_000, memory_file_max=500):
+    return ScratchSpace(
+        disk_dir=str(tmp_path / "disk"),
+        memory_dir=str(tmp_path / "memory"),
+        memory_file_max=memory_file_max,
+        memory_budget=memory_budget,
+        disk_budget=disk_budget,
+        orphan_age=3600,
+    )
+
+
+def test_small_file_goes_to_memory(tmp_path):
+    space = _space(tmp_path)
+    assert space.allocate(100) == "memory"
+    assert space.allocations == {"memory": 1, "disk": 0}
+    assert space.spilled == 0
+
+
+def test_large_file_goes_to_disk_without_counting_a_spill(tmp_path):
+    space = _space(tmp_path)
+    assert space.allocate(600) == "disk"
+    assert space.spilled == 0
+
+
+def test_spills_to_disk_when_memory_budget_is_used(tmp_path):
+    space = _space(tmp_path)
+    with space.workspace() as ws:
+        assert ws.write("a.bin", b"x" * 400).is_relative_to(tmp_path / "memory")
+        assert ws.write("b.bin", b"x" * 400).is_relative_to(tmp_path / "memory")
+        assert ws.write("c.bin", b"x" * 400).is_relative_to(tmp_path / "disk")
+    assert space.spilled == 1
+    assert space.stats()["spilled_to_disk"] == 1
+    assert not any((tmp_path / "memory").iterdir())
+
+
+def test_rejects_with_retry_after_when_disk_is_full(tmp_path):
+    space = _space(tmp_path, disk_budget=1000)
+    with space.workspace() as ws:
+        ws.write("held.bin", b"x" * 900)
+        with pytest.raises(HTTPException) as rejected:
+            space.allocate(600)
+    assert rejected.value.status_code == 503
+    assert rejected.value.headers["Retry-After"] == "30"
+    assert space.rejected == 1
+
+
+def test_orphans_of_dead_workers_are_reclaimed_for_space(tmp_path):
+    space = _space(tmp_path, disk_budget=1000)
+    orphan = tmp_path / "disk" / "ws-999999999-deadbeef"
+    orphan.mkdir(parents=True)
+    (orphan / "left.bin").write_bytes(b"x" * 900)
+    assert space.allocate(600) == "disk"
+    assert not orphan.exists()
+    assert space.reclaimed_bytes == 900
+
+
+def test_memory_tier_disabled_without_parent_dir(tmp_path):
+    space = ScratchSpace(str(tmp_path / "disk"), str(tmp_path / "missing" / "memory"),
+                         500, 1000, 10_000, 3600)
+    assert "memory" not in space.roots
+    assert space.allocate(10) == "disk"
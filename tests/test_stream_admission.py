@@ -0,0 +1,36 @@
+import asyncio
+
+import main
+from admission import AdmissionController
+
+
+def test_stream_slot_is_held_until_work_finishes_after_disconnect(monkeypatch):
+    controller = AdmissionController("evaluate", max_concurrent=1, max_queue=0, queue_timeout=1)
+    monkeypatch.setitem(main.admission_controllers, "evaluate", controller)
+
+    async def scenario():
+        release = asyncio.Event()
+
+        async def slow_evaluation(pdf_url, audio_url, file_format, emit):
+            emit("downloaded", {"audio_cached": False})
+            await release.wait()
+            return {"TotalScore": 50, "Positive": [], "Negative": [], "Improvement": []}
+
+        monkeypatch.setattr(main, "_run_evaluation", slow_evaluation)
+        response = await main.evaluate_submission_stream_endpoint("pdf", "audio", "mp3")
+        stream = response.body_iterator
+        assert (await stream.__anext__()).startswith("event: downloaded")
+
+        # Client disconnects mid-stream: the generator is closed, the work carries on
+        await stream.aclose()
+        await asyncio.sleep(0.05)
+        assert controller.active == 1
+
+        release.set()
+        for _ in range(50):
+            if controller.active == 0:
+                break
+            await asyncio.sleep(0.01)
+        assert controller.active == 0
+
+    asyncio.run(scenario())
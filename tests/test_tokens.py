@@ -0,0 +1,36 @@
+import pytest
+
+import tokens
+
+
+@pytest.fixture(autouse=True)
+def char_estimate(monkeypatch):
+    # Deterministic ~4 characters per token, without tiktoken's downloaded tables
+    monkeypatch.setattr(tokens, "_get_encoding", lambda model: None)
+
+
+def _item(chars):
+    # compact_json wraps the text in {"t":"..."} (8 characters)
+    return {"t": "x" * (chars - 8)}
+
+
+def test_batches_stay_within_budget_and_keep_order():
+    items = [_item(40) for _ in range(7)]  # 10 tokens each
+    batches = tokens.batch_by_token_budget(items, budget=25)
+    assert [len(batch) for batch in batches] == [2, 2, 2, 1]
+    assert [item for batch in batches for item in batch] == items
+
+
+def test_oversized_item_gets_its_own_batch():
+    small, large = _item(40), _item(400)
+    batches = tokens.batch_by_token_budget([small, large, small], budget=25)
+    assert batches == [[small], [large], [small]]
+
+
+def test_empty_input_makes_no_batches():
+    assert tokens.batch_by_token_budget([], budget=100) == []
+
+
+def test_chat_estimate_adds_message_overhead_and_completion():
+    messages = [{"role": "system", "content": "x" * 40}, {"role": "user", "content": None}]
+    assert tokens.estimate_chat_tokens(messages, "gpt-4o", completion_tokens=100) == 10 + 4 + 0 + 4 + 100
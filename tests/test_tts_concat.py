@@ -0,0 +1,46 @@
+import pytest
+
+import preflight
+import services
+from accounting import run_subprocess
+
+imageio_ffmpeg = pytest.importorskip("imageio_ffmpeg")
+
+# Encoders producing what OpenAI TTS returns for each response_format
+ENCODERS = {
+    "mp3": ["-c:a", "libmp3lame"],
+    "opus": ["-c:a", "libopus"],
+    "aac": ["-c:a", "aac", "-f", "adts"],
+}
+
+
+def _segment(path, seconds, response_format):
+    run_subprocess(
+        [imageio_ffmpeg.get_ffmpeg_exe(), "-hide_banner", "-loglevel", "error",
+         "-f", "lavfi", "-i", f"sine=frequency=440:duration={seconds}", "-ar", "24000",
+         *ENCODERS[response_format], "-y", str(path)],
+        check=True
+    )
+    return path
+
+
+@pytest.mark.parametrize("response_format", sorted(services.TTS_OUTPUT_FORMATS))
+def test_segments_are_joined_without_reencoding(tmp_path, response_format):
+    segment_ext, output_ext, _ = services.TTS_OUTPUT_FORMATS[response_format]
+    segments = [_segment(tmp_path / f"it's {i}.{segment_ext}", 1 + i, response_format) for i in range(2)]
+    output = tmp_path / f"joined.{output_ext}"
+
+    services.concat_audio_segments(segments, output, response_format)
+
+    probe = preflight.probe_audio(str(output))
+    assert probe["audio_codecs"]
+    assert probe["duration"] == pytest.approx(3.0, abs=0.2)
+    assert not output.with_suffix(".txt").exists()
+
+
+def test_concat_failure_is_reported(tmp_path):
+    broken = tmp_path / "broken.mp3"
+    broken.write_bytes(b"not audio")
+    with pytest.raises(RuntimeError, match="Audio concatenation failed"):
+        services.concat_audio_segments([broken], tmp_path / "joined.mp3", "mp3")
+    assert not (tmp_path / "joined.txt").exists()
@@ -0,0 +1,52 @@
+import requests
+
+import config
+import services
+
+
+class _Head:
+    def __init__(self, headers, ok=True):
+        self.headers = headers
+        self.ok = ok
+
+
+def _serve(monkeypatch, headers):
+    calls = []
+
+    def head(url, **kwargs):
+        calls.append(url)
+        if isinstance(headers, Exception):
+            raise headers
+        return _Head(headers)
+
+    monkeypatch.setattr(requests, "head", head)
+    monkeypatch.setattr(services, "_url_validators", {})
+    return calls
+
+
+def test_reuploaded_file_gets_a_new_key(monkeypatch):
+    _serve(monkeypatch, {"ETag": '"v1"', "Content-Length": "100"})
+    first, first_ttl = services.url_cache_key("https://files/rubric.pdf", "model")
+
+    _serve(monkeypatch, {"ETag": '"v2"', "Content-Length": "120"})
+    second, second_ttl = services.url_cache_key("https://files/rubric.pdf", "model")
+
+    assert first != second
+    assert first_ttl is None and second_ttl is None
+
+
+def test_without_validator_the_url_key_is_short_lived(monkeypatch):
+    _serve(monkeypatch, {})
+    _, ttl = services.url_cache_key("https://files/rubric.pdf")
+    assert ttl == config.URL_CACHE_UNVALIDATED_TTL_SECONDS
+
+    _serve(monkeypatch, requests.ConnectionError("unreachable"))
+    _, ttl = services.url_cache_key("https://files/rubric.pdf")
+    assert ttl == config.URL_CACHE_UNVALIDATED_TTL_SECONDS
+
+
+def test_one_head_request_per_url_within_memo_window(monkeypatch):
+    calls = _serve(monkeypatch, {"Last-Modified": "Mon, 05 Jan 2026 10:00:00 GMT"})
+    keys = {services.url_cache_key("https://files/rubric.pdf", part)[0] for part in ("text", "rubric")}
+    assert len(keys) == 2
+    assert calls == ["https://files/rubric.pdf"]
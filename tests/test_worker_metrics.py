@@ -0,0 +1,71 @@
+import os
+
+import worker_metrics
+
+
+def _route(active=0, waiting=0, admitted=0, rejected=0, wait_samples=0, avg_wait_ms=0.0, p95_wait_ms=0.0):
+    return {
+        "active": active, "waiting": waiting, "max_concurrent": 4, "max_queue": 16,
+        "admitted": admitted, "rejected": rejected, "wait_samples": wait_samples,
+        "avg_wait_ms": avg_wait_ms, "p95_wait_ms": p95_wait_ms,
+    }
+
+
+def _snapshot(worker, evaluate, upstream=None, write_behind=None):
+    return {
+        "worker": worker, "pid": 1, "published_at": 0,
+        "admission": {"evaluate": evaluate},
+        "upstream": upstream or {},
+        "write_behind": write_behind or {"pending": 0, "dead_lettered": 0},
+    }
+
+
+def test_admission_figures_are_summed_across_workers():
+    snapshots = [
+        _snapshot("a", _route(active=2, waiting=1, admitted=10, wait_samples=1, avg_wait_ms=100.0, p95_wait_ms=100.0)),
+        _snapshot("b", _route(active=1, rejected=3, admitted=5, wait_samples=3, avg_wait_ms=20.0, p95_wait_ms=50.0)),
+    ]
+    stats = worker_metrics.cluster_admission_stats(snapshots)
+    evaluate = stats["routes"]["evaluate"]
+
+    assert stats["workers"] == 2
+    assert stats["pid"] == os.getpid()
+    assert (evaluate["active"], evaluate["waiting"], evaluate["rejected"], evaluate["admitted"]) == (3, 1, 3, 15)
+    # Caps are per worker, so the container-wide cap is their sum
+    assert (evaluate["max_concurrent"], evaluate["max_queue"]) == (8, 32)
+    assert evaluate["avg_wait_ms"] == 40.0  # weighted by wait samples
+    assert evaluate["p95_wait_ms"] == 100.0  # worst worker
+    assert set(stats["per_worker"]) == {"a", "b"}
+
+
+def test_breaker_state_reports_the_worst_worker():
+    snapshots = [
+        _snapshot("a", _route(), upstream={"gpt-4o": "closed", "whisper-1": "closed"}),
+        _snapshot("b", _route(), upstream={"gpt-4o": "open"}),
+        _snapshot("c", _route(), upstream={"gpt-4o": "half_open"}),
+    ]
+    models = worker_metrics.cluster_upstream_states(snapshots)["models"]
+    assert models["gpt-4o"] == {"state": "open", "workers": {"closed": 1, "open": 1, "half_open": 1}}
+    assert models["whisper-1"]["state"] == "closed"
+
+
+def test_write_behind_counts_are_summed():
+    snapshots = [
+        _snapshot("a", _route(), write_behind={"pending": 2, "dead_lettered": 1}),
+        _snapshot("b", _route(), write_behind={"pending": 3, "dead_lettered": 0}),
+    ]
+    stats = worker_metrics.cluster_write_behind_stats(snapshots)
+    assert (stats["pending"], stats["dead_lettered"]) == (5, 1)
+
+
+def test_published_snapshots_of_other_workers_are_included(shared_cache):
+    worker_metrics.publish()
+    other = dict(worker_metrics.snapshot(), worker="other-host-1")
+    shared_cache.set(worker_metrics.NAMESPACE, "other-host-1", other, ttl=60)
+
+    snapshots = worker_metrics.worker_snapshots()
+    assert [snap["worker"] for snap in snapshots] == [worker_metrics.worker_id(), "other-host-1"]
+
+    worker_metrics.unpublish()
+    shared_cache.delete(worker_metrics.NAMESPACE, "other-host-1")
+    assert [snap["worker"] for snap in worker_metrics.worker_snapshots()] == [worker_metrics.worker_id()]
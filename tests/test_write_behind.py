@@ -0,0 +1,168 @@
+import json
+import sqlite3
+import time
+
+import pytest
+
+import write_behind
+
+
+def _submission(submission_id):
+    return {
+        "id": submission_id, "userId": "user", "scenarioId": "scenario", "totalScore": 80,
+        "positive": "", "negative": "", "improvement": "", "status": "COMPLETED",
+        "createdAt": "2026-01-01T00:00:00+00:00", "updatedAt": "2026-01-01T00:00:00+00:00",
+    }
+
+
+def _ids(db_path):
+    with sqlite3.connect(db_path) as conn:
+        return sorted(row[0] for row in conn.execute('SELECT "id" FROM "Submission"'))
+
+
+def _wait_for(condition, timeout=3.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.02)
+    return False
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / "stand_in.db")
+
+
+def _queue(db_path, tmp_path, batch_size=100, flush_interval=60.0, sink=None):
+    return write_behind.WriteBehindQueue(
+        sink or write_behind.SQLiteSink(db_path),
+        batch_size=batch_size,
+        flush_interval=flush_interval,
+        journal_path=str(tmp_path / "write_behind.jsonl")
+    )
+
+
+def test_flushes_when_batch_size_is_reached(db_path, tmp_path):
+    queue = _queue(db_path, tmp_path, batch_size=2)
+    queue.start()
+    try:
+        queue.enqueue("Submission", _submission("a"))
+        time.sleep(0.1)
+        assert _ids(db_path) == []
+        queue.enqueue("Submission", _submission("b"))
+        assert _wait_for(lambda: _ids(db_path) == ["a", "b"])
+    finally:
+        queue.stop()
+
+
+def test_flushes_on_interval(db_path, tmp_path):
+    queue = _queue(db_path, tmp_path, flush_interval=0.1)
+    queue.start()
+    try:
+        queue.enqueue("Submission", _submission("a"))
+        assert _wait_for(lambda: _ids(db_path) == ["a"])
+        assert _wait_for(lambda: not queue.journal_path.exists())
+    finally:
+        queue.stop()
+
+
+def test_stop_drains_pending_rows(db_path, tmp_path):
+    queue = _queue(db_path, tmp_path)
+    queue.start()
+    queue.enqueue("Submission", _submission("a"))
+    queue.stop()
+    assert _ids(db_path) == ["a"]
+    assert queue.pending_count() == 0
+
+
+class _DownSink:
+    integrity_errors = (sqlite3.IntegrityError,)
+
+    def write(self, table, rows):
+        raise ConnectionError("database is down")
+
+    def write_one(self, table, row):
+        self.write(table, [row])
+
+
+def test_journal_replays_rows_after_a_crash(db_path, tmp_path):
+    crashed = _queue(db_path, tmp_path, sink=_DownSink())
+    crashed.start()
+    crashed.enqueue("Submission", _submission("a"))
+    crashed.enqueue("Submission", _submission("b"))
+    crashed.flush()
+    # Process dies without stop(): only the journal is left
+    crashed._stopped.set()
+    assert crashed.pending_count() == 2
+    assert crashed.journal_path.exists()
+
+    restarted = _queue(db_path, tmp_path)
+    restarted.start()
+    restarted.stop()
+    assert _ids(db_path) == ["a", "b"]
+    assert not restarted.journal_path.exists()
+
+
+def test_constraint_violation_is_dead_lettered_and_rest_of_batch_written(db_path, tmp_path):
+    queue = _queue(db_path, tmp_path)
+    queue.sink.write("Submission", [_submission("taken")])
+
+    queue.enqueue("Submission", _submission("a"))
+    queue.enqueue("Submission", _submission("taken"))
+    queue.enqueue("Submission", _submission("b"))
+    queue.flush()
+
+    assert _ids(db_path) == ["a", "b", "taken"]
+    assert queue.pending_count() == 0
+    assert queue.stats()["dead_lettered"] == 1
+    dead = [json.loads(line) for line in queue.dead_letter_path.read_text().splitlines()]
+    assert [record["row"]["id"] for record in dead] == ["taken"]
+    assert dead[0]["table"] == "Submission"
+    assert dead[0]["reason"] == "Data integrity constraint violated"
+
+
+@pytest.mark.parametrize("error, reason", [
+    ('insert violates foreign key constraint "Submission_userId_fkey"', "User not found"),
+    ('insert violates foreign key constraint "Submission_scenarioId_fkey"', "Scenario not found"),
+])
+def test_dead_letter_names_the_failed_foreign_key(tmp_path, error, reason):
+    queue = _queue(str(tmp_path / "unused.db"), tmp_path)
+    queue._dead_letter({"table": "Submission", "row": _submission("a")}, sqlite3.IntegrityError(error))
+    record = json.loads(queue.dead_letter_path.read_text())
+    assert record["reason"].startswith(reason)
+    assert record["error"] == error
+
+
+class _ReferenceSink:
+    def __init__(self, user_exists=True, scenario_exists=True, error=None):
+        self.result = (user_exists, scenario_exists)
+        self.error = error
+
+    def references_exist(self, user_id, scenario_id):
+        if self.error:
+            raise self.error
+        return self.result
+
+
+@pytest.fixture
+def no_cache(monkeypatch):
+    monkeypatch.setattr(write_behind, "cache_get", lambda *args: None)
+    monkeypatch.setattr(write_behind, "cache_set", lambda *args, **kwargs: None)
+
+
+@pytest.mark.parametrize("sink, message", [
+    (_ReferenceSink(user_exists=False), "User not found"),
+    (_ReferenceSink(scenario_exists=False), "Scenario not found"),
+])
+def test_unknown_references_are_rejected_before_queueing(monkeypatch, no_cache, sink, message):
+    monkeypatch.setattr(write_behind.write_queue, "sink", sink)
+    with pytest.raises(ValueError, match=message):
+        write_behind.verify_submission_references("user", "scenario")
+
+
+def test_reference_check_is_skipped_when_database_is_down(monkeypatch, no_cache):
+    monkeypatch.setattr(write_behind.write_queue, "sink", _ReferenceSink(error=ConnectionError("down")))
+    assert write_behind.verify_submission_references("user", "scenario") is False
+    monkeypatch.setattr(write_behind.write_queue, "sink", _ReferenceSink())
+    assert write_behind.verify_submission_references("user", "scenario") is True
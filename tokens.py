@@ -0,0 +1,61 @@
+# tokens.py
+import json
+from functools import lru_cache
+
+
+@lru_cache(maxsize=None)
+def _get_encoding(model: str):
+    try:
+        import tiktoken
+    except ImportError:  # tokenizer is optional, fall back to a character estimate
+        return None
+    try:
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            return tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        # tiktoken downloads its BPE files on first use; offline hosts fall back to the estimate
+        print(f"Tokenizer unavailable for {model}, estimating tokens: {e}")
+        return None
+
+
+def count_tokens(text: str, model: str = "gpt-4-turbo") -> int:
+    """Count tokens locally for the given model (roughly 4 chars per token without tiktoken)"""
+    if not text:
+        return 0
+    encoding = _get_encoding(model)
+    if encoding is None:
+        return max(1, len(text) // 4)
+    return len(encoding.encode(text))
+
+
+def compact_json(data) -> str:
+    return json.dumps(data, separators=(",", ":"), ensure_ascii=False)
+
+
+def batch_by_token_budget(items, budget: int, model: str = "gpt-4-turbo"):
+    """Greedily group items so each group's compact JSON stays within the token budget"""
+    batches = []
+    current = []
+    current_tokens = 0
+
+    for item in items:
+        item_tokens = count_tokens(compact_json(item), model)
+        if current and current_tokens + item_tokens > budget:
+            batches.append(current)
+            current = []
+            current_tokens = 0
+        current.append(item)
+        current_tokens += item_tokens
+
+    if current:
+        batches.append(current)
+    return batches
+
+
+def estimate_chat_tokens(messages, model: str, completion_tokens: int = 0) -> int:
+    """Prompt tokens for a chat request plus the expected completion, for rate-limit budgeting"""
+    # ~4 tokens of per-message overhead in the chat format
+    prompt_tokens = sum(count_tokens(m.get("content") or "", model) + 4 for m in messages)
+    return prompt_tokens + completion_tokens
@@ -0,0 +1,115 @@
+# worker_metrics.py
+import asyncio
+import os
+import socket
+import time
+
+from fastapi.concurrency import run_in_threadpool
+
+import config
+from admission import admission_stats
+from cache import cache_delete, cache_set, cache_values
+from resilience import breaker_states
+from write_behind import write_queue
+
+
+# Admission queues, circuit breakers and the write-behind queue live in each worker
+# process, so one worker's numbers say little about the container: caps are per
+# worker and the effective concurrency is WEB_CONCURRENCY x the configured value.
+# Every worker publishes a snapshot to the shared cache; the metrics endpoints
+# aggregate the live snapshots.
+
+NAMESPACE = "worker_metrics"
+_SUMMED = ("active", "waiting", "max_concurrent", "max_queue", "admitted", "rejected", "wait_samples")
+_SEVERITY = {"closed": 0, "half_open": 1, "open": 2}
+
+
+def worker_id() -> str:
+    # Computed on each call: the pid changes when gunicorn forks the workers
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+def snapshot() -> dict:
+    return {
+        "worker": worker_id(),
+        "pid": os.getpid(),
+        "published_at": time.time(),
+        "admission": admission_stats(),
+        "upstream": breaker_states(),
+        "write_behind": write_queue.stats(),
+    }
+
+
+def publish():
+    cache_set(NAMESPACE, worker_id(), snapshot(), ttl=config.METRICS_SNAPSHOT_TTL_SECONDS)
+
+
+def unpublish():
+    cache_delete(NAMESPACE, worker_id())
+
+
+async def publish_loop():
+    """Run for the worker's lifetime; snapshots of a dead worker expire after METRICS_SNAPSHOT_TTL_SECONDS"""
+    while True:
+        await run_in_threadpool(publish)
+        await asyncio.sleep(config.METRICS_PUBLISH_SECONDS)
+
+
+def worker_snapshots() -> list:
+    """Live snapshots of all workers, with this worker's taken fresh"""
+    own = snapshot()
+    others = [s for s in cache_values(NAMESPACE) if s.get("worker") != own["worker"]]
+    return [own] + sorted(others, key=lambda s: s["worker"])
+
+
+def _merge_route(stats: list) -> dict:
+    merged = {field: sum(s.get(field, 0) for s in stats) for field in _SUMMED}
+    samples = merged["wait_samples"]
+    merged["avg_wait_ms"] = round(
+        sum(s["avg_wait_ms"] * s.get("wait_samples", 0) for s in stats) / samples, 1
+    ) if samples else 0.0
+    # Percentiles do not add up across workers; report the worst worker's
+    merged["p95_wait_ms"] = max((s["p95_wait_ms"] for s in stats), default=0.0)
+    return merged
+
+
+def cluster_admission_stats(snapshots: list) -> dict:
+    routes = {}
+    for snap in snapshots:
+        for route, stats in snap["admission"].items():
+            routes.setdefault(route, []).append(stats)
+    return {
+        "workers": len(snapshots),
+        "pid": os.getpid(),
+        "routes": {route: _merge_route(stats) for route, stats in routes.items()},
+        "per_worker": {snap["worker"]: snap["admission"] for snap in snapshots},
+    }
+
+
+def cluster_upstream_states(snapshots: list) -> dict:
+    models = {}
+    for snap in snapshots:
+        for model, state in snap["upstream"].items():
+            counts = models.setdefault(model, {})
+            counts[state] = counts.get(state, 0) + 1
+    return {
+        "workers": len(snapshots),
+        "pid": os.getpid(),
+        "models": {
+            model: {"state": max(counts, key=_SEVERITY.get), "workers": counts}
+            for model, counts in models.items()
+        },
+        "per_worker": {snap["worker"]: snap["upstream"] for snap in snapshots},
+    }
+
+
+def cluster_write_behind_stats(snapshots: list) -> dict:
+    per_worker = {snap["worker"]: snap.get("write_behind", {}) for snap in snapshots}
+    return {
+        "workers": len(snapshots),
+        "pid": os.getpid(),
+        "pending": sum(stats.get("pending", 0) for stats in per_worker.values()),
+        "dead_lettered": sum(stats.get("dead_lettered", 0) for stats in per_worker.values()),
+        "dead_letter_file": str(write_queue.dead_letter_path),
+        "per_worker": per_worker,
+    }
@@ -0,0 +1,357 @@
+# write_behind.py
+import json
+import os
+import sqlite3
+import threading
+from datetime import datetime, timezone
+from pathlib import Path
+from uuid import uuid4
+
+import config
+from cache import cache_get, cache_set, make_key
+from database import (
+    execute_prepared, get_database_connection, integrity_error_reason, submission_references_exist
+)
+
+
+# Grading results and reference-audio rows are queued here and written in batches
+# off the request path. Every pending row is also kept in an append-only journal
+# so a crash or failed shutdown flush replays them on the next start. Rows the
+# database rejects outright (constraint violations) go to a dead-letter file next
+# to the journal, <stem>.dead<suffix>, for manual repair.
+
+SUBMISSION_COLUMNS = ("id", "userId", "scenarioId", "totalScore", "positive", "negative",
+                      "improvement", "status", "createdAt", "updatedAt")
+REFERENCE_AUDIO_COLUMNS = ("id", "audioScenarioId", "audioUrl", "fileFormate", "size", "createdAt")
+
+
+def _quoted(columns):
+    return ", ".join(f'"{c}"' for c in columns)
+
+
+class PostgresSink:
+    SUBMISSION_SQL = f'INSERT INTO "Submission" ({_quoted(SUBMISSION_COLUMNS)}) VALUES %s'
+    REFERENCE_AUDIO_SQL = f"""
+    INSERT INTO reference_audio ({_quoted(REFERENCE_AUDIO_COLUMNS)}) VALUES %s
+    ON CONFLICT ("audioScenarioId") DO UPDATE SET
+        "audioUrl" = EXCLUDED."audioUrl",
+        "fileFormate" = EXCLUDED."fileFormate",
+        "size" = EXCLUDED."size",
+        "createdAt" = EXCLUDED."createdAt"
+    """
+
+    @property
+    def integrity_errors(self):
+        import psycopg2
+        return (psycopg2.IntegrityError,)
+
+    PREPARED = {"Submission": "insert_submission", "reference_audio": "upsert_reference_audio"}
+
+    def references_exist(self, user_id, scenario_id):
+        return submission_references_exist(user_id, scenario_id)
+
+    def write(self, table, rows):
+        from psycopg2.extras import execute_values
+
+        sql = self.SUBMISSION_SQL if table == "Submission" else self.REFERENCE_AUDIO_SQL
+        columns = SUBMISSION_COLUMNS if table == "Submission" else REFERENCE_AUDIO_COLUMNS
+        with get_database_connection() as conn:
+            with conn:
+                with conn.cursor() as cursor:
+                    execute_values(cursor, sql, [tuple(r[c] for c in columns) for r in rows],
+                                   page_size=len(rows))
+
+    def write_one(self, table, row):
+        """Single-row write through a statement prepared once per pooled connection"""
+        columns = SUBMISSION_COLUMNS if table == "Submission" else REFERENCE_AUDIO_COLUMNS
+        with get_database_connection() as conn:
+            with conn:
+                execute_prepared(conn, self.PREPARED[table], tuple(row[c] for c in columns))
+
+
+class SQLiteSink:
+    """Local stand-in for Postgres, used for tests and offline development"""
+
+    integrity_errors = (sqlite3.IntegrityError,)
+
+    def references_exist(self, user_id, scenario_id):
+        # The stand-in has no "User"/"Scenario" tables to check against
+        return True, True
+
+    def __init__(self, path: str):
+        self.path = path
+        with sqlite3.connect(self.path) as conn:
+            conn.execute(f'CREATE TABLE IF NOT EXISTS "Submission" ({_quoted(SUBMISSION_COLUMNS)}, PRIMARY KEY ("id"))')
+            conn.execute(f'CREATE TABLE IF NOT EXISTS reference_audio ({_quoted(REFERENCE_AUDIO_COLUMNS)}, UNIQUE ("audioScenarioId"))')
+
+    def write_one(self, table, row):
+        self.write(table, [row])
+
+    def write(self, table, rows):
+        columns = SUBMISSION_COLUMNS if table == "Submission" else REFERENCE_AUDIO_COLUMNS
+        if table == "Submission":
+            statement = 'INSERT INTO "Submission"'
+        else:
+            statement = "INSERT OR REPLACE INTO reference_audio"
+        placeholders = ", ".join("?" * len(columns))
+        with sqlite3.connect(self.path) as conn:
+            conn.executemany(
+                f"{statement} ({_quoted(columns)}) VALUES ({placeholders})",
+                [tuple(r[c] for c in columns) for r in rows]
+            )
+
+
+def create_sink(backend: str):
+    if backend.startswith("sqlite:///"):
+        return SQLiteSink(backend[len("sqlite:///"):])
+    return PostgresSink()
+
+
+class WriteBehindQueue:
+    def __init__(self, sink, batch_size: int, flush_interval: float, journal_path: str):
+        self.sink = sink
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        # Each worker process journals to its own file: <stem>.<pid><suffix>
+        self.journal_base = Path(journal_path)
+        self.journal_path = self.journal_base
+        self.dead_letter_path = self.journal_base.with_name(
+            f"{self.journal_base.stem}.dead{self.journal_base.suffix}"
+        )
+        self.dead_lettered = 0
+        self._pending = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        base = self.journal_base
+        self.journal_path = base.with_name(f"{base.stem}.{os.getpid()}{base.suffix}")
+        self._replay_journal()
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the flusher and write out everything still queued"""
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout=30)
+            self._thread = None
+        self.flush()
+        with self._lock:
+            if self._pending:
+                print(f"Write-behind: {len(self._pending)} row(s) left in journal for next start")
+
+    def enqueue(self, table: str, row: dict):
+        with self._lock:
+            self._pending.append({"table": table, "row": row})
+            self._append_journal(self._pending[-1])
+            size = len(self._pending)
+        if size >= self.batch_size:
+            self._wakeup.set()
+
+    def pending_count(self) -> int:
+        with self._lock:
+            return len(self._pending)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"pending": len(self._pending), "dead_lettered": self.dead_lettered}
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                batch = self._pending[:]
+            if not batch:
+                return
+
+            written = self._write_batch(batch)
+
+            with self._lock:
+                done = {id(item) for item in written}
+                self._pending = [item for item in self._pending if id(item) not in done]
+                self._rewrite_journal()
+
+    def _write_batch(self, batch):
+        """Write a batch grouped by table; returns the items that no longer need retrying"""
+        written = []
+        for table in ("Submission", "reference_audio"):
+            items = [item for item in batch if item["table"] == table]
+            if table == "reference_audio":
+                # ON CONFLICT cannot touch the same scenario twice in one statement; keep the latest
+                latest = {item["row"]["audioScenarioId"]: item for item in items}
+                kept = {id(item) for item in latest.values()}
+                written.extend(item for item in items if id(item) not in kept)
+                items = list(latest.values())
+
+            for start in range(0, len(items), self.batch_size):
+                chunk = items[start:start + self.batch_size]
+                try:
+                    self.sink.write(table, [item["row"] for item in chunk])
+                    written.extend(chunk)
+                except self.sink.integrity_errors as e:
+                    print(f"Write-behind batch into {table} violated a constraint, retrying row by row: {e}")
+                    written.extend(self._write_rows_individually(table, chunk))
+                except Exception as e:
+                    # Connection or server problems: keep the rows queued and retry on the next tick
+                    print(f"Write-behind flush into {table} failed, will retry: {e}")
+        return written
+
+    def _write_rows_individually(self, table, items):
+        written = []
+        for item in items:
+            try:
+                self.sink.write_one(table, item["row"])
+                written.append(item)
+            except self.sink.integrity_errors as e:
+                print(f"Write-behind dead-lettering {table} row {item['row']['id']}: {integrity_error_reason(e)} ({e})")
+                self._dead_letter(item, e)
+                written.append(item)
+            except Exception as e:
+                print(f"Write-behind flush into {table} failed, will retry: {e}")
+        return written
+
+    def _dead_letter(self, item, error):
+        record = dict(item, reason=integrity_error_reason(error), error=str(error).strip(),
+                      dead_lettered_at=_now(), pid=os.getpid())
+        self.dead_letter_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.dead_letter_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+        with self._lock:
+            self.dead_lettered += 1
+
+    def _append_journal(self, item):
+        self.journal_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.journal_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(item, ensure_ascii=False) + "\n")
+            f.flush()
+
+    def _rewrite_journal(self):
+        if not self._pending:
+            if self.journal_path.exists():
+                self.journal_path.unlink()
+            return
+        tmp_path = self.journal_path.with_suffix(".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for item in self._pending:
+                f.write(json.dumps(item, ensure_ascii=False) + "\n")
+        os.replace(tmp_path, self.journal_path)
+
+    def _orphan_journals(self):
+        """Journals left behind by worker processes that are no longer running"""
+        base = self.journal_base
+        if not base.parent.exists():
+            return []
+        orphans = [base] if base.exists() else []
+        for path in base.parent.glob(f"{base.stem}.*{base.suffix}"):
+            pid = path.name[len(base.stem) + 1:-len(base.suffix) or None]
+            if not pid.isdigit():
+                continue
+            if int(pid) == os.getpid():
+                orphans.append(path)
+                continue
+            try:
+                os.kill(int(pid), 0)
+            except ProcessLookupError:
+                orphans.append(path)
+            except PermissionError:
+                pass
+        return orphans
+
+    def _replay_journal(self):
+        items = []
+        for path in self._orphan_journals():
+            # Renaming claims the file atomically, so two starting workers never replay it twice
+            claimed = path.with_name(f"{path.name}.{os.getpid()}.claimed")
+            try:
+                os.rename(path, claimed)
+            except FileNotFoundError:
+                continue
+            with open(claimed, encoding="utf-8") as f:
+                items.extend(json.loads(line) for line in f if line.strip())
+            claimed.unlink()
+
+        if not items:
+            return
+        with self._lock:
+            self._pending = items + self._pending
+            self._rewrite_journal()
+        print(f"Write-behind: replaying {len(items)} row(s) from previous journals")
+
+
+def _now():
+    return datetime.now(timezone.utc).isoformat()
+
+
+write_queue = WriteBehindQueue(
+    create_sink(config.WRITE_BEHIND_BACKEND),
+    batch_size=config.WRITE_BEHIND_BATCH_SIZE,
+    flush_interval=config.WRITE_BEHIND_FLUSH_INTERVAL_SECONDS,
+    journal_path=config.WRITE_BEHIND_JOURNAL_PATH
+)
+
+
+def verify_submission_references(user_id, scenario_id) -> bool:
+    """Raise ValueError if the user or scenario does not exist, so the client gets a 400
+    instead of an id for a row that would be dead-lettered.
+
+    Returns False when the database cannot be reached: the row is still queued (the
+    queue retries until the database is back) but could not be checked.
+    """
+    key = make_key(user_id, scenario_id)
+    if cache_get("submission_references", key):
+        return True
+    try:
+        user_exists, scenario_exists = write_queue.sink.references_exist(user_id, scenario_id)
+    except Exception as e:
+        print(f"Submission reference check skipped, database unavailable: {e}")
+        return False
+    if not user_exists:
+        raise ValueError("User not found - invalid user ID provided")
+    if not scenario_exists:
+        raise ValueError("Scenario not found - invalid scenario ID provided")
+    cache_set("submission_references", key, True, ttl=config.SUBMISSION_REFERENCE_CACHE_SECONDS)
+    return True
+
+
+def enqueue_submission(user_id, scenario_id, total_score, positives_str, negatives_str, improvements_str) -> str:
+    """Queue a grading result for batched insert into "Submission" and return its id"""
+    submission_id = str(uuid4())
+    now = _now()
+    write_queue.enqueue("Submission", {
+        "id": submission_id,
+        "userId": user_id,
+        "scenarioId": scenario_id,
+        "totalScore": total_score,
+        "positive": positives_str,
+        "negative": negatives_str,
+        "improvement": improvements_str,
+        "status": "COMPLETED",
+        "createdAt": now,
+        "updatedAt": now,
+    })
+    return submission_id
+
+
+def enqueue_reference_audio(scenario_id, audio_url, audio_format, audio_size) -> str:
+    """Queue a reference audio upsert keyed by scenario"""
+    audio_id = str(uuid4())
+    write_queue.enqueue("reference_audio", {
+        "id": audio_id,
+        "audioScenarioId": scenario_id,
+        "audioUrl": audio_url,
+        "fileFormate": audio_format,
+        "size": audio_size,
+        "createdAt": _now(),
+    })
+    return audio_id